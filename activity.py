@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from dataTypes import TelegramUser
+from database import run_db
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL: float = 10  # seconds between two writes of the buffered activity
+MAX_PENDING: int = 5000  # flush earlier if this many users are waiting
+KNOWN_LIMIT: int = 200_000  # how many existing user ids are remembered, to skip the existence check
+UPSERT_BATCH: int = 500  # rows per statement, keeps clear of SQLite's bound parameters limit
+
+
+def _snapshot(user) -> dict:
+    return {
+        "id": user.id,
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "language_code": user.language_code,
+        "last_seen": datetime.datetime.now(),
+    }
+
+
+def _create_user(session: Session, user) -> bool:
+    """Insert the user if it doesn't exist yet; returns whether it was inserted"""
+    t = TelegramUser.from_user(user)
+    result = session.execute(insert(TelegramUser).values(
+        id=t.id, username=t.username, first_name=t.first_name, last_name=t.last_name,
+        language_code=t.language_code, last_seen=t.last_seen, monthly=t.monthly, weekly=t.weekly, dailiy=t.dailiy,
+        schedule_changed=t.schedule_changed,
+    ).on_conflict_do_nothing(index_elements=[TelegramUser.id]))
+    return result.rowcount == 1
+
+
+def _upsert_users(session: Session, rows: list[dict]) -> None:
+    for i in range(0, len(rows), UPSERT_BATCH):
+        statement = insert(TelegramUser).values(rows[i:i + UPSERT_BATCH])
+        session.execute(statement.on_conflict_do_update(
+            index_elements=[TelegramUser.id],
+            set_={key: statement.excluded[key] for key in rows[0] if key != "id"},
+        ))
+
+
+class ActivityBuffer:
+    """Collects the activity of the users in memory and writes it to the database in batches
+
+    Every message used to update the user row on its own; now pings of the same user are merged and written at most
+    once every `interval` seconds, with a single statement per batch. Only the first ping of a user that is not in
+    the database yet is written immediately, so that the rest of the bot can rely on the user row existing.
+    """
+
+    def __init__(self, interval: float = FLUSH_INTERVAL, max_pending: int = MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: dict[int, dict] = {}
+        self._known: set[int] = set()
+        self._task: asyncio.Task | None = None
+        self._flushing: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def ping(self, user) -> bool:
+        """Record the activity of a telegram User; returns whether the user is new"""
+        self._pending[user.id] = _snapshot(user)
+        if len(self._pending) >= self.max_pending and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.create_task(self.flush())
+        if user.id in self._known:
+            return False
+        new_user = await run_db(_create_user, user)
+        if len(self._known) >= KNOWN_LIMIT:
+            self._known.clear()  # they will be checked again, once
+        self._known.add(user.id)
+        return new_user
+
+    async def flush(self) -> None:
+        """Write all the pending activity"""
+        if not self._pending:
+            return
+        rows, self._pending = list(self._pending.values()), {}
+        try:
+            await run_db(_upsert_users, rows)
+        except Exception:
+            logger.exception("Could not write the activity of %d users", len(rows))
+            for row in rows:  # try again next time, unless there is something newer
+                self._pending.setdefault(row["id"], row)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush, and write what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,190 @@
+"""Benchmark of the bot handlers and of the reminder run on a synthetic database
+
+    python -m benchmarks.bench --users 100000 --json results.json [--compare previous.json]
+
+Updates are fed through the real Application (so routing is part of the measure), against the fake Bot API.
+For every scenario the wall time, the latency percentiles and the SQL queries per call are reported, together with
+the peak RSS of the process. The fixture database is generated on the first run and then reused.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.fixtures import generate, FIRST_USER_ID
+from logconfig import setup_logging
+from migrations import upgrade
+
+_update_ids = itertools.count(1)
+
+
+class QueryCounter:
+    """Counts the SQL statements executed through some engines, and the time spent in them"""
+
+    def __init__(self, *engines):
+        from sqlalchemy import event
+
+        self.count = 0
+        self.seconds = 0.0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._before)
+            event.listen(engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.seconds += time.perf_counter() - conn.info["query_started"].pop()
+
+
+def message_update(bot, user_id: int, text: str):
+    from telegram import Update
+
+    data = {"update_id": next(_update_ids), "message": {
+        "message_id": next(_update_ids), "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "en"}}}
+    if text.startswith("/"):
+        data["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return Update.de_json(data, bot)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def measure(name: str, calls, counter: QueryCounter) -> dict:
+    """Await every coroutine factory in `calls`, one after the other, and summarize"""
+    latencies = []
+    queries = counter.count
+    started = time.perf_counter()
+    for call in calls:
+        t = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - t)
+    wall = time.perf_counter() - started
+    result = {
+        "calls": len(latencies),
+        "wall_s": round(wall, 4),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "queries_per_call": round((counter.count - queries) / max(1, len(latencies)), 2),
+    }
+    print(f"{name:>16}: {json.dumps(result)}", file=sys.stderr)
+    return result
+
+
+async def run(args: argparse.Namespace) -> dict:
+    import database
+    import main
+    import reminders
+    from benchmarks.fake_bot_api import FakeBotAPI
+    from sender import Broadcaster
+
+    upgrade(database.engine)  # fixtures generated by an older revision
+    counter = QueryCounter(database.get_engine(), database.get_read_engine())
+    rng = random.Random(args.seed)
+    sample = [FIRST_USER_ID + rng.randrange(args.users) for _ in range(args.calls)]
+    results = {}
+    async with FakeBotAPI() as api:
+        application = main.build_application("123456:fake", base_url=api.base_url)
+        async with application:
+            bot = application.bot
+            results["db_user_ping"] = await measure(
+                "db_user_ping", [lambda u=u: main.db_user_ping(message_update(bot, u, "hi")) for u in sample], counter)
+            results["main_menu"] = await measure(
+                "main_menu", [lambda u=u: main.main_menu(u) for u in sample], counter)
+            results["start"] = await measure(
+                "start", [lambda u=u: application.process_update(message_update(bot, u, "/start")) for u in sample],
+                counter)
+            results["list_birthday"] = await measure(
+                "list_birthday", [lambda u=u: application.process_update(message_update(bot, u, "🎂📒 List Birthdays"))
+                                  for u in sample], counter)
+            # the whole daily run, as if every user was due at once
+            broadcaster = Broadcaster(bot, workers=64, global_rate=0, per_chat_rate=0)
+            today = datetime.date.today()
+            due = [(FIRST_USER_ID + i, today) for i in range(args.users)]
+            with database.engine.begin() as conn:  # as if today was never planned
+                conn.exec_driver_sql("UPDATE user SET reminded_on = NULL")
+                conn.exec_driver_sql("DELETE FROM outbox")
+            sent = len(api.sent)
+            results["report"] = await measure("report", [lambda: reminders.report(broadcaster, due)], counter)
+            results["report"]["messages"] = len(api.sent) - sent
+            await main.activity.stop()
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, previous: dict) -> None:
+    """Print the relative change of the main figures against a previous run"""
+    for name, result in current["results"].items():
+        before = previous.get("results", {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ("wall_s", "p50_ms", "p99_ms", "queries_per_call"):
+            if before.get(key):
+                changes.append(f"{key} {100 * (result[key] - before[key]) / before[key]:+.1f}%")
+        print(f"{name:>16}: " + ", ".join(changes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="1000, 100000, 1000000, ...")
+    parser.add_argument("--db", help="fixture database, generated if missing (default bench-<users>.db)")
+    parser.add_argument("--calls", type=int, default=500, help="calls per handler scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="a previous results file to compare with")
+    args = parser.parse_args()
+
+    path = args.db or f"bench-{args.users}.db"
+    fixture = None
+    if not os.path.exists(path):
+        fixture = generate(path, args.users, args.seed)
+        print("Generated", fixture, file=sys.stderr)
+    os.environ["DATABASE_URL"] = f"sqlite+pysqlite:///{os.path.abspath(path)}"
+    setup_logging(level="WARNING")  # LOG_LEVELS and LOG_SAMPLING apply, to measure their cost
+
+    results = asyncio.run(run(args))
+    output = {
+        "meta": {"users": args.users, "calls": args.calls, "revision": git_revision(),
+                 "date": datetime.datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0]},
+        "fixture": fixture,
+        "results": results,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    json.dump(output, sys.stdout, indent=2)
+    print()
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(output, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(output, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
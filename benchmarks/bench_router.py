@@ -0,0 +1,92 @@
+"""Micro-benchmark of the routing of keyboard buttons: the regex handler chain against the ButtonRouter
+
+    python -m benchmarks.bench_router [--extra 0 50 200] [--rounds 20000]
+
+Only the routing is measured, i.e. what the Application does for a text update before calling a callback: going
+through the handlers of the group in order until one of them accepts the update. `--extra` adds that many made up
+buttons, to show how the cost grows with the number of buttons.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+
+from telegram import Bot
+from telegram.ext import MessageHandler, filters
+
+from benchmarks.bench import message_update
+from router import ButtonRouter
+
+# the labels of the bot, in the order their handlers used to be registered
+LABELS = ["🎂📒 List Birthdays", "🏠 Home", "🗑️ Delete", "📝 Edit", "✅ Yes, delete", "🔔 Set reminders", "ℹ️ About",
+          "✅ Weekly", "❌ Weekly", "✅ Daily", "❌ Daily", "✅ Monthly", "❌ Monthly"]
+
+
+async def _noop(update, context):
+    pass
+
+
+def regex_chain(labels: list[str]) -> list:
+    handlers = [MessageHandler(filters.Regex(label), _noop) for label in labels[:5]]
+    handlers.append(MessageHandler(filters.Regex(r"^(/view_bd_[\d]+)$"), _noop))
+    handlers += [MessageHandler(filters.Regex(label), _noop) for label in labels[5:]]
+    return handlers
+
+
+def router(labels: list[str]) -> list:
+    buttons = ButtonRouter()
+    for label in labels:
+        buttons.add(label, _noop)
+    buttons.add_prefix("/view_bd_", _noop)
+    return [buttons]
+
+
+def route(handlers: list, update) -> bool:
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            return True
+    return False
+
+
+def time_routing(handlers: list, updates: list, rounds: int) -> float:
+    """Nanoseconds per routed update"""
+    started = time.perf_counter_ns()
+    for _ in range(rounds):
+        for update in updates:
+            route(handlers, update)
+    return (time.perf_counter_ns() - started) / (rounds * len(updates))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--extra", type=int, nargs="+", default=[0, 50, 200], help="made up buttons to add")
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    bot = Bot("123456:fake")
+    results = {}
+    for extra in args.extra:
+        labels = LABELS + [f"🔘 Button {i:04d}" for i in range(extra)]
+        cases = {
+            "first": [message_update(bot, 1, labels[0])],
+            "last": [message_update(bot, 1, labels[-1])],
+            "view_bd": [message_update(bot, 1, "/view_bd_123")],
+            "miss": [message_update(bot, 1, "some free text")],
+        }
+        results[len(labels)] = row = {}
+        for case, updates in cases.items():
+            chain_ns = time_routing(regex_chain(labels), updates, args.rounds)
+            router_ns = time_routing(router(labels), updates, args.rounds)
+            row[case] = {"regex_ns": round(chain_ns), "router_ns": round(router_ns),
+                         "speedup": round(chain_ns / router_ns, 1)}
+            print(f"{len(labels):>4} buttons {case:>8}: regex {chain_ns:9.0f} ns, router {router_ns:6.0f} ns",
+                  file=sys.stderr)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Latency of /find on a user with a large address book, among many other users
+
+    python -m benchmarks.bench_search --entries 50000 --others 500000
+
+The database is built in a scratch file through the migrations, so the search index is filled by its triggers as
+it would be by the bot. Every kind of search (whole word, prefix, typo, no match) is timed on the big user and on a
+user with a handful of birthdays.
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from dataTypes import Birthday, TelegramUser
+from migrations import upgrade
+from search import search_birthdays
+
+FIRST_NAMES = ["Mario", "Giovanni", "Anna", "Annalisa", "José", "Luca", "Marco", "Francesca", "Giulia", "Paolo",
+               "Maria", "Mariangela", "Sofia", "Alessandro", "Chiara", "Lorenzo", "Elena", "Matteo", "Sara", "Davide"]
+LAST_NAMES = ["Rossi", "Bianchi", "Verdi", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno",
+              "Gallo", "Conti", "De Luca", "Mancini", "Costa", "Giordano", "Rizzo", "Lombardi", "Moretti", "García"]
+QUERIES = {
+    "word": ["mario", "rossi", "anna", "marco verdi"],
+    "prefix": ["mar", "gio", "ann", "fran", "esp"],
+    "typo": ["giovani", "esposto", "franceska", "lorezno"],
+    "none": ["zzz", "qwerty"],
+}
+BIG_USER, SMALL_USER, FIRST_OTHER = 1, 2, 10
+
+
+def build(path: str, entries: int, others: int, seed: int) -> None:
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite+pysqlite:///{path}")
+    upgrade(engine)
+    users = others // 10 + 1
+    with Session(engine) as session:
+        session.execute(insert(TelegramUser.__table__),
+                        [{"id": i, "first_name": f"U{i}"} for i in (BIG_USER, SMALL_USER)] +
+                        [{"id": FIRST_OTHER + i, "first_name": f"U{i}"} for i in range(users)])
+        rows = [(BIG_USER, i) for i in range(entries)] + [(SMALL_USER, i) for i in range(8)] + \
+               [(FIRST_OTHER + rng.randrange(users), i) for i in range(others)]
+        for i in range(0, len(rows), 10_000):
+            session.execute(insert(Birthday.__table__), [
+                {"user_id": user_id, "first_name": f"{rng.choice(FIRST_NAMES)}{'' if n % 4 else n}",
+                 "last_name": rng.choice(LAST_NAMES), "birth": datetime.datetime(1990, 1, 1), "birth_md": 101,
+                 "is_anniversary": False} for user_id, n in rows[i:i + 10_000]])
+        session.commit()
+    engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=50_000, help="birthdays of the big user")
+    parser.add_argument("--others", type=int, default=500_000, help="birthdays of the other users")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of every query")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "search.db")
+        started = time.perf_counter()
+        build(path, args.entries, args.others, args.seed)
+        print(f"built in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        engine = create_engine(f"sqlite+pysqlite:///{path}")
+        results = {}
+        with Session(engine) as session:
+            for user_id, user in ((BIG_USER, "big"), (SMALL_USER, "small")):
+                for kind, queries in QUERIES.items():
+                    latencies, found = [], 0
+                    for query in queries:
+                        for _ in range(args.repeat):
+                            start = time.perf_counter()
+                            found = len(search_birthdays(session, user_id, query))
+                            latencies.append(time.perf_counter() - start)
+                            session.expunge_all()
+                    latencies.sort()
+                    results[f"{user}_{kind}"] = {"p50_ms": round(statistics.median(latencies) * 1000, 2),
+                                                 "max_ms": round(latencies[-1] * 1000, 2), "last_found": found}
+        engine.dispose()
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Throughput of the reminder fan-out against the fake Bot API
+
+    python -m benchmarks.bench_sender --recipients 100000 --global-rate 0
+
+Prints the messages per second and the total run time, and with --json writes them to a file.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from benchmarks.fake_bot_api import FakeBotAPI
+from sender import Broadcaster, Delivery, OutgoingMessage
+
+
+def deliveries(recipients: int, messages: int):
+    for chat_id in range(1, recipients + 1):
+        yield Delivery(chat_id, [OutgoingMessage("*Birthdays today*\n", "Markdown")] +
+                       [OutgoingMessage(f"John Doe {i} - 1/1/1990, 35 anni\n") for i in range(messages - 1)])
+
+
+async def run(args: argparse.Namespace) -> dict:
+    async with FakeBotAPI(latency=args.latency, global_limit=args.api_global_limit,
+                          per_chat_limit=args.api_per_chat_limit) as api:
+        request = HTTPXRequest(connection_pool_size=args.workers, pool_timeout=30)
+        async with Bot("123456:fake", base_url=api.base_url, request=request) as bot:
+            broadcaster = Broadcaster(bot, workers=args.workers, global_rate=args.global_rate,
+                                      per_chat_rate=args.per_chat_rate)
+            stats = await broadcaster.broadcast(deliveries(args.recipients, args.messages))
+        return {
+            "recipients": args.recipients,
+            "workers": args.workers,
+            "sent": stats.sent,
+            "failed": stats.failed,
+            "retries": stats.retries,
+            "rate_limited": stats.rate_limited,
+            "api_rejected": api.rejected,
+            "elapsed_s": round(stats.elapsed, 3),
+            "messages_per_s": round(stats.throughput, 1),
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipients", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=2, help="messages per recipient, header included")
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake API latency in seconds")
+    parser.add_argument("--global-rate", type=float, default=0, help="client side global limit, 0 for none")
+    parser.add_argument("--per-chat-rate", type=float, default=0, help="client side per-chat limit, 0 for none")
+    parser.add_argument("--api-global-limit", type=int, default=0, help="429 above this many messages/s")
+    parser.add_argument("--api-per-chat-limit", type=int, default=0, help="429 above this many messages/s per chat")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
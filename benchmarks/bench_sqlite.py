@@ -0,0 +1,165 @@
+"""Concurrent read/write throughput of the database, with SQLite's defaults and with the tuned connections
+
+    python -m benchmarks.bench_sqlite --users 10000 --readers 4 --writers 2 --seconds 10
+
+Writers add birthdays and change reminder settings like the handlers do, a short transaction each; readers page
+through the birthday lists of random users; a planner reads the reminder plans of batches of users, the long reads
+of the reminder run. They all run at once, on a fresh copy of the fixture database for every configuration:
+
+    default   how the bot connected before: rollback journal, a sync per commit, one engine for everything
+    tuned     database.make_engine: WAL, synchronous=NORMAL, mmap, and read-only connections for the readers
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from benchmarks.fixtures import generate, FIRST_USER_ID
+from database import make_engine, insert_birthday, set_reminder, upcoming_birthdays
+from migrations import upgrade
+from planner import plan_reminders, USER_BATCH
+
+CONFIGURATIONS = ("default", "tuned")
+
+
+def copy_database(source: str, target: str, journal_mode: str) -> None:
+    """Copy the fixture (consistently, even if it is in WAL mode) and set the journal mode of the copy"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    src.backup(dst)
+    dst.execute(f"PRAGMA journal_mode={journal_mode}")
+    src.close()
+    dst.close()
+
+
+def engines(configuration: str, path: str, readers: int, writers: int):
+    url = f"sqlite+pysqlite:///{path}"
+    if configuration == "default":
+        engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 15})
+        return engine, engine
+    return make_engine(url, writers), make_engine(url, readers + 1, read_only=True)
+
+
+class Worker(threading.Thread):
+    """Runs `operation(session, rng)` in a loop until `deadline`, one session (and commit) per call"""
+
+    def __init__(self, kind: str, engine, operation, seed: int, start: threading.Event, deadline: list[float]):
+        super().__init__(daemon=True)
+        self.kind = kind
+        self.engine = engine
+        self.operation = operation
+        self.rng = random.Random(seed)
+        self.start_event = start
+        self.deadline = deadline
+        self.latencies: list[float] = []
+        self.errors = 0
+
+    def run(self) -> None:
+        self.start_event.wait()
+        while time.perf_counter() < self.deadline[0]:
+            started = time.perf_counter()
+            try:
+                with Session(self.engine, expire_on_commit=False) as session:
+                    self.operation(session, self.rng)
+                    session.commit()
+            except OperationalError:  # database is locked: the busy timeout ran out
+                self.errors += 1
+                continue
+            self.latencies.append(time.perf_counter() - started)
+
+
+def measure(configuration: str, fixture: str, args: argparse.Namespace) -> dict:
+    path = os.path.join(args.scratch, f"bench-sqlite-{configuration}.db")
+    copy_database(fixture, path, "DELETE" if configuration == "default" else "WAL")
+    writer, reader = engines(configuration, path, args.readers, args.writers)
+    today = datetime.date.today()
+
+    def user(rng: random.Random) -> int:
+        return FIRST_USER_ID + rng.randrange(args.users)
+
+    def write(session: Session, rng: random.Random) -> None:
+        if rng.random() < 0.5:
+            insert_birthday(session, user(rng), "Bench", str(rng.randrange(10 ** 6)), datetime.datetime(1990, 1, 1))
+        else:
+            set_reminder(session, user(rng), "weekly", rng.random() < 0.5)
+
+    def read(session: Session, rng: random.Random) -> None:
+        upcoming_birthdays(session, user(rng), today, 0, 10)
+
+    def plan(session: Session, rng: random.Random) -> None:
+        first = rng.randrange(max(1, args.users - USER_BATCH))
+        plan_reminders(session, today, range(FIRST_USER_ID + first, FIRST_USER_ID + first + USER_BATCH))
+
+    start, deadline = threading.Event(), [0.0]
+    workers = [Worker("write", writer, write, i, start, deadline) for i in range(args.writers)]
+    workers += [Worker("read", reader, read, 100 + i, start, deadline) for i in range(args.readers)]
+    workers.append(Worker("plan", reader, plan, 1000, start, deadline))
+    for worker in workers:
+        worker.start()
+    deadline[0] = time.perf_counter() + args.seconds
+    start.set()
+    for worker in workers:
+        worker.join()
+    writer.dispose()
+    reader.dispose()
+
+    result = {}
+    for kind in ("write", "read", "plan"):
+        latencies = sorted(x for w in workers if w.kind == kind for x in w.latencies)
+        result[kind] = {
+            "ops_per_s": round(len(latencies) / args.seconds, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+            "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+            "locked_errors": sum(w.errors for w in workers if w.kind == kind),
+        }
+    print(f"{configuration:>8}: {json.dumps(result)}", file=sys.stderr)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--db", help="fixture database, generated if missing (default bench-<users>.db)")
+    parser.add_argument("--readers", type=int, default=4, help="threads paging through birthday lists")
+    parser.add_argument("--writers", type=int, default=2, help="threads writing, like the handlers")
+    parser.add_argument("--seconds", type=float, default=10.0, help="duration of every configuration")
+    parser.add_argument("--scratch", default=tempfile.gettempdir(), help="where the copies of the fixture go")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    fixture = args.db or f"bench-{args.users}.db"
+    if not os.path.exists(fixture):
+        print("Generated", generate(fixture, args.users), file=sys.stderr)
+    upgrade(create_engine(f"sqlite+pysqlite:///{fixture}"))  # fixtures generated by an older revision
+
+    results = {configuration: measure(configuration, fixture, args) for configuration in CONFIGURATIONS}
+    for kind in ("write", "read", "plan"):
+        before, after = results["default"][kind]["ops_per_s"], results["tuned"][kind]["ops_per_s"]
+        if before:
+            print(f"{kind:>8}: {after / before:.2f}x the operations per second", file=sys.stderr)
+    output = {"users": args.users, "readers": args.readers, "writers": args.writers, "sqlite": sqlite3.sqlite_version,
+              "results": results}
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(output, file, indent=2)
+    json.dump(output, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Startup cost of the entry points: time, memory and modules of a fresh interpreter importing each of them
+
+    python -m benchmarks.bench_startup --repeat 5
+    python -m benchmarks.bench_startup --check     # exit status 1 if a headless entry point imports too much
+
+Every entry point is imported in its own interpreter, `--repeat` times, and the best time is kept. With `--check`,
+the headless entry points must not import what they do not need (FORBIDDEN) nor create the database engine. The
+check is on the modules rather than on the times, which are too noisy to fail a build on: SQLAlchemy and, for the
+workers, python-telegram-bot are most of what is left, and they are needed.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ENTRY_POINTS = {
+    "bot": "main",
+    "reminders": "workers",
+    "maintenance": "maintenance",
+}
+# what the headless entry points must not import: the handlers of the bot, and for the maintenance telegram at all
+FORBIDDEN = {
+    "reminders": ("main", "telegram.ext", "router", "persistence", "webhook", "importer", "export"),
+    "maintenance": ("main", "telegram", "sender", "workers"),
+}
+
+PROBE = """
+import json, resource, sys, time
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+import database
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline,
+    "modules": len(sys.modules),
+    "loaded": [name for name in {forbidden!r} if name in sys.modules],
+    "engine": database._engine is not None,
+}}))
+"""
+
+
+def probe(module: str, forbidden: tuple[str, ...]) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", PROBE.format(module=module, forbidden=forbidden)], cwd=root,
+                            check=True, capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=root)).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(repeat: int) -> dict:
+    results = {}
+    for name, module in ENTRY_POINTS.items():
+        runs = [probe(module, FORBIDDEN.get(name, ())) for _ in range(repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        results[name] = {"module": module, "import_ms": round(best["seconds"] * 1000, 1),
+                         "rss_mb": round(best["rss_kb"] / 1024, 1), "modules": best["modules"],
+                         "forbidden_imports": best["loaded"], "engine_created": best["engine"]}
+    return results
+
+
+def check(results: dict) -> list[str]:
+    problems = []
+    for name, result in results.items():
+        if result["forbidden_imports"]:
+            problems.append(f"{name} imports {', '.join(result['forbidden_imports'])}")
+        if result["engine_created"]:
+            problems.append(f"{name} creates the database engine at import")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="interpreters started per entry point")
+    parser.add_argument("--check", action="store_true", help="fail if a headless entry point is too heavy")
+    args = parser.parse_args()
+
+    results = measure(args.repeat)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if args.check:
+        problems = check(results)
+        for problem in problems:
+            print("FAIL:", problem, file=sys.stderr)
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
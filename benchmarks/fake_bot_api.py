@@ -0,0 +1,161 @@
+"""A local stand-in for the Telegram Bot API, to benchmark the bot without touching the network
+
+It answers the methods the bot uses with plausible results, with a configurable latency, and can emulate Telegram's
+flood control by answering 429 with a `retry_after` when the global or per-chat rate is exceeded.
+
+Point a Bot to it with `Bot(token, base_url=api.base_url)`.
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import itertools
+import json
+import re
+import time
+import urllib.parse
+
+from httpserver import Request, Response, serve
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Birthday bot", "username": "fake_birthday_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class FakeBotAPI:
+    """Fake Bot API server
+
+    Args:
+        latency (float): Seconds each call takes
+        global_limit (int): Messages per second accepted for the whole bot before answering 429, 0 for no limit
+        per_chat_limit (int): Messages per second accepted for a single chat before answering 429, 0 for no limit
+        retry_after (int): The `retry_after` sent with a 429
+    """
+
+    def __init__(self, latency: float = 0.0, global_limit: int = 0, per_chat_limit: int = 0, retry_after: int = 1):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.per_chat_limit = per_chat_limit
+        self.retry_after = retry_after
+        self.calls: collections.Counter = collections.Counter()
+        self.rejected = 0
+        self.sent: list[tuple[float, int, str]] = []  # (time, chat_id, text) of every accepted message
+        self.files: dict[str, bytes] = {}  # file_id: content, served to getFile and the downloads
+        self._message_ids = itertools.count(1)
+        self._window = 0
+        self._window_global = 0
+        self._window_chats: collections.Counter = collections.Counter()
+        self._server: asyncio.Server | None = None
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self, port: int = 0) -> None:
+        self._server = await serve(self.handle, "127.0.0.1", port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def __aenter__(self) -> FakeBotAPI:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    def _throttled(self, chat_id: int) -> bool:
+        """Fixed one second windows, good enough to see whether the client respects the limits"""
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window = window
+            self._window_global = 0
+            self._window_chats.clear()
+        if self.global_limit and self._window_global >= self.global_limit:
+            return True
+        if self.per_chat_limit and self._window_chats[chat_id] >= self.per_chat_limit:
+            return True
+        self._window_global += 1
+        self._window_chats[chat_id] += 1
+        return False
+
+    @staticmethod
+    def _params(request: Request) -> dict:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(request.body or b"{}")
+        if content_type.startswith("multipart/form-data"):  # uploads, the files are returned as bytes
+            boundary = content_type.split("boundary=", 1)[-1].strip('"').encode()
+            params = {}
+            for part in request.body.split(b"--" + boundary)[1:-1]:
+                head, _, value = part.partition(b"\r\n\r\n")
+                name = re.search(rb'name="([^"]*)"', head)
+                if name is not None:
+                    value = value[:-2]  # the CRLF before the next boundary
+                    params[name.group(1).decode()] = value if b"filename=" in head else value.decode()
+            return params
+        params = {}
+        for key, value in urllib.parse.parse_qsl(request.body.decode()):
+            try:  # complex parameters are json encoded
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    @staticmethod
+    def _ok(result) -> Response:
+        return Response(200, json.dumps({"ok": True, "result": result}).encode(), "application/json")
+
+    def _message(self, chat_id: int, **extra) -> dict:
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, **extra}
+
+    async def handle(self, request: Request) -> Response:
+        if request.path.startswith("/file/"):  # /file/bot<token>/<file_path>
+            content = self.files.get(request.path.rsplit("/", 1)[-1])
+            return Response(404) if content is None else Response(200, content, "application/octet-stream")
+        method = request.path.rsplit("/", 1)[-1]
+        self.calls[method] += 1
+        params = self._params(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method in ("sendMessage", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            if self._throttled(chat_id):
+                self.rejected += 1
+                return Response(429, json.dumps({
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry later",
+                    "parameters": {"retry_after": self.retry_after}}).encode(), "application/json")
+            text = str(params.get("text", ""))
+            self.sent.append((time.monotonic(), chat_id, text))
+            if method == "sendDocument":
+                document = params.get("document")
+                if isinstance(document, bytes):  # an upload, can be downloaded back by file id
+                    file_id = f"fake-{len(self.sent)}"
+                    self.files[file_id] = document
+                else:
+                    file_id = str(document)
+                return self._ok(self._message(chat_id, document={"file_id": file_id, "file_unique_id": file_id}))
+            return self._ok(self._message(chat_id, text=text))
+        if method == "editMessageText":
+            return self._ok(self._message(int(params.get("chat_id", 0)), text=str(params.get("text", ""))))
+        if method == "getFile":
+            file_id = str(params.get("file_id", ""))
+            if file_id not in self.files:
+                return Response(400, json.dumps({"ok": False, "error_code": 400,
+                                                 "description": "Bad Request: invalid file_id"}).encode(),
+                                "application/json")
+            return self._ok({"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]),
+                             "file_path": file_id})
+        if method == "getUpdates":
+            await asyncio.sleep(min(float(params.get("timeout", 0) or 0), 1.0))
+            return self._ok([])
+        if method in ("answerCallbackQuery", "setWebhook", "deleteWebhook", "setMyCommands", "close", "logOut"):
+            return self._ok(True)
+        return Response(404, json.dumps({"ok": False, "error_code": 404, "description": "Not Found"}).encode(),
+                        "application/json")
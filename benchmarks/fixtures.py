@@ -0,0 +1,92 @@
+"""Synthetic database fixtures for the benchmarks
+
+    python -m benchmarks.fixtures --users 100000 --out bench-100k.db
+
+The users have a heavy-tailed number of birthdays (most have a handful, a few have thousands), birth years around
+1990 and a slightly seasonal distribution of birth months, so that the per-day reminder load looks like a real one.
+"""
+from __future__ import annotations
+
+import argparse
+import calendar
+import datetime
+import os
+import random
+import sqlite3
+import time
+
+from sqlalchemy import create_engine
+
+from migrations import upgrade
+
+# relative frequency of births per month (northern hemisphere, summer/early autumn peak)
+MONTH_WEIGHTS = [0.95, 0.9, 0.97, 0.95, 1.0, 1.0, 1.06, 1.08, 1.08, 1.03, 0.97, 1.0]
+TIMEZONES = [None, None, None, "Europe/Rome", "Europe/London", "America/New_York", "Asia/Kolkata", "Asia/Tokyo"]
+MAX_BIRTHDAYS: int = 5000
+FIRST_USER_ID: int = 10_000_000
+BATCH: int = 50_000
+
+
+def birthdays_per_user(rng: random.Random) -> int:
+    return min(MAX_BIRTHDAYS, int(rng.lognormvariate(1.5, 1.0)))
+
+
+def birth_date(rng: random.Random) -> datetime.date:
+    year = min(2020, max(1925, int(rng.gauss(1990, 15))))
+    month = rng.choices(range(1, 13), MONTH_WEIGHTS)[0]
+    day = rng.randint(1, calendar.monthrange(year, month)[1])  # 29 February happens, in leap years
+    return datetime.date(year, month, day)
+
+
+def generate(path: str, users: int, seed: int = 42) -> dict:
+    """Create the database at `path` with `users` users and their birthdays; returns some figures about it"""
+    if os.path.exists(path):
+        os.remove(path)
+    upgrade(create_engine(f"sqlite+pysqlite:///{path}"))
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+    user_rows, birthday_rows = [], []
+    total_birthdays = 0
+
+    def write():
+        conn.executemany("INSERT INTO user (id, username, first_name, last_name, language_code, last_seen, monthly, "
+                         "weekly, dailiy, timezone, remind_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", user_rows)
+        conn.executemany("INSERT INTO birthday (first_name, last_name, birth, user_id, is_anniversary, birth_md) "
+                         "VALUES (?, ?, ?, ?, 0, ?)", birthday_rows)
+        user_rows.clear()
+        birthday_rows.clear()
+
+    for i in range(users):
+        user_id = FIRST_USER_ID + i
+        user_rows.append((user_id, f"user{i}", f"User{i}", None, "en", now, rng.random() < 0.8, rng.random() < 0.7,
+                          rng.random() < 0.9, rng.choice(TIMEZONES), None))
+        for j in range(birthdays_per_user(rng)):
+            birth = birth_date(rng)
+            birthday_rows.append((f"Friend{j}", f"Of{i}", birth.strftime("%Y-%m-%d 00:00:00.000000"), user_id,
+                                  birth.month * 100 + birth.day))
+        if len(birthday_rows) >= BATCH:
+            total_birthdays += len(birthday_rows)
+            write()
+    total_birthdays += len(birthday_rows)
+    write()
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    return {"users": users, "birthdays": total_birthdays, "seconds": round(time.perf_counter() - started, 2)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--out", default="bench.db")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    print(generate(args.out, args.users, args.seed))
+
+
+if __name__ == "__main__":
+    main()
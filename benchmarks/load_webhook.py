@@ -0,0 +1,155 @@
+"""Load generator for the webhook mode: POSTs synthetic updates to the ingestion server, no network involved
+
+    python -m benchmarks.load_webhook --users 10000 --updates 20000 --connections 32 --concurrency 64
+
+The bot runs in process against the fake Bot API and a fixture database (generated on the first run, as for
+benchmarks.bench). Every connection posts its updates one after the other, like Telegram does with up to
+`max_connections` connections. Reported:
+
+- ingest: how fast the updates are acknowledged by the webhook (what Telegram sees)
+- end to end: from the POST of an update to the reply received by the fake Bot API, which is why the default text
+  is a button answered with exactly one message
+
+With `--abusers 5 --abuse-share 0.5`, half of the updates come from 5 users pressing the button over and over: the
+end-to-end figures are those of the other users, and the updates dropped by the flood control are counted (run it
+again with `--no-flood` to compare).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import sys
+import time
+
+from benchmarks.bench import percentile
+from benchmarks.fixtures import generate, FIRST_USER_ID
+from logconfig import setup_logging
+from migrations import upgrade
+
+SECRET = "load-test-secret"
+
+
+def update_body(update_id: int, user_id: int, text: str) -> bytes:
+    message = {"message_id": update_id, "date": int(time.time()), "text": text,
+               "chat": {"id": user_id, "type": "private"},
+               "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "en"}}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return json.dumps({"update_id": update_id, "message": message}).encode()
+
+
+async def post(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, port: int, body: bytes) -> int:
+    """One request on a keep-alive connection, returns the status"""
+    writer.write(f"POST /webhook HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nContent-Type: application/json\r\n"
+                 f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\nContent-Length: {len(body)}\r\n\r\n"
+                 .encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def connection(port: int, jobs: collections.deque, posted: dict[int, list[float]],
+                     statuses: collections.Counter, text: str) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while jobs:
+            update_id, user_id = jobs.popleft()
+            posted[user_id].append(time.monotonic())
+            statuses[await post(reader, writer, port, update_body(update_id, user_id, text))] += 1
+    finally:
+        writer.close()
+
+
+async def run(args: argparse.Namespace) -> dict:
+    import database
+    import main
+    from benchmarks.fake_bot_api import FakeBotAPI
+    from flood import UPDATES_DROPPED
+    from webhook import serve_webhook
+
+    def dropped() -> dict[str, float]:
+        return {reason: UPDATES_DROPPED.value(reason=reason) for reason in ("flood", "repeated", "overload")}
+
+    upgrade(database.engine)  # fixtures generated by an older revision
+    rng = random.Random(args.seed)
+    abusers = range(FIRST_USER_ID + args.users, FIRST_USER_ID + args.users + args.abusers)
+    jobs = collections.deque(
+        (i + 1, rng.choice(abusers) if abusers and rng.random() < args.abuse_share
+         else FIRST_USER_ID + rng.randrange(args.users)) for i in range(args.updates))
+    posted: dict[int, list[float]] = collections.defaultdict(list)
+    statuses: collections.Counter = collections.Counter()
+    async with FakeBotAPI(latency=args.api_latency) as api:
+        application = main.build_application("123456:fake", base_url=api.base_url, concurrency=args.concurrency,
+                                             flood_control=not args.no_flood)
+        async with application:
+            await application.start()
+            server = await serve_webhook(application, "127.0.0.1", 0, "/webhook", SECRET)
+            port = server.sockets[0].getsockname()[1]
+            started = time.monotonic()
+            await asyncio.gather(*(connection(port, jobs, posted, statuses, args.text)
+                                   for _ in range(args.connections)))
+            ingested = time.monotonic() - started
+            while len(api.sent) + sum(dropped().values()) < statuses[200] \
+                    and time.monotonic() - started < args.timeout:
+                await asyncio.sleep(0.01)
+            processed = time.monotonic() - started
+            server.close()
+            await application.stop()
+        await main.activity.stop()
+    # the updates of a user are handled in order, so are their replies
+    replies = collections.defaultdict(list)
+    for sent_at, chat_id, _ in api.sent:
+        replies[chat_id].append(sent_at)
+    latencies = [reply - sent for user_id, times in posted.items() if user_id not in abusers
+                 for sent, reply in zip(times, replies[user_id])]
+    return {
+        "updates": args.updates,
+        "statuses": dict(statuses),
+        "ingest_per_s": round(args.updates / ingested, 1),
+        "processed_per_s": round(len(api.sent) / processed, 1),
+        "replies": len(api.sent),
+        "dropped": dropped(),
+        "e2e_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "e2e_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "e2e_max_ms": round(max(latencies, default=0) * 1000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--db", help="fixture database, generated if missing (default bench-<users>.db)")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--connections", type=int, default=32, help="concurrent webhook connections")
+    parser.add_argument("--concurrency", type=int, default=64, help="updates handled at the same time by the bot")
+    parser.add_argument("--text", default="ℹ️ About", help="text of the synthetic messages")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the replies")
+    parser.add_argument("--abusers", type=int, default=0, help="users flooding the bot")
+    parser.add_argument("--abuse-share", type=float, default=0.5, help="fraction of the updates sent by the abusers")
+    parser.add_argument("--no-flood", action="store_true", help="disable the flood control")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    path = args.db or f"bench-{args.users}.db"
+    if not os.path.exists(path):
+        print("Generated", generate(path, args.users, args.seed), file=sys.stderr)
+    os.environ["DATABASE_URL"] = f"sqlite+pysqlite:///{os.path.abspath(path)}"
+    setup_logging(level="WARNING")  # LOG_LEVELS and LOG_SAMPLING apply, to measure their cost
+    json.dump(asyncio.run(run(args)), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
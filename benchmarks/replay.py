@@ -0,0 +1,188 @@
+"""Replay of a recorded trace of updates (see tracing) through the handlers of the bot
+
+    python -m benchmarks.replay updates.trace --speed 10
+
+The updates go through the Application of main.build_application, conversations and buttons included, with the
+bot pointed to the fake Bot API and a scratch database: a fresh one, or a copy of `--db`. They are put in the update
+queue in the recorded order and at the recorded intervals, divided by `--speed` (0 replays them as fast as
+possible); idle gaps longer than `--max-gap` recorded seconds are shortened to it, a trace spanning days replays in
+minutes. The same trace always produces the same input, so two revisions of the bot can be compared on it.
+
+Reported, overall and for the most frequent kinds of update (a command, a button, the text of a conversation, ...):
+the latency from the update being queued to its handlers being done, the updates handled per second, the updates
+dropped by the flood control and the handler errors, the Bot API calls per method. `lag_max_s` is how late the
+replay fell behind the schedule, when it is not ~0 the bot could not keep up with the traffic at that speed.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.bench import percentile
+from logconfig import setup_logging
+
+KINDS: int = 15  # kinds of update reported on their own, the most frequent ones
+FINISHED_GROUP: int = 1_000_000  # after every handler of the bot
+
+
+def load(path: str, max_gap: float) -> list[tuple[float, dict]]:
+    """The updates of the trace, each with its offset in (recorded) seconds from the first one"""
+    records = []
+    previous = offset = None
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if previous is not None:
+                offset += min(max(record["t"] - previous, 0.0), max_gap)
+            else:
+                offset = 0.0
+            previous = record["t"]
+            records.append((offset, record["u"]))
+    return records
+
+
+def kind(data: dict) -> str:
+    """What an update is, for the report: the command, the button or what else it carries"""
+    message = data.get("message") or data.get("edited_message")
+    if message is not None:
+        text = message.get("text")
+        if text is None:
+            return "document" if "document" in message else "message"
+        if text.startswith("/"):
+            return re.sub(r"\d+", "#", text.split()[0])  # /view_bd_# for every birthday
+        return text if re.search(r"[^\sxX\d\W_]", text) else "text"  # a masked text has only x, digits, punctuation
+    if "callback_query" in data:
+        return "callback:" + re.sub(r"\d+", "#", data["callback_query"].get("data", ""))
+    return next((key for key in data if key != "update_id"), "update")
+
+
+def summary(latencies: list[float]) -> dict:
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+    }
+
+
+async def replay(records: list[tuple[float, dict]], args: argparse.Namespace) -> dict:
+    import database
+    import main
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    from benchmarks.fake_bot_api import FakeBotAPI
+    from flood import UPDATES_DROPPED
+    from migrations import upgrade
+
+    def dropped() -> dict[str, float]:
+        return {reason: UPDATES_DROPPED.value(reason=reason) for reason in ("flood", "repeated", "overload")}
+
+    upgrade(database.engine)
+    queued: dict[int, float] = {}
+    latencies: dict[str, list[float]] = collections.defaultdict(list)
+    kinds: dict[int, str] = {}
+    errors: collections.Counter = collections.Counter()
+    finished = 0
+
+    async def done(update: Update, context) -> None:
+        nonlocal finished
+        finished += 1
+        latencies[kinds[update.update_id]].append(time.monotonic() - queued[update.update_id])
+
+    async def error(update: object, context) -> None:
+        errors[type(context.error).__name__] += 1
+
+    before = dropped()
+    lag = 0.0
+    async with FakeBotAPI(latency=args.api_latency) as api:
+        application = main.build_application("123456:fake", base_url=api.base_url, concurrency=args.concurrency,
+                                             flood_control=not args.no_flood, trace_file=None)
+        application.add_handler(TypeHandler(Update, done), group=FINISHED_GROUP)
+        application.add_error_handler(error)
+        try:
+            async with application:  # the hooks are run as by run_polling: activity flusher, broadcaster, scheduler
+                await application.post_init(application)
+                await application.start()
+                started = time.monotonic()
+                for update_id, (offset, data) in enumerate(records, 1):
+                    if args.speed > 0:
+                        delay = started + offset / args.speed - time.monotonic()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        else:
+                            lag = max(lag, -delay)
+                    data = dict(data, update_id=update_id)  # unique, also for traces appended to by several runs
+                    kinds[update_id] = kind(data)
+                    update = Update.de_json(data, application.bot)
+                    queued[update_id] = time.monotonic()
+                    await application.update_queue.put(update)
+                fed = time.monotonic() - started
+                while finished + sum(dropped().values()) - sum(before.values()) < len(records) \
+                        and time.monotonic() - started < fed + args.timeout:
+                    await asyncio.sleep(0.01)
+                elapsed = time.monotonic() - started
+                await application.stop()
+                await application.post_stop(application)
+        finally:
+            await application.post_shutdown(application)
+    everything = [x for values in latencies.values() for x in values]
+    frequent = sorted(latencies, key=lambda k: -len(latencies[k]))[:KINDS]
+    return {
+        "updates": len(records),
+        "recorded_s": round(records[-1][0], 3) if records else 0.0,
+        "speed": args.speed,
+        "elapsed_s": round(elapsed, 3),
+        "lag_max_s": round(lag, 3),
+        "handled": finished,
+        "handled_per_s": round(finished / elapsed, 1) if elapsed else None,
+        "dropped": {reason: count - before[reason] for reason, count in dropped().items()},
+        "errors": dict(errors),
+        "api_calls": dict(api.calls),
+        "latency": summary(everything),
+        "kinds": {k: summary(latencies[k]) for k in frequent},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="the file recorded with TRACE_FILE")
+    parser.add_argument("--speed", type=float, default=1.0, help="times the recorded speed, 0 for no waiting")
+    parser.add_argument("--max-gap", type=float, default=10.0, help="longest pause kept, in recorded seconds")
+    parser.add_argument("--limit", type=int, help="replay only the first updates of the trace")
+    parser.add_argument("--db", help="database copied as the scratch database, an empty one if not given")
+    parser.add_argument("--concurrency", type=int, default=64, help="updates handled at the same time by the bot")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument("--no-flood", action="store_true", help="disable the flood control")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the last updates")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    records = load(args.trace, args.max_gap)[:args.limit]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "replay.db")
+        if args.db:
+            shutil.copyfile(args.db, path)
+        # before main and database are imported, they read it once
+        os.environ["DATABASE_URL"] = f"sqlite+pysqlite:///{path}"
+        setup_logging(level="WARNING")
+        result = asyncio.run(replay(records, args))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=2)
+    json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, TypeVar
+
+from dataTypes import Birthday
+from database import run_db, count_birthdays, get_birthday
+
+MAX_USERS: int = 10_000  # users kept in the cache
+MAX_ROWS: int = 256  # birthdays kept per user
+TTL: float = 600  # seconds, a safety net: every write already invalidates the user
+
+T = TypeVar("T")
+
+
+class _Entry:
+    __slots__ = ("created", "facts", "rows")
+
+    def __init__(self):
+        self.created = time.monotonic()
+        self.facts: dict[str, object] = {}
+        self.rows: OrderedDict[int, Birthday | None] = OrderedDict()  # None: does not exist or is not the user's
+
+
+class BirthdayCache:
+    """Per-user cache of birthday rows and of facts derived from them
+
+    Everything about a user is dropped at once by `invalidate`, which must be called after every write to that
+    user's birthdays. A load that was running while the user got invalidated is not stored.
+    """
+
+    def __init__(self, max_users: int = MAX_USERS, max_rows: int = MAX_ROWS, ttl: float = TTL):
+        self.max_users = max_users
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+
+    def _entry(self, user_id: int) -> _Entry:
+        entry = self._entries.get(user_id)
+        if entry is None or time.monotonic() - entry.created > self.ttl:
+            entry = self._entries[user_id] = _Entry()
+            if len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(user_id)
+        return entry
+
+    async def _fact(self, user_id: int, key: str, load: Callable[[], Awaitable[T]]) -> T:
+        entry = self._entry(user_id)
+        if key in entry.facts:
+            self.hits += 1
+            return entry.facts[key]
+        self.misses += 1
+        value = await load()
+        entry.facts[key] = value  # harmless if the entry has been invalidated meanwhile, it is not reachable anymore
+        return value
+
+    async def has_birthdays(self, user_id: int) -> bool:
+        """Whether the user has any birthday (anniversaries excluded)"""
+        return await self._fact(user_id, "has_birthdays", lambda: self._has_birthdays(user_id))
+
+    @staticmethod
+    async def _has_birthdays(user_id: int) -> bool:
+        return await run_db(count_birthdays, user_id) > 0
+
+    async def get_birthday(self, user_id: int, birthday_id: int | str) -> Birthday | None:
+        """A birthday by id, only if it belongs to the user"""
+        birthday_id = int(birthday_id)
+        entry = self._entry(user_id)
+        if birthday_id in entry.rows:
+            self.hits += 1
+            entry.rows.move_to_end(birthday_id)
+            return entry.rows[birthday_id]
+        self.misses += 1
+        b = await run_db(get_birthday, user_id, birthday_id)
+        entry.rows[birthday_id] = b
+        if len(entry.rows) > self.max_rows:
+            entry.rows.popitem(last=False)
+        return b
+
+    def invalidate(self, user_id: int) -> None:
+        """Forget everything about the user, to be called whenever their birthdays change"""
+        self._entries.pop(user_id, None)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "users": len(self._entries)}
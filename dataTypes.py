@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 import datetime
-from typing import List
-from sqlalchemy import String, Column, Integer, DateTime, create_engine, ForeignKey, Boolean
-from sqlalchemy.orm import declarative_base, Mapped, relationship, mapped_column
-from telegram import User
+from typing import List, TYPE_CHECKING
+from sqlalchemy import String, Column, Integer, DateTime, create_engine, ForeignKey, Boolean, Index, LargeBinary, Float, Date, Text, UniqueConstraint
+from sqlalchemy.orm import declarative_base, Mapped, relationship, mapped_column, validates
+
+if TYPE_CHECKING:  # the reminder workers and the maintenance do not need telegram for the models
+    from telegram import User
 
 Base = declarative_base()
 
@@ -22,6 +24,16 @@ class TelegramUser(Base):
     monthly: Mapped[bool] = Column(Boolean, default=True)
     weekly: Mapped[bool] = Column(Boolean, default=True)
     dailiy: Mapped[bool] = Column(Boolean, default=True)
+    timezone: Mapped[str | None] = Column(String)  # IANA name, None for the default one
+    remind_at: Mapped[int | None] = Column(Integer)  # minutes after local midnight, None for the default time
+    # when the user was created or its timezone/time changed, for the reminder workers to pick up the change
+    schedule_changed: Mapped[datetime.datetime | None] = Column(DateTime)
+    reminded_on: Mapped[datetime.date | None] = Column(Date)  # the last local day whose reminders were planned
+    birthdays_version: Mapped[int] = Column(Integer, default=0)  # incremented by every write to the birthdays
+
+    __table_args__ = (
+        Index("ix_user_schedule_changed", "schedule_changed"),
+    )
 
 
     @staticmethod
@@ -36,6 +48,8 @@ class TelegramUser(Base):
             monthly = True,
             weekly = True,
             dailiy = True,
+            schedule_changed=datetime.datetime.now(),
+            birthdays_version=0,
         )
 
     def update_user(self, user: User) -> None:
@@ -64,3 +78,73 @@ class Birthday(Base):
     user_id: Mapped[int] = Column(Integer, ForeignKey("user.id"))
     user: Mapped["TelegramUser"] = relationship("TelegramUser", back_populates="birthdays")
     is_anniversary: Mapped[bool] = Column(Boolean, default=False)
+    # month * 100 + day of the birth, kept in sync with birth, so that birthdays can be looked up by day with an index
+    birth_md: Mapped[int] = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_birthday_user_id", "user_id"),
+        Index("ix_birthday_user_name", "user_id", "first_name", "last_name"),
+        Index("ix_birthday_birth_md", "birth_md"),
+        Index("ix_birthday_user_md", "user_id", "birth_md", "id"),
+    )
+
+    @validates("birth")
+    def _update_birth_md(self, key: str, birth: datetime.datetime) -> datetime.datetime:
+        self.birth_md = None if birth is None else birth.month * 100 + birth.day
+        return birth
+
+
+class UserData(Base):
+    """The `user_data` of the conversations of a user, pickled"""
+    __tablename__ = "user_data"
+    user_id: Mapped[int] = Column(Integer, primary_key=True)
+    data: Mapped[bytes] = Column(LargeBinary)
+
+
+class ConversationState(Base):
+    """The state of an ongoing conversation, the ones that ended are deleted"""
+    __tablename__ = "conversation"
+    name: Mapped[str] = Column(String, primary_key=True)
+    key: Mapped[str] = Column(String, primary_key=True)  # the conversation key (chat id, user id), as JSON
+    state: Mapped[bytes] = Column(LargeBinary)  # pickled
+
+
+class ShardLease(Base):
+    """Which reminder worker owns a shard of the users, and until when"""
+    __tablename__ = "shard_lease"
+    shard: Mapped[int] = Column(Integer, primary_key=True)
+    owner: Mapped[str | None] = Column(String)
+    expires: Mapped[float] = Column(Float, default=0)  # unix time
+
+
+class WorkerHeartbeat(Base):
+    """The reminder workers that are alive, to share the shards evenly"""
+    __tablename__ = "worker_heartbeat"
+    owner: Mapped[str] = Column(String, primary_key=True)
+    expires: Mapped[float] = Column(Float)  # unix time
+
+
+class OutboxMessage(Base):
+    """The reminders of a user for a day, from when they are planned until they are delivered"""
+    __tablename__ = "outbox"
+    id: Mapped[int] = Column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = Column(Integer, ForeignKey("user.id"))
+    day: Mapped[datetime.date] = Column(Date)
+    messages: Mapped[str] = Column(Text)  # JSON list of [text, parse_mode]
+    status: Mapped[int] = Column(Integer, default=0)  # see outbox.PENDING, SENT, FAILED, SENDING
+    done_at: Mapped[datetime.datetime | None] = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "day"),
+        Index("ix_outbox_status", "status"),
+        Index("ix_outbox_day", "day"),
+    )
+
+
+class ExportFile(Base):
+    """An export already sent to the user, sent again by file id as long as the birthdays did not change"""
+    __tablename__ = "export_file"
+    user_id: Mapped[int] = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    kind: Mapped[str] = Column(String, primary_key=True)  # "csv" or "ics"
+    version: Mapped[int] = Column(Integer)  # the birthdays_version of the user when it was generated
+    file_id: Mapped[str] = Column(String)  # telegram's
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import datetime
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Final, Iterable, TypeVar
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, update
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session
+
+from dataTypes import TelegramUser, Birthday
+from metrics import instrument_engine
+
+load_dotenv()
+
+DATABASE_URL: Final = os.getenv("DATABASE_URL", "sqlite+pysqlite:///database.db")
+DB_WORKERS: Final = int(os.getenv("DB_WORKERS", "4"))
+DB_READERS: Final = int(os.getenv("DB_READERS", "2"))  # threads (and connections) of the read-only pool
+SQLITE_BUSY_TIMEOUT: Final = int(os.getenv("SQLITE_BUSY_TIMEOUT", "15000"))  # ms a writer waits for the lock
+SQLITE_MMAP_SIZE: Final = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# run on every new connection; the journal mode is stored in the database file, the others are per connection
+SQLITE_PRAGMAS: Final = (
+    "PRAGMA journal_mode=WAL",  # the readers see the last commit and do not block the writer, nor the other way
+    "PRAGMA synchronous=NORMAL",  # no fsync per commit: a power loss may undo the last commits, never corrupt
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}",
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",  # pages read from the mapping instead of copied by read()
+)
+
+_engine: Engine | None = None
+_read_engine: Engine | None = None
+_engine_lock = threading.Lock()
+
+
+def is_file_database(url: str) -> bool:
+    """Whether the URL is an SQLite database file, not an in-memory database nor another backend"""
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:")
+
+
+def make_engine(url: str, pool_size: int, read_only: bool = False, pragmas: tuple[str, ...] = SQLITE_PRAGMAS) \
+        -> Engine:
+    """An engine on an SQLite file with a pool of `pool_size` connections, each one set up with `pragmas`
+
+    Args:
+        url (str): The database URL
+        pool_size (int): Connections kept open, as many as the threads using the engine
+        read_only (bool): Make the connections refuse to write (PRAGMA query_only), and read a single snapshot per
+            transaction
+        pragmas (tuple[str, ...]): The statements run on every new connection
+    """
+    # a file is pooled by default (QueuePool), sized here to the threads of the engine instead of 5 (and 10 more)
+    engine = create_engine(url, pool_size=pool_size, max_overflow=pool_size, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def configure(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+        if read_only:
+            dbapi_connection.isolation_level = None  # pysqlite begins only before a write, see below
+
+    if read_only:
+        # the transaction of a session begins with its first query, as the SQLAlchemy docs recommend for pysqlite:
+        # all the queries of a read see the same snapshot
+        @event.listens_for(engine, "begin")
+        def begin(connection):
+            connection.exec_driver_sql("BEGIN")
+
+    return engine
+
+
+def get_engine() -> Engine:
+    """The engine, created on first use: importing this module connects to nothing"""
+    global _engine
+    with _engine_lock:  # the first queries may come from several threads of the pool at once
+        if _engine is None:
+            if is_file_database(DATABASE_URL):
+                _engine = make_engine(DATABASE_URL, DB_WORKERS)
+            else:
+                _engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+            instrument_engine(_engine)
+        return _engine
+
+
+def get_read_engine() -> Engine:
+    """The engine of the read-only connections, the same as get_engine() if the database is not an SQLite file"""
+    global _read_engine
+    if not is_file_database(DATABASE_URL):
+        return get_engine()
+    engine = get_engine()  # the first connection of the writer switches the file to WAL
+    with _engine_lock:
+        if _read_engine is None:
+            with engine.connect():
+                pass
+            _read_engine = make_engine(DATABASE_URL, DB_READERS, read_only=True)
+            instrument_engine(_read_engine)
+        return _read_engine
+
+
+def __getattr__(name: str):
+    if name == "engine":  # `database.engine` and `from database import engine` create it as well
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# SQLite serializes writers anyway, a few threads are enough to keep slow reads from blocking everything else
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+# the long reads (lists, reports, exports) have their own threads, they never hold up the handlers that write
+_read_executor = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-read")
+
+T = TypeVar("T")
+
+
+def _call(fn: Callable[..., T], *args, **kwargs) -> T:
+    # objects stay usable after the commit, since the session is gone by the time the handler reads them
+    with Session(get_engine(), expire_on_commit=False) as session:
+        result = fn(session, *args, **kwargs)
+        session.commit()
+        return result
+
+
+def _read(fn: Callable[..., T], *args, **kwargs) -> T:
+    with Session(get_read_engine()) as session:
+        return fn(session, *args, **kwargs)
+
+
+async def run_db(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run `fn(session, *args, **kwargs)` on the database thread pool, in its own session, and commit
+
+    Handlers must never touch the database on the event loop, every query goes through here or run_read.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, _call, fn, *args, **kwargs))
+
+
+async def run_read(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run `fn(session, *args, **kwargs)` on a read-only connection, on the threads of the readers
+
+    For the reads that can be long and write nothing. Every statement sees the last committed data, including what
+    the handler committed through run_db just before.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_read_executor, functools.partial(context.run, _read, fn, *args, **kwargs))
+
+
+def get_user(session: Session, user_id: int) -> TelegramUser | None:
+    return session.get(TelegramUser, user_id)
+
+
+def set_reminder(session: Session, user_id: int, kind: str, enabled: bool) -> TelegramUser:
+    """Turn one of the reminders (monthly, weekly or dailiy) on or off"""
+    t = session.get(TelegramUser, user_id)
+    setattr(t, kind, enabled)
+    return t
+
+
+def set_schedule(session: Session, user_id: int, **fields) -> TelegramUser:
+    """Change the timezone and/or the time of the reminders of the user"""
+    t = session.get(TelegramUser, user_id)
+    for key, value in fields.items():
+        setattr(t, key, value)
+    t.schedule_changed = datetime.datetime.now()
+    return t
+
+
+def user_schedules(session: Session, shards: int = 1, owned: Iterable[int] | None = None,
+                   since: datetime.datetime | None = None) \
+        -> list[tuple[int, str | None, int | None, datetime.date | None]]:
+    """The (id, timezone, remind_at, reminded_on) of the users, to load the reminder scheduler
+
+    Args:
+        session (Session): The session
+        shards (int): In how many shards the users are split, by id
+        owned (Iterable[int] | None): Only the users of these shards, None for all of them
+        since (datetime.datetime | None): Only the users created or whose schedule changed after this time
+    """
+    query = session.query(TelegramUser.id, TelegramUser.timezone, TelegramUser.remind_at, TelegramUser.reminded_on)
+    if owned is not None:
+        query = query.filter((TelegramUser.id % shards).in_(list(owned)))
+    if since is not None:
+        query = query.filter(TelegramUser.schedule_changed > since)
+    return query.all()
+
+
+def count_birthdays(session: Session, user_id: int) -> int:
+    """How many birthdays (not anniversaries) the user has"""
+    return session.query(Birthday).filter(Birthday.user_id == user_id, Birthday.is_anniversary == False).count()
+
+
+def birthday_exists(session: Session, user_id: int, first_name: str, last_name: str) -> bool:
+    return session.query(Birthday.id).filter(Birthday.user_id == user_id, Birthday.first_name == first_name,
+                                             Birthday.last_name == last_name).first() is not None
+
+
+def get_birthday(session: Session, user_id: int, birthday_id: int) -> Birthday | None:
+    """A birthday by id, only if it belongs to the user"""
+    b = session.get(Birthday, int(birthday_id))
+    return b if b is not None and b.user_id == user_id else None
+
+
+def upcoming_birthdays(session: Session, user_id: int, today: datetime.date, offset: int,
+                       limit: int) -> tuple[int, list[Birthday]]:
+    """A page of the user's birthdays, ordered by the next occurrence starting from today
+
+    The birthdays from today to the end of the year come first, then the ones from New Year; both parts are read
+    in order from the (user_id, birth_md, id) index, so only the requested page is fetched.
+
+    Returns:
+        tuple[int, list[Birthday]]: The total number of birthdays of the user, and the page
+    """
+    today_md = today.month * 100 + today.day
+    mine = session.query(Birthday).filter(Birthday.user_id == user_id)
+    total = mine.count()
+    this_year = mine.filter(Birthday.birth_md >= today_md)
+    this_year_count = this_year.count()
+    rows = []
+    if offset < this_year_count:
+        rows = this_year.order_by(Birthday.birth_md, Birthday.id).offset(offset).limit(limit).all()
+    if len(rows) < limit:
+        rows += mine.filter(Birthday.birth_md < today_md).order_by(Birthday.birth_md, Birthday.id) \
+            .offset(max(0, offset - this_year_count)).limit(limit - len(rows)).all()
+    return total, rows
+
+
+def touch_birthdays(session: Session, user_id: int) -> None:
+    """Record that the birthdays of the user changed, to be called by every write to them"""
+    session.execute(update(TelegramUser).where(TelegramUser.id == user_id)
+                    .values(birthdays_version=TelegramUser.birthdays_version + 1))
+
+
+def insert_birthday(session: Session, user_id: int, first_name: str, last_name: str,
+                    birth: datetime.datetime) -> Birthday:
+    b = Birthday(first_name=first_name, last_name=last_name, birth=birth, user_id=user_id, is_anniversary=False)
+    session.add(b)
+    touch_birthdays(session, user_id)
+    return b
+
+
+def update_birthday(session: Session, user_id: int, birthday_id: int, **fields) -> Birthday | None:
+    """Change some fields of a birthday of the user, returns None if it does not exist"""
+    b = get_birthday(session, user_id, birthday_id)
+    if b is not None:
+        for key, value in fields.items():
+            setattr(b, key, value)
+        touch_birthdays(session, user_id)
+    return b
+
+
+def remove_birthday(session: Session, user_id: int, birthday_id: int) -> bool:
+    b = get_birthday(session, user_id, birthday_id)
+    if b is None:
+        return False
+    session.delete(b)
+    touch_birthdays(session, user_id)
+    return True
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import calendar
+import datetime
+import functools
+from typing import Final, Iterable, NamedTuple
+
+DATE_FORMAT: Final = "%d/%m/%Y"  # how the users type the dates
+
+
+class InvalidDate(ValueError):
+    """The text is not a date in one of the accepted formats"""
+
+
+class FutureDate(InvalidDate):
+    """The date of birth is in the future"""
+
+
+def parse_birth_date(text: str, formats: tuple[str, ...] = (DATE_FORMAT,),
+                     now: datetime.datetime | None = None) -> datetime.datetime:
+    """Parse and validate a date of birth, with the rules used everywhere a date is entered
+
+    Args:
+        text (str): The date, as typed or as read from a file
+        formats (tuple[str, ...]): The accepted strptime formats, tried in order
+        now (datetime.datetime | None): The current time, the date cannot be after it
+
+    Raises:
+        InvalidDate: If the text is not a date in one of the formats
+        FutureDate: If the date is in the future
+    """
+    text = text.strip()
+    for fmt in formats:
+        try:
+            date = datetime.datetime.strptime(text, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        raise InvalidDate(text)
+    if date > (now or datetime.datetime.now()):
+        raise FutureDate(text)
+    return date
+
+
+class Occurrence(NamedTuple):
+    """The next birthday of someone, seen from a reference day"""
+    days: int  # until the next birthday, 0 on the day
+    months: int  # the same wait in months of 30 days...
+    remaining_days: int  # ...and days
+    age: int  # on the reference day
+
+
+@functools.lru_cache(maxsize=8)
+def _month_starts(year: int) -> tuple[tuple[int, ...], bool]:
+    """The ordinal of the day before the first of every month (indexed 1 to 12) of the year, and if it is leap"""
+    starts = [0] * 13
+    ordinal = datetime.date(year, 1, 1).toordinal() - 1
+    for month in range(1, 13):
+        starts[month] = ordinal
+        ordinal += calendar.monthrange(year, month)[1]
+    return tuple(starts), calendar.isleap(year)
+
+
+def celebrated_on(year: int, month: int, day: int) -> datetime.date:
+    """The day a birthday is celebrated in `year`: the 29th of February is the 28th in the other years"""
+    if month == 2 and day == 29 and not calendar.isleap(year):
+        day = 28
+    return datetime.date(year, month, day)
+
+
+def occurrences(births: Iterable[datetime.date], today: datetime.date) -> list[Occurrence]:
+    """The next birthday and the age of many people at once, from the same reference day
+
+    The calendars of this year and the next are computed once, then every birth date costs a few integer
+    operations: no date object is built per row. A birthday on the 29th of February is celebrated on the 28th in
+    the years without one.
+
+    Args:
+        births (Iterable[datetime.date]): The dates of birth, dates or datetimes
+        today (datetime.date): The reference day
+
+    Returns:
+        list[Occurrence]: In the same order as the births
+    """
+    today_ordinal = today.toordinal()
+    today_md = today.month * 100 + today.day
+    this_year, this_leap = _month_starts(today.year)
+    next_year, next_leap = _month_starts(today.year + 1)
+    result = []
+    for birth in births:
+        month, day = birth.month, birth.day
+        leap_day = month == 2 and day == 29
+        this_day = 28 if leap_day and not this_leap else day
+        if month * 100 + this_day >= today_md:
+            days = this_year[month] + this_day - today_ordinal
+            age = today.year - birth.year - (month * 100 + this_day > today_md)
+        else:
+            days = next_year[month] + (28 if leap_day and not next_leap else day) - today_ordinal
+            age = today.year - birth.year
+        result.append(Occurrence(days, days // 30, days % 30, age))
+    return result
+
+
+def occurrence(birth: datetime.date, today: datetime.date) -> Occurrence:
+    """The next birthday and the age of a single person"""
+    return occurrences((birth,), today)[0]
@@ -0,0 +1,113 @@
+"""Export of the birthdays of a user, as CSV or as an iCalendar feed with a yearly event per birthday
+
+The rows are streamed from the database in batches and written to a file as they come, nothing is built in memory.
+The files sent to a user are remembered by their Telegram file id, together with the version of the birthdays
+they were generated from: exporting again sends the same file, without reading the birthdays, until they change.
+"""
+from __future__ import annotations
+
+import csv
+import datetime
+from typing import Final, Iterator, TextIO
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from dataTypes import Birthday, ExportFile, TelegramUser
+
+EXPORT_BATCH: Final = 1000  # rows fetched from the cursor at a time
+FILE_NAMES: Final = {"csv": "birthdays.csv", "ics": "birthdays.ics"}
+CSV_HEADER: Final = ("first name", "last name", "birthday")  # read back by the importer
+
+
+def _rows(session: Session, user_id: int) -> Iterator[tuple[int, str, str, datetime.datetime]]:
+    """The (id, first name, last name, birth) of the birthdays of the user, in calendar order"""
+    query = select(Birthday.id, Birthday.first_name, Birthday.last_name, Birthday.birth) \
+        .where(Birthday.user_id == user_id).order_by(Birthday.birth_md, Birthday.id)
+    return iter(session.execute(query, execution_options={"yield_per": EXPORT_BATCH}))
+
+
+def write_csv(rows: Iterator[tuple], file: TextIO) -> int:
+    writer = csv.writer(file)
+    writer.writerow(CSV_HEADER)
+    count = 0
+    for _, first_name, last_name, birth in rows:
+        writer.writerow((first_name, last_name or "", birth.strftime("%Y-%m-%d")))
+        count += 1
+    return count
+
+
+def _ics_text(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _ics_line(file: TextIO, line: str) -> None:
+    """Write a content line, folded at 75 octets as RFC 5545 requires"""
+    data = line.encode()
+    while len(data) > 75:
+        cut = 75
+        while data[cut] & 0xC0 == 0x80:  # do not split a UTF-8 sequence
+            cut -= 1
+        file.write(data[:cut].decode() + "\r\n")
+        data = b" " + data[cut:]
+    file.write(data.decode() + "\r\n")
+
+
+def write_ics(rows: Iterator[tuple], file: TextIO, stamp: datetime.datetime) -> int:
+    """An all-day event per birthday, repeated every year from the date of birth"""
+    dtstamp = stamp.strftime("%Y%m%dT%H%M%SZ")
+    for line in ("BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//birthdaybot//EN", "CALSCALE:GREGORIAN",
+                 "X-WR-CALNAME:Birthdays"):
+        _ics_line(file, line)
+    count = 0
+    for birthday_id, first_name, last_name, birth in rows:
+        name = f"{first_name} {last_name or ''}".strip()
+        # a plain yearly rule skips the non-leap years for the 29th of February, the last day of February does not
+        rule = "FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=-1" if (birth.month, birth.day) == (2, 29) else "FREQ=YEARLY"
+        for line in ("BEGIN:VEVENT", f"UID:birthday-{birthday_id}@birthdaybot", f"DTSTAMP:{dtstamp}",
+                     f"DTSTART;VALUE=DATE:{birth.strftime('%Y%m%d')}", "DURATION:P1D", f"RRULE:{rule}",
+                     f"SUMMARY:{_ics_text('🎂 ' + name)}", "TRANSP:TRANSPARENT", "END:VEVENT"):
+            _ics_line(file, line)
+        count += 1
+    _ics_line(file, "END:VCALENDAR")
+    return count
+
+
+def cached_export(session: Session, user_id: int, kind: str) -> str | None:
+    """The file id of the export of the user, if it was sent since the last change of their birthdays"""
+    return session.scalar(select(ExportFile.file_id).join(TelegramUser, TelegramUser.id == ExportFile.user_id).where(
+        ExportFile.user_id == user_id, ExportFile.kind == kind, ExportFile.version == TelegramUser.birthdays_version))
+
+
+def write_export(session: Session, user_id: int, kind: str, path: str) -> tuple[int, int]:
+    """Write the export of the user to `path`
+
+    The version is read in the same transaction as the birthdays, so it is never newer than the file: on a read-only
+    connection (see database.make_engine) a transaction is a single snapshot.
+
+    Args:
+        session (Session): Database session
+        user_id (int): The user
+        kind (str): "csv" or "ics"
+        path (str): The file to write
+
+    Returns:
+        tuple[int, int]: The version of the birthdays that was exported, and how many birthdays
+    """
+    version = session.scalar(select(TelegramUser.birthdays_version).where(TelegramUser.id == user_id)) or 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        rows = _rows(session, user_id)
+        if kind == "ics":
+            count = write_ics(rows, file, datetime.datetime.now(datetime.timezone.utc))
+        else:
+            count = write_csv(rows, file)
+    return version, count
+
+
+def store_export(session: Session, user_id: int, kind: str, version: int, file_id: str) -> None:
+    statement = insert(ExportFile).values(user_id=user_id, kind=kind, version=version, file_id=file_id)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=[ExportFile.user_id, ExportFile.kind],
+        set_={"version": statement.excluded.version, "file_id": statement.excluded.file_id},
+    ))
@@ -0,0 +1,106 @@
+"""Inbound flood control: what a single chat can ask of the bot, decided before any handler or query runs
+
+Every user has a token bucket of FLOOD_BURST updates, refilled at FLOOD_RATE updates per second. An update that
+finds the bucket empty waits for its token, up to FLOOD_MAX_DELAY seconds, and is dropped if it would wait longer.
+A button pressed again (the same label, command or inline button) within COALESCE_SECONDS of the previous press is
+dropped as well: it would only produce the same answer twice. A dropped inline button press is still answered (see
+webhook), so that its spinner stops.
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import Collection, Final
+
+from telegram import Update
+
+import metrics
+from sender import TokenBucket
+
+FLOOD_RATE: Final = float(os.getenv("FLOOD_RATE", "1"))  # updates per second per user, 0 for no limit
+FLOOD_BURST: Final = float(os.getenv("FLOOD_BURST", "10"))
+FLOOD_MAX_DELAY: Final = float(os.getenv("FLOOD_MAX_DELAY", "3"))  # seconds an update can be deferred
+COALESCE_SECONDS: Final = float(os.getenv("COALESCE_SECONDS", "1"))
+SWEEP_EVERY: Final = 10_000  # updates between two removals of the users that went quiet
+
+UPDATES_DEFERRED = metrics.Counter("birthdaybot_updates_deferred_total", "Updates delayed by the flood control")
+UPDATES_DROPPED = metrics.Counter("birthdaybot_updates_dropped_total",
+                                  "Updates dropped before being handled, per reason (flood, repeated, overload)")
+
+
+class _UserState:
+    __slots__ = ("bucket", "press", "pressed_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.press: str | None = None  # the last button pressed, and when
+        self.pressed_at = 0.0
+
+
+class FloodControl:
+    """Decides if the update of a user is handled now, later or not at all
+
+    Args:
+        rate (float): Updates per second a user can send on average, 0 or less for no limit
+        burst (float): Updates a user can send at once
+        max_delay (float): The longest an update is deferred, the ones that would wait longer are dropped
+        coalesce_seconds (float): Presses of the same button closer than this are handled once, 0 to never coalesce
+        buttons (Collection[str]): The labels of the keyboard buttons; commands and inline buttons are always
+            coalesced, text that is neither (a name, a date) never is
+    """
+
+    def __init__(self, rate: float = FLOOD_RATE, burst: float = FLOOD_BURST, max_delay: float = FLOOD_MAX_DELAY,
+                 coalesce_seconds: float = COALESCE_SECONDS, buttons: Collection[str] = ()):
+        self.rate = rate
+        self.burst = burst
+        self.max_delay = max_delay
+        self.coalesce_seconds = coalesce_seconds
+        self.buttons = set(buttons)
+        self._users: dict[int, _UserState] = {}
+        self._seen = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def press(self, update: object) -> str | None:
+        """What was pressed, if the update is a button press (or a command), None otherwise"""
+        if not isinstance(update, Update):
+            return None
+        if update.callback_query is not None:
+            return "callback:" + (update.callback_query.data or "")
+        text = update.message.text if update.message is not None else None
+        if text and (text.startswith("/") or text in self.buttons):
+            return "text:" + text
+        return None
+
+    def admit(self, key: int, update: object) -> float | None:
+        """Seconds to wait before handling the update of user (or chat) `key`, None if it has to be dropped"""
+        self._seen += 1
+        if self._seen % SWEEP_EVERY == 0:
+            self._sweep()
+        state = self._users.get(key)
+        if state is None:
+            state = self._users[key] = _UserState(self.rate, self.burst)
+        now = time.monotonic()
+        press = self.press(update)
+        if press is not None and press == state.press and now - state.pressed_at < self.coalesce_seconds:
+            UPDATES_DROPPED.inc(reason="repeated")
+            return None
+        wait = state.bucket.reserve()
+        if wait > self.max_delay:
+            state.bucket.tokens += 1  # not used after all
+            UPDATES_DROPPED.inc(reason="flood")
+            return None
+        if press is not None:
+            state.press, state.pressed_at = press, now
+        if wait > 0:
+            UPDATES_DEFERRED.inc()
+        return wait
+
+    def _sweep(self) -> None:
+        # a user whose bucket has refilled and whose last press is old is the same as a user never seen
+        now = time.monotonic()
+        idle = max(self.burst / self.rate if self.rate > 0 else 0, self.coalesce_seconds)
+        for key in [key for key, state in self._users.items()
+                    if now - max(state.bucket.updated, state.pressed_at) > idle]:
+            del self._users[key]
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY: int = 1 << 20  # refuse bodies larger than 1 MiB
+MAX_HEADERS: int = 100  # refuse requests with more header lines
+MAX_HEADER_BYTES: int = 16 << 10  # or with larger headers, in total
+READ_TIMEOUT: float = 30  # seconds to receive a whole request, idle keep-alive connections included
+
+REASONS = {200: "OK", 204: "No Content", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+           404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 429: "Too Many Requests",
+           431: "Request Header Fields Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    headers: dict[str, str]  # lowercase names
+    body: bytes
+
+
+class Response(NamedTuple):
+    status: int
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+async def _readline(reader: asyncio.StreamReader, status: int) -> bytes:
+    try:
+        return await reader.readline()
+    except ValueError:  # longer than the limit of the reader
+        raise _BadRequest(status)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Request | None:
+    """Read a single request from a keep-alive connection, None when the client has closed it"""
+    line = await _readline(reader, 400)
+    if not line:
+        return None
+    try:
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise _BadRequest(400)
+    headers = {}
+    size = 0
+    for _ in range(MAX_HEADERS + 1):
+        line = await _readline(reader, 431)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        size += len(line)
+        if size > MAX_HEADER_BYTES:
+            raise _BadRequest(431)
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    else:
+        raise _BadRequest(431)
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise _BadRequest(400)
+    if length < 0:
+        raise _BadRequest(400)
+    if length > MAX_BODY:
+        raise _BadRequest(413)
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, path, headers, body)
+
+
+def _write_response(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+    writer.write(
+        f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+        f"Content-Type: {response.content_type}\r\n"
+        f"Content-Length: {len(response.body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + response.body
+    )
+
+
+async def serve(handler: Handler, host: str, port: int, timeout: float = READ_TIMEOUT) -> asyncio.Server:
+    """Start a minimal HTTP/1.1 server on the running event loop
+
+    This is only meant for small internal endpoints (metrics, webhook ingestion, the fake Bot API used by the
+    benchmarks), it does not support chunked bodies or TLS, which are left to a reverse proxy. The requests are
+    limited in size, and a connection is closed when a request takes more than `timeout` seconds to arrive.
+
+    Args:
+        handler (Handler): Coroutine turning a Request into a Response
+        host (str): Address to bind
+        port (int): Port to bind, 0 for a random free port
+        timeout (float): Seconds to receive a request, from the end of the previous one on a keep-alive connection
+
+    Returns:
+        asyncio.Server: The started server, the bound port is in `server.sockets[0].getsockname()[1]`
+    """
+
+    async def connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), timeout)
+                except asyncio.TimeoutError:
+                    break
+                except _BadRequest as e:
+                    _write_response(writer, Response(e.status), False)
+                    break
+                if request is None:
+                    break
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                try:
+                    response = await handler(request)
+                except Exception:  # a broken handler must not kill the server
+                    logger.exception("Error while handling %s %s", request.method, request.path)
+                    response = Response(500)
+                _write_response(writer, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # the lines (request line, headers) longer than the limit of the readers are refused as well
+    return await asyncio.start_server(connection, host, port, limit=MAX_HEADER_BYTES)
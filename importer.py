@@ -0,0 +1,212 @@
+"""Bulk import of birthdays from CSV and vCard files
+
+The file is read line by line from disk and imported in batches, each one checked for duplicates and committed on its
+own, so the memory used does not depend on the size of the file.
+"""
+from __future__ import annotations
+
+import csv
+import datetime
+from typing import Final, Iterable, Iterator, NamedTuple, TextIO
+
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from dataTypes import Birthday
+from database import touch_birthdays
+from dates import parse_birth_date, InvalidDate, FutureDate, DATE_FORMAT
+
+# rows per transaction; the duplicate check binds 2 parameters a row and the user, below the 999 SQLite allows
+# before 3.32
+IMPORT_BATCH: Final = 400
+MAX_FILE_SIZE: Final = 20 * 1024 * 1024  # the largest file a bot can download
+MAX_NAME: Final = 128
+# besides the format typed in the chat, what address books and spreadsheets export
+IMPORT_DATE_FORMATS: Final = (DATE_FORMAT, "%Y-%m-%d", "%Y%m%d", "%d-%m-%Y", "%d.%m.%Y")
+
+FIRST_NAME_HEADERS: Final = ("first name", "first_name", "firstname", "given name", "name", "nome")
+LAST_NAME_HEADERS: Final = ("last name", "last_name", "lastname", "surname", "family name", "cognome")
+DATE_HEADERS: Final = ("birthday", "date of birth", "birth", "birthdate", "dob", "date", "data di nascita")
+
+
+class Entry(NamedTuple):
+    line: int
+    first_name: str
+    last_name: str
+    date: str
+
+
+class ImportResult:
+    def __init__(self):
+        self.added = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors: list[str] = []  # the first few, to show to the user
+
+    def error(self, line: int, message: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < 10:
+            self.errors.append(f"line {line}: {message}")
+
+    def __repr__(self) -> str:
+        return f"<ImportResult(added={self.added}, duplicates={self.duplicates}, invalid={self.invalid})>"
+
+
+def _column(header: list[str], names: tuple[str, ...]) -> int | None:
+    for name in names:  # in order of preference
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def iter_csv(file: TextIO) -> Iterator[Entry]:
+    """The entries of a CSV file, with a header naming the columns or with first name, last name, date columns"""
+    sample = file.read(4096)
+    file.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(file, dialect)
+    columns = None
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if columns is None:  # the first row, a header or already an entry
+            header = [cell.strip().lower() for cell in row]
+            named = (_column(header, FIRST_NAME_HEADERS), _column(header, LAST_NAME_HEADERS),
+                     _column(header, DATE_HEADERS))
+            if named[0] is not None and named[2] is not None:
+                columns = named
+                continue
+            columns = (0, 1, 2)
+        first, last, date = (row[i].strip() if i is not None and i < len(row) else "" for i in columns)
+        yield Entry(reader.line_num, first, last, date)
+
+
+def _unfold(file: TextIO) -> Iterator[tuple[int, str]]:
+    """The logical lines of a vCard file: a line starting with a space or a tab continues the previous one"""
+    current, start = None, 0
+    for number, line in enumerate(file, start=1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, number
+    if current is not None:
+        yield start, current
+
+
+def _unescape(value: str) -> str:
+    return value.replace("\\,", ",").replace("\\;", ";").replace("\\n", " ").replace("\\N", " ").strip()
+
+
+def iter_vcard(file: TextIO) -> Iterator[Entry]:
+    """The entries of a vCard (.vcf) file, one per card with a BDAY"""
+    card: dict[str, str] | None = None
+    start = 0
+    for number, line in _unfold(file):
+        name, _, value = line.partition(":")
+        name = name.split(";", 1)[0].rsplit(".", 1)[-1].upper()  # drop the parameters and the group
+        if name == "BEGIN" and value.strip().upper() == "VCARD":
+            card, start = {}, number
+        elif card is None:
+            continue
+        elif name == "END":
+            if "BDAY" in card:
+                first, last = card.get("FIRST", ""), card.get("LAST", "")
+                if not first and not last and "FN" in card:
+                    first, _, last = card["FN"].partition(" ")
+                yield Entry(start, first, last, card["BDAY"])
+            card = None
+        elif name == "N":
+            parts = (value.split(";") + ["", ""])[:2]  # family name; given name; ...
+            card["LAST"], card["FIRST"] = _unescape(parts[0]), _unescape(parts[1])
+        elif name == "FN":
+            card[name] = _unescape(value)
+        elif name == "BDAY":
+            card[name] = value.strip().split("T", 1)[0]  # a date-time in some exports
+
+
+def _validate(entry: Entry, result: ImportResult, now: datetime.datetime) -> dict | None:
+    if not entry.first_name:
+        result.error(entry.line, "missing name")
+        return None
+    if len(entry.first_name) > MAX_NAME or len(entry.last_name) > MAX_NAME:
+        result.error(entry.line, "name too long")
+        return None
+    try:
+        birth = parse_birth_date(entry.date, IMPORT_DATE_FORMATS, now)
+    except FutureDate:
+        result.error(entry.line, f"{entry.date} is in the future")
+        return None
+    except InvalidDate:
+        result.error(entry.line, f"{entry.date or 'missing date'} is not a valid date")
+        return None
+    return {"first_name": entry.first_name, "last_name": entry.last_name, "birth": birth,
+            "birth_md": birth.month * 100 + birth.day, "is_anniversary": False}
+
+
+def _insert_batch(session: Session, user_id: int, rows: list[dict], result: ImportResult) -> None:
+    # duplicates within the batch, then against the database (which holds the previous batches too)
+    unique = {}
+    for row in rows:
+        unique.setdefault((row["first_name"], row["last_name"]), row)
+    existing = {tuple(row) for row in session.execute(
+        select(Birthday.first_name, Birthday.last_name).where(
+            Birthday.user_id == user_id,
+            tuple_(Birthday.first_name, Birthday.last_name).in_(list(unique)),
+        ))}
+    new = [dict(row, user_id=user_id) for key, row in unique.items() if key not in existing]
+    result.duplicates += len(rows) - len(new)
+    if new:
+        session.execute(insert(Birthday.__table__), new)  # the table, not the entity: no ORM bookkeeping
+        touch_birthdays(session, user_id)
+    session.commit()
+    result.added += len(new)
+
+
+def import_birthdays(session: Session, user_id: int, entries: Iterable[Entry]) -> ImportResult:
+    """Validate the entries and add the new ones to the birthdays of the user, a batch per transaction
+
+    Args:
+        session (Session): Database session, committed after every batch
+        user_id (int): The owner of the birthdays
+        entries (Iterable[Entry]): The parsed entries, consumed lazily
+
+    Returns:
+        ImportResult: How many were added, were already there, or were not valid
+    """
+    result = ImportResult()
+    now = datetime.datetime.now()
+    batch = []
+    for entry in entries:
+        row = _validate(entry, result, now)
+        if row is not None:
+            batch.append(row)
+        if len(batch) >= IMPORT_BATCH:
+            _insert_batch(session, user_id, batch, result)
+            batch = []
+    if batch:
+        _insert_batch(session, user_id, batch, result)
+    return result
+
+
+def import_file(session: Session, user_id: int, path: str, kind: str) -> ImportResult:
+    """Import the CSV (`kind` "csv") or vCard (`kind` "vcard") file at `path`"""
+    with open(path, encoding="utf-8-sig", errors="replace", newline="") as file:
+        entries = iter_csv(file) if kind == "csv" else iter_vcard(file)
+        return import_birthdays(session, user_id, entries)
+
+
+def file_kind(file_name: str | None, mime_type: str | None) -> str | None:
+    """"csv" or "vcard" from the name or the type of an uploaded document, None if it is neither"""
+    name = (file_name or "").lower()
+    mime = (mime_type or "").lower()
+    if name.endswith((".vcf", ".vcard")) or mime in ("text/vcard", "text/x-vcard", "text/directory"):
+        return "vcard"
+    if name.endswith((".csv", ".tsv", ".txt")) or mime in ("text/csv", "text/comma-separated-values"):
+        return "csv"
+    return None
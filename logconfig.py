@@ -0,0 +1,189 @@
+"""Logging: records are queued by the code that logs them and formatted and written by a background thread
+
+    LOG_LEVEL=INFO                                    # the level of every logger not listed in LOG_LEVELS
+    LOG_FORMAT=json                                   # one JSON object per line, "text" by default
+    LOG_LEVELS=sqlalchemy.engine=INFO,httpx=WARNING   # per logger (and its children)
+    LOG_SAMPLING=sqlalchemy.engine=0.01               # keep 1% of the records below WARNING of these loggers
+    LOG_LEAN=1                                        # records without the thread and process information
+
+The records carry the update and the user being handled (`update_id`, `user_id`), also in the database threads
+since run_db copies the context. Sampling is by update, so a sampled update keeps all its records: enabling the SQL
+log on a busy bot gives the complete queries of a few updates instead of slowing down all of them. When the writer
+cannot keep up the records are dropped and counted, the handlers never wait for it.
+
+LOG_LEAN switches off the documented `logging.logThreads`, `logProcesses` and `logMultiprocessing`, for the whole
+process: none of it is in our formats and it is a part of the cost of a record, but a library formatting its own
+records with it would see None.
+"""
+from __future__ import annotations
+
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import zlib
+from typing import Final
+
+import metrics
+
+LOG_QUEUE_SIZE: Final = 10_000  # records waiting to be written, the next ones are dropped
+TEXT_FORMAT: Final = "%(asctime)s - %(name)s - %(levelname)s - %(message)s%(correlation)s"
+DEFAULT_LEVELS: Final = "httpx=WARNING"  # a line per request to the Bot API otherwise
+
+LOG_DROPPED = metrics.Counter("birthdaybot_log_dropped_total", "Log records dropped because the writer was behind")
+
+_update_id: contextvars.ContextVar[int | None] = contextvars.ContextVar("log_update_id", default=None)
+_user_id: contextvars.ContextVar[int | None] = contextvars.ContextVar("log_user_id", default=None)
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def correlate(update_id: int | None, user_id: int | None) -> None:
+    """Tag the records logged from now on, in this context, with the update and the user being handled"""
+    _update_id.set(update_id)
+    _user_id.set(user_id)
+
+
+def parse_pairs(text: str) -> dict[str, str]:
+    """"a=1,b.c=2" as {"a": "1", "b.c": "2"}"""
+    pairs = {}
+    for item in text.split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip():
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+class CorrelationFilter(logging.Filter):
+    """Adds `update_id`, `user_id` and their text form `correlation` to the records"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = _update_id.get()
+        record.user_id = _user_id.get()
+        if record.update_id is None and record.user_id is None:
+            record.correlation = ""
+        else:
+            record.correlation = f" [update={record.update_id} user={record.user_id}]"
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the records below WARNING of some loggers and their children, for a given update the
+    same fraction for all of them
+
+    Args:
+        rates (dict[str, float]): The fraction kept, from 0 to 1, by logger name
+    """
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.thresholds = {name: int(rate * 10_000) for name, rate in rates.items()}
+        self._by_logger: dict[str, int | None] = {}
+
+    def _threshold(self, name: str) -> int | None:
+        if name not in self._by_logger:
+            probe = name
+            while probe and probe not in self.thresholds:
+                probe = probe.rpartition(".")[0]
+            self._by_logger[name] = self.thresholds.get(probe)
+        return self._by_logger[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        threshold = self._threshold(record.name)
+        if threshold is None:
+            return True
+        update_id = _update_id.get()
+        if update_id is None:  # outside of the updates
+            return random.randrange(10_000) < threshold
+        return zlib.crc32(update_id.to_bytes(8, "little", signed=True)) % 10_000 < threshold
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("update_id", "user_id"):
+            value = getattr(record, key, None)
+            if value is not None:
+                data[key] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only the message is merged here, its arguments could change once the call returns; the formatting (time,
+        # JSON, traceback) is left to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # a SimpleQueue is much cheaper than a Queue but unbounded, the bound is approximate
+        if self.queue.qsize() >= LOG_QUEUE_SIZE:
+            LOG_DROPPED.inc()
+        else:
+            self.queue.put_nowait(record)
+
+
+def setup_logging(level: str | None = None, fmt: str | None = None, levels: str | None = None,
+                  sampling: str | None = None, lean: bool | None = None) -> logging.handlers.QueueListener:
+    """Configure the logging of the process, replacing any previous configuration
+
+    Every argument defaults to the environment variable of the same name (LOG_LEVEL, LOG_FORMAT, LOG_LEVELS,
+    LOG_SAMPLING, LOG_LEAN), see the module documentation.
+
+    Returns:
+        logging.handlers.QueueListener: The background writer, stopped (and flushed) at exit
+    """
+    global _listener
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    fmt = fmt or os.getenv("LOG_FORMAT", "text")
+    levels = levels if levels is not None else os.getenv("LOG_LEVELS", DEFAULT_LEVELS)
+    sampling = sampling if sampling is not None else os.getenv("LOG_SAMPLING", "")
+    lean = lean if lean is not None else os.getenv("LOG_LEAN", "") not in ("", "0")
+
+    stop_logging()
+    if lean:
+        logging.logThreads = logging.logProcesses = logging.logMultiprocessing = False
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(JSONFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    handler = _QueueHandler(queue.SimpleQueue())
+    rates = {name: float(value) for name, value in parse_pairs(sampling).items()}
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+    handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, value in parse_pairs(levels).items():
+        logging.getLogger(name).setLevel(value.upper())
+
+    _listener = logging.handlers.QueueListener(handler.queue, writer, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def stop_logging() -> None:
+    """Write the records still queued and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,101 +1,94 @@
 #!/usr/bin/env python
 # pylint: disable=unused-argument
 
+import asyncio
 import datetime
+import functools
 import logging
 from typing import Final
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
-
-from dataTypes import TelegramUser, Birthday
-
-import threading
-
-import asyncio
+from dataTypes import Birthday
+from database import get_engine, run_db, run_read, get_user, set_reminder, set_schedule, user_schedules, \
+    birthday_exists, upcoming_birthdays, insert_birthday, update_birthday, remove_birthday
+from migrations import upgrade
+import metrics
+import logconfig
+from activity import ActivityBuffer
+from cache import BirthdayCache
+from dates import parse_birth_date, occurrences, occurrence, Occurrence, InvalidDate, FutureDate
+from importer import import_file, file_kind, MAX_FILE_SIZE
+from search import search_birthdays, words
+from export import cached_export, write_export, store_export, FILE_NAMES
+from scheduler import ReminderScheduler, is_timezone, remind_minute, zone
+from sender import Broadcaster
+from reminders import report
+import outbox
+from router import ButtonRouter
+from persistence import SQLitePersistence
+from webhook import UserOrderedUpdateProcessor, run_webhook
+from flood import FloodControl
+from tracing import TraceRecorder, TRACE_FILE
+from packer import pack, escape_markdown
 
 # load token from env
 from dotenv import load_dotenv
 import os
+import secrets
+import tempfile
 
 load_dotenv()
 
 TOKEN: Final = os.getenv("TOKEN")
-
-
-async def sleep_until(hour: int, minute: int, second: int):
-    """Asynchronous wait until specific hour, minute and second
-
-    Args:
-        hour (int): Hour
-        minute (int): Minute
-        second (int): Second
-
-    """
-    t = datetime.datetime.today()
-    future = datetime.datetime(t.year, t.month, t.day, hour, minute, second)
-    if t.timestamp() > future.timestamp():
-        future += datetime.timedelta(days=1)
-    await asyncio.sleep((future - t).total_seconds())
-
-
-
-
-engine = create_engine("sqlite+pysqlite:///database.db", echo=True)
-#create_database(engine.url)
-session = Session(engine)
-
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, Update, InlineKeyboardMarkup, InlineKeyboardButton
+METRICS_HOST: Final = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT: Final = int(os.getenv("METRICS_PORT", "0"))  # 0 disables the metrics endpoint
+MODE: Final = os.getenv("MODE", "polling")  # polling or webhook
+WEBHOOK_URL: Final = os.getenv("WEBHOOK_URL")  # the public https url Telegram sends the updates to
+WEBHOOK_SECRET: Final = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_HOST: Final = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT: Final = int(os.getenv("WEBHOOK_PORT", "8443"))
+# local: this process sends the reminders, workers: they are sent by the processes of workers.py
+REMINDERS: Final = os.getenv("REMINDERS", "local")
+UPDATE_CONCURRENCY: Final = int(os.getenv("UPDATE_CONCURRENCY", "64"))  # updates handled at the same time
+POLICY_FILE: Final = os.path.join(os.path.dirname(os.path.abspath(__file__)), "POLICY.md")
+
+
+from telegram import ReplyKeyboardMarkup, Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
     Application,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
     MessageHandler,
-    filters, PicklePersistence, CallbackQueryHandler,
+    filters, CallbackQueryHandler, TypeHandler,
 )
-
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.DEBUG
-)
-# set higher logging level for httpx to avoid all GET and POST requests being logged
-#logging.getLogger("httpx").setLevel(logging.WARNING)
+from telegram.error import BadRequest
 
 logger = logging.getLogger(__name__)
 
 NAME, SURNAME, DATETIME = range(3)
 
+activity = ActivityBuffer()
+birthday_cache = BirthdayCache()
+broadcaster: Broadcaster | None = None  # created with the application
+scheduler: ReminderScheduler | None = None
+metrics_server = None
+resuming: asyncio.Task | None = None  # the delivery of the outbox left by the previous run
 
-def remaining_months_and_days(birth: datetime.datetime) -> tuple[int, int]:
-    """Returns the remaining months and days until the next birthday"""
-    today = datetime.date.today()
-    # if the birthday has already passed this year, calculate the remaining time until next year's birthday
-    if today.month > birth.month or (today.month == birth.month and today.day > birth.day):
-        next_birthday = datetime.date(today.year + 1, birth.month, birth.day)
-    else:
-        # otherwise, calculate the remaining time until this year's birthday
-        next_birthday = datetime.date(today.year, birth.month, birth.day)
-    # calculate the difference between the two dates and return the remaining months and days
-    remaining = next_birthday - today
-    return remaining.days // 30, remaining.days % 30
-
-
-def calculate_age(born):
-    """Returns the age of a person given the date of birth"""
-    today = datetime.date.today()
-    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+metrics.Gauge("birthdaybot_cache_hits", "Birthday cache hits", lambda: birthday_cache.hits)
+metrics.Gauge("birthdaybot_cache_misses", "Birthday cache misses", lambda: birthday_cache.misses)
+metrics.Gauge("birthdaybot_scheduled_users", "Users in the reminder scheduler", lambda: len(scheduler or ()))
+metrics.Gauge("birthdaybot_pending_activity", "Users whose activity is waiting to be written",
+              lambda: activity.pending)
 
 
-def main_menu(t: TelegramUser) -> list[list[InlineKeyboardButton]]:
+async def main_menu(user_id: int) -> list[list[InlineKeyboardButton]]:
     """The main menu keyboard, with the options to add a birthday, list all birthdays and set reminders"""
-    global session  # this is needed to access the database
     final = []
     first_row = [
         InlineKeyboardButton("🎂➕ Add Birthday", callback_data="main_menu_add_birthday")
     ]
     # if there are birthdays in the database, add the option to list them, but not if they are anniversaries (not yet implemented)
-    if session.query(Birthday).filter(Birthday.user_id == t.id, Birthday.is_anniversary == False).count() > 0:
+    if await birthday_cache.has_birthdays(user_id):
         first_row.append(InlineKeyboardButton("🎂📒 List Birthdays", callback_data="main_menu_list_birthday"))
 
     final.append(first_row)
@@ -105,56 +98,49 @@ def main_menu(t: TelegramUser) -> list[list[InlineKeyboardButton]]:
     return final
 
 
-def db_user_ping(update: Update) -> list[bool, TelegramUser]:
-    """This is for updating the user in the database, whatever action he does, and creating it if it doesn't exist"""
-    global session
-    id_t: int = update.message.from_user.id
-    t = session.query(TelegramUser).filter(
-        TelegramUser.id == id_t).first()  # check if the user exists, and if it does, update it
-    new_user = t is None
-    if new_user:
-        t: TelegramUser = TelegramUser.from_user(update.message.from_user)
-        session.add(t)
-    else:
-        t.update_user(update.message.from_user)
-    session.commit()
-    return [new_user, t]
-
+async def db_user_ping(update: Update) -> bool:
+    """This is for updating the user in the database, whatever action he does, and creating it if it doesn't exist
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle the /start command, which is the first command that is sent when the user opens the bot"""
-
-    new_user, t = db_user_ping(update)  # update the user in the database
-    reply_keyboard = main_menu(t)  # get the main menu keyboard
+    Returns whether the user is new. Apart from the creation, the update is buffered and written in batch later.
+    """
+    new_user = await activity.ping(update.effective_user)
+    if new_user and scheduler is not None:
+        scheduler.schedule(update.effective_user.id, None, None)
+    return new_user
 
-    #if new user must send privacy policy from POLICY.md (chunked)
 
+@functools.cache
+def welcome_messages(new_user: bool) -> tuple[str, ...]:
+    """The messages of /start: the privacy policy from POLICY.md, only for a new user, followed by the welcome"""
+    lines = []
     if new_user:
-        with open("POLICY.md", "r") as file:
-           # split the text in chunks of 4096 characters, because Telegram has a limit of 4096 characters per message
-           # however, we do not split the text in the middle of a line, so we find the last newline character before the 4096th character
+        with open(POLICY_FILE, "r") as file:
+            lines = file.read().rstrip("\n").split("\n") + [""]
+    lines += [("Welcome!" if new_user else "Welcome back!"), "",
+              "This bot will help you keep track of your friends' birthdays and remind you when they are coming up."]
+    return tuple(pack(lines))
 
-            text = file.read()
-            while len(text) > 0:
-                split = text[:4096].rfind("\n")
-                await update.message.reply_text(text[:split], parse_mode="Markdown")
-                text = text[split + 1:]
 
-        
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /start command, which is the first command that is sent when the user opens the bot"""
 
-    # send the welcome message
+    new_user = await db_user_ping(update)  # update the user in the database
+    reply_keyboard = await main_menu(update.message.from_user.id)  # get the main menu keyboard
+
+    # the policy (for a new user) and the welcome, packed once in as few messages as possible
+    chunks = welcome_messages(new_user)
+    for chunk in chunks[:-1]:
+        await update.message.reply_text(chunk, parse_mode="Markdown")
     await update.message.reply_text(
-        ("Welcome!" if new_user else "Welcome back!") +
-        "\n\nThis bot will help you keep track of your friends' birthdays and remind you when they are coming up.\n\n",
+        chunks[-1], parse_mode="Markdown",
         reply_markup=ReplyKeyboardMarkup(
             reply_keyboard, one_time_keyboard=True, input_field_placeholder="Action"
         ),
     )
 
 
-
 async def add_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """Start the birthday adding conversation, asking for the name of the person"""
     reply_keyboard = [[
         InlineKeyboardButton("❌ Cancel", callback_data="main_menu")
@@ -171,14 +157,14 @@ async def add_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """Ask for the name of the person"""
     context.user_data["name"] = update.message.text.strip()
     reply_keyboard = [[
         InlineKeyboardButton("❌ Cancel", callback_data="main_menu")
     ]]
     await update.message.reply_text(  # ask for the surname
-        "Add the last name of *" + context.user_data["name"] + "*\n\n",
+        "Add the last name of " + escape_markdown(context.user_data["name"]) + "\n\n",
         reply_markup=ReplyKeyboardMarkup(
             reply_keyboard, one_time_keyboard=True
         ),
@@ -188,20 +174,18 @@ async def name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def surname(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """Ask for the last name of the person"""
-    global session
     context.user_data["surname"] = update.message.text.strip()
     reply_keyboard = [[
         InlineKeyboardButton("❌ Cancel", callback_data="main_menu")
     ]]
     # check if the person is already in the database, and if it is, ask for the name again
-    if session.query(Birthday).filter(Birthday.user_id == update.message.from_user.id,
-                                      Birthday.first_name == context.user_data["name"],
-                                      Birthday.last_name == context.user_data["surname"]).count() > 0:
+    if await run_db(birthday_exists, update.message.from_user.id, context.user_data["name"],
+                    context.user_data["surname"]):
         await update.message.reply_text(
-            "*" + context.user_data["name"] + " " + context.user_data[
-                "surname"] + "* is already in your database, set the name again or cancel the operation\n\n",
+            escape_markdown(context.user_data["name"] + " " + context.user_data["surname"]) +
+            " is already in your database, set the name again or cancel the operation\n\n",
             reply_markup=ReplyKeyboardMarkup(
                 reply_keyboard, one_time_keyboard=True
             ),
@@ -210,8 +194,8 @@ async def surname(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return NAME
     # otherwise, ask for the date of birth
     await update.message.reply_text(
-        "Add the date of birth of *" + context.user_data["name"] + " " + context.user_data["surname"] +
-        "* in the day/month/year format \n\n",
+        "Add the date of birth of " + escape_markdown(context.user_data["name"] + " " + context.user_data["surname"]) +
+        " in the day/month/year format \n\n",
         reply_markup=ReplyKeyboardMarkup(
             reply_keyboard, one_time_keyboard=True
         ),
@@ -221,7 +205,7 @@ async def surname(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def datetime_p(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """Ask for the date of birth"""
     context.user_data["datetime"] = update.message.text.strip()
     reply_keyboard = [[
@@ -232,100 +216,138 @@ async def datetime_p(update: Update, context: ContextTypes.DEFAULT_TYPE):
     surname = context.user_data["surname"].strip()
     dt = context.user_data["datetime"].strip()
     try:
-        datetime_object = datetime.datetime.strptime(dt, '%d/%m/%Y')
-    except ValueError:  # malformed
+        datetime_object = parse_birth_date(dt)
+    except FutureDate:
         await update.message.reply_text(
-            "Wrong date format, please try again\n\n",
+            "The date you entered is in the future, please try again\n\n",
             reply_markup=ReplyKeyboardMarkup(
                 reply_keyboard, one_time_keyboard=True
             )
         )
         return DATETIME
-    if datetime_object > datetime.datetime.now():  # future date?
+    except InvalidDate:  # malformed
         await update.message.reply_text(
-            "The date you entered is in the future, please try again\n\n",
+            "Wrong date format, please try again\n\n",
             reply_markup=ReplyKeyboardMarkup(
                 reply_keyboard, one_time_keyboard=True
             )
         )
         return DATETIME
     await update.message.reply_text(
-        "*Information saved*\n\nName: _" + name + "_ \nLast name: _" + surname + "_ \nDate of birth: _" + dt + "_\n\n",
+        "*Information saved*\n\nName: " + escape_markdown(name) + " \nLast name: " + escape_markdown(surname) +
+        " \nDate of birth: _" + dt + "_\n\n",
         reply_markup=ReplyKeyboardMarkup(
             reply_keyboard, one_time_keyboard=True
         ),
         parse_mode="Markdown"
     )
     # create and save
-    b = Birthday(first_name=name, last_name=surname, birth=datetime_object, user_id=update.message.from_user.id,
-                 is_anniversary=False)
-    session.add(b)
-    session.commit()
+    await run_db(insert_birthday, update.message.from_user.id, name, surname, datetime_object)
+    birthday_cache.invalidate(update.message.from_user.id)
     await start(update, context)
     return ConversationHandler.END
 
 
 async def end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    db_user_ping(update)
+    await db_user_ping(update)
     context.user_data.clear()
     await start(update, context)
     return ConversationHandler.END
 
-def sort_close(b: Birthday) -> int:
-    now = datetime.datetime.now()
-    datetime_bd = datetime.datetime(now.year, b.birth.month, b.birth.day)
-    if datetime_bd < now:
-        datetime_bd = datetime.datetime(now.year + 1, b.birth.month, b.birth.day)
-    return (datetime_bd - now).days
+LIST_PAGE_SIZE: Final = 10  # birthdays per page of the list
+
+
+def next_in(when: Occurrence) -> str:
+    """Pretty formatting of the remaining time until the next birthday"""
+    nmonths, ndays = when.months, when.remaining_days
+    nextin = ""
+    if nmonths > 0:
+        nextin += str(nmonths) + " months"
+    if ndays > 0 and nmonths > 0:
+        nextin += " and "
+    if ndays > 0:
+        nextin += str(ndays) + " days"
+    return nextin
+
+
+def list_entries(birthdays: list[Birthday], today: datetime.date) -> str:
+    """The birthdays as lines of a list, with the age, the time to the next birthday and the link to each one"""
+    text = ""
+    for b, when in zip(birthdays, occurrences([b.birth for b in birthdays], today)):
+        # the names are escaped, they are typed by the user and the list is in Markdown
+        text += "• " + escape_markdown(b.first_name) + " " + escape_markdown(b.last_name) + " " + \
+            b.birth.strftime("%d/%m/%Y") + "\n    *" + str(when.age) + "* years old\n    next in *" + \
+            next_in(when) + "\n    /view_bd_" + str(b.id) + "*\n"
+    return text
+
+
+async def list_page(user_id: int, page: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Render a page of the birthday list, in upcoming order, with the buttons to move between pages"""
+    today = datetime.date.today()
+    total, birthdays = await run_read(upcoming_birthdays, user_id, today, page * LIST_PAGE_SIZE, LIST_PAGE_SIZE)
+    pages = max(1, -(-total // LIST_PAGE_SIZE))
+    text = "*Birthdays* 🎂\n\n"
+    text += list_entries(birthdays, today)
+    if pages == 1:
+        return text, None
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"list_page_{page - 1}"))
+    navigation.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"list_page_{page}"))
+    if page + 1 < pages:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"list_page_{page + 1}"))
+    return text, InlineKeyboardMarkup([navigation])
+
 
 async def list_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
-    """List all the birthdays in the database"""
-    global session
-    today = datetime.datetime.now().date()
-    birthdays = session.query(Birthday).filter(Birthday.user_id == update.message.from_user.id).all()
-    # now order the birthdays by the remaining time until the next birthday
-    birthdays = sorted(birthdays, key=sort_close)
+    await db_user_ping(update)
+    """List the birthdays in the database, one page at a time"""
     reply_keyboard = [[
         InlineKeyboardButton("🏠 Home", callback_data="home")  # go back to the main menu
     ]]
-    messages = []
-    list = ""
-    for b in birthdays:
-        # calculate the remaining time until the next birthday
-        nmonths, ndays = remaining_months_and_days(b.birth)
-        nextin = ""
-        # pretty formatting of the remaining time
-        if nmonths > 0:
-            nextin += str(nmonths) + " months"
-        if ndays > 0 and nmonths > 0:
-            nextin += " and "
-        if ndays > 0:
-            nextin += str(ndays) + " days"
-        # add the birthday to the list
-        row = "• " + b.first_name + " " + b.last_name + " " + b.birth.strftime("%d/%m/%Y") + "\n    *" + str(
-            calculate_age(b.birth)) + "* years old\n    next in *" + nextin + "\n    /view_bd_" + str(b.id) + "*\n"
-        if len(list + row) > 3000:  # Telegram has a limit of 4096 characters per message, so we split the list in multiple messages
-            messages.append(list)  # add the current message to the list of messages
-            list = row
-        else:
-            list += row
-
-    if len(list) != 0:  # if there is some remaining text, add it to the list of messages as the last message
-        messages.append(list)
-
-    for m in messages:  # send all the messages
-        await update.message.reply_text(
-            "*Birthdays* 🎂\n\n" + m,
-            reply_markup=ReplyKeyboardMarkup(
-                reply_keyboard, one_time_keyboard=True
-            ),
-            parse_mode="Markdown"
-        )
+    text, navigation = await list_page(update.message.from_user.id, 0)
+    if navigation is None:  # everything fits in one page
+        await update.message.reply_text(text, reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True),
+                                        parse_mode="Markdown")
+        return
+    # a message cannot have both an inline keyboard and a reply keyboard, the Home button goes with a short message
+    await update.message.reply_text("📒", reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True))
+    await update.message.reply_text(text, reply_markup=navigation, parse_mode="Markdown")
+
+
+async def list_birthday_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Move to another page of the birthday list, editing the message in place"""
+    query = update.callback_query
+    await db_user_ping(update)
+    page = int(query.data.split("_")[-1])
+    text, navigation = await list_page(query.from_user.id, page)
+    await query.answer()
+    try:
+        await query.edit_message_text(text, reply_markup=navigation, parse_mode="Markdown")
+    except BadRequest as e:  # telegram refuses edits that change nothing, e.g. when pressing the page number
+        if "not modified" not in str(e):
+            raise
+
+
+async def find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/find <name>, the birthdays whose name matches, also partially or with typos"""
+    await db_user_ping(update)
+    typed = words(" ".join(context.args or ()))
+    if not typed:
+        await update.message.reply_text("Type a name after /find, e.g. /find mario")
+        return
+    birthdays = await run_read(search_birthdays, update.message.from_user.id, " ".join(typed))
+    if not birthdays:
+        await update.message.reply_text("🔎 No birthday matches " + escape_markdown(" ".join(typed)),
+                                        parse_mode="Markdown")
+        return
+    lines = list_entries(birthdays, datetime.date.today()).rstrip("\n").split("\n")
+    for chunk in pack(lines, header="*Found* 🔎\n"):
+        await update.message.reply_text(chunk, parse_mode="Markdown")
 
 
 async def view_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE, birthday_id: int = None):
-    db_user_ping(update)
+    await db_user_ping(update)
     """View a birthday in detail, with the possibility to edit or delete it"""
     reply_keyboard = [[
         InlineKeyboardButton("🏠 Home"),
@@ -334,20 +356,14 @@ async def view_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE, birt
     ]]
     if birthday_id is None:  # if the id is empty, return to the main menu
         birthday_id = update.message.text.strip().split("_")[-1]
-    b = session.query(Birthday).filter(Birthday.id == birthday_id).first()
-    if b is not None and b.user_id == update.message.from_user.id:  # check if the birthday exists and belongs to the user
+    b = await birthday_cache.get_birthday(update.message.from_user.id, birthday_id)
+    if b is not None:  # the birthday exists and belongs to the user
         context.user_data["view_bd_id"] = birthday_id
-        nmonths, ndays = remaining_months_and_days(b.birth)
-        nextin = ""
-        if nmonths > 0:
-            nextin += str(nmonths) + " months"
-        if ndays > 0 and nmonths > 0:
-            nextin += " and "
-        if ndays > 0:
-            nextin += str(ndays) + " days"
+        when = occurrence(b.birth, datetime.date.today())
+        nextin = next_in(when)
         await update.message.reply_text(
-            b.first_name + " " + b.last_name + " " + b.birth.strftime("%d/%m/%Y") + "\n    *" + str(
-                calculate_age(b.birth)) + "* years old\n    next in *" + nextin + "\n*\n",
+            escape_markdown(b.first_name + " " + b.last_name) + " " + b.birth.strftime("%d/%m/%Y") + "\n    *" + str(
+                when.age) + "* years old\n    next in *" + nextin + "\n*\n",
             reply_markup=ReplyKeyboardMarkup(
                 reply_keyboard, one_time_keyboard=True
             ),
@@ -355,11 +371,11 @@ async def view_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE, birt
 
 
 async def delete_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """ask for confirmation for the deletion of a birthday"""
     bdid = context.user_data["view_bd_id"]
-    b = session.query(Birthday).filter(Birthday.id == bdid).first()
-    if b is not None and b.user_id == update.message.from_user.id:
+    b = await birthday_cache.get_birthday(update.message.from_user.id, bdid)
+    if b is not None:
         # are you sure?
         keyboard = [
             [InlineKeyboardButton("✅ Yes, delete")],
@@ -367,18 +383,18 @@ async def delete_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
 
         await update.message.reply_text(
-            "Are you sure you want to delete the entry for *" + b.first_name + " " + b.last_name + "*?",
+            "Are you sure you want to delete the entry for " + escape_markdown(b.first_name + " " + b.last_name) + "?",
             reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, input_field_placeholder="Action"),
 
             parse_mode="Markdown")
 
 
 async def edit_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """ask for confirmation for the deletion of a birthday"""
     bdid = context.user_data["view_bd_id"]
-    b = session.query(Birthday).filter(Birthday.id == bdid).first()
-    if b is not None and b.user_id == update.message.from_user.id:
+    b = await birthday_cache.get_birthday(update.message.from_user.id, bdid)
+    if b is not None:
         # which field do you want to edit?
         keyboard = [
             [InlineKeyboardButton("📅 Date of birth")],
@@ -393,14 +409,14 @@ async def edit_birthday(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def edit_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """allow to edit the date of birth of a birthday"""
     keyboard = [
         [InlineKeyboardButton("❌ Cancel")]
     ]
     bdid = context.user_data["view_bd_id"]
-    b = session.query(Birthday).filter(Birthday.id == bdid).first()
-    if b is not None and b.user_id == update.message.from_user.id:
+    b = await birthday_cache.get_birthday(update.message.from_user.id, bdid)
+    if b is not None:
         # ask for the new date of birth
         await update.message.reply_text("Enter the new date of birth in the format DD/MM/YYYY",
                                         reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True,
@@ -416,14 +432,14 @@ async def edit_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """allow to edit the first name of a birthday"""
     keyboard = [
         [InlineKeyboardButton("❌ Cancel")]
     ]
     bdid = context.user_data["view_bd_id"]
-    b = session.query(Birthday).filter(Birthday.id == bdid).first()
-    if b is not None and b.user_id == update.message.from_user.id:
+    b = await birthday_cache.get_birthday(update.message.from_user.id, bdid)
+    if b is not None:
         # ask for the new first name
         await update.message.reply_text("Enter the new first name",
                                         reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True,
@@ -439,14 +455,14 @@ async def edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def edit_surname(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """allow to edit the last name of a birthday"""
     keyboard = [
         [InlineKeyboardButton("❌ Cancel")]
     ]
     bdid = context.user_data["view_bd_id"]
-    b = session.query(Birthday).filter(Birthday.id == bdid).first()
-    if b is not None and b.user_id == update.message.from_user.id:
+    b = await birthday_cache.get_birthday(update.message.from_user.id, bdid)
+    if b is not None:
         # ask for the new last name
         await update.message.reply_text("Enter the new last name",
                                         reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True,
@@ -462,25 +478,25 @@ async def edit_surname(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def edit_date_data(update: Update, context: ContextTypes):
-    db_user_ping(update)
+    await db_user_ping(update)
     """edit the date of birth of a birthday"""
     bdid = context.user_data["view_bd_id"]
-    b = session.query(Birthday).filter(Birthday.id == bdid).first()
-    if b is not None and b.user_id == update.message.from_user.id:
+    b = await birthday_cache.get_birthday(update.message.from_user.id, bdid)
+    if b is not None:
         try:
-            date = datetime.datetime.strptime(update.message.text, "%d/%m/%Y")
-            b.birth = date
-            session.commit()
+            date = parse_birth_date(update.message.text)
             await start(update, context)
-            if datetime.datetime.now() < date:
-                await update.message.reply_text("⚠️ The date of birth is in the future, type it again or cancel")
-                return DATETIME
-            else:
-                await update.message.reply_text("✅ Date of birth updated")
+            await run_db(update_birthday, update.message.from_user.id, bdid, birth=date)
+            birthday_cache.invalidate(update.message.from_user.id)
+            await update.message.reply_text("✅ Date of birth updated")
             await view_birthday(update, context, bdid)
 
             return ConversationHandler.END
-        except ValueError:
+        except FutureDate:  # do not save it
+            await start(update, context)
+            await update.message.reply_text("⚠️ The date of birth is in the future, type it again or cancel")
+            return DATETIME
+        except InvalidDate:
             await update.message.reply_text("⚠️ Invalid date format")
             await edit_date(update, context)
             return DATETIME
@@ -491,13 +507,12 @@ async def edit_date_data(update: Update, context: ContextTypes):
 
 
 async def edit_name_data(update: Update, context: ContextTypes):
-    db_user_ping(update)
+    await db_user_ping(update)
     """edit the first name of a birthday"""
     bdid = context.user_data["view_bd_id"]
-    b = session.query(Birthday).filter(Birthday.id == bdid).first()
-    if b is not None and b.user_id == update.message.from_user.id:
-        b.first_name = update.message.text
-        session.commit()
+    b = await run_db(update_birthday, update.message.from_user.id, bdid, first_name=update.message.text)
+    birthday_cache.invalidate(update.message.from_user.id)
+    if b is not None:
         await start(update, context)
         await update.message.reply_text("✅ First name updated")
         await view_birthday(update, context, bdid)
@@ -509,13 +524,12 @@ async def edit_name_data(update: Update, context: ContextTypes):
 
 
 async def edit_surname_data(update: Update, context: ContextTypes):
-    db_user_ping(update)
+    await db_user_ping(update)
     """edit the last name of a birthday"""
     bdid = context.user_data["view_bd_id"]
-    b = session.query(Birthday).filter(Birthday.id == bdid).first()
-    if b is not None and b.user_id == update.message.from_user.id:
-        b.last_name = update.message.text
-        session.commit()
+    b = await run_db(update_birthday, update.message.from_user.id, bdid, last_name=update.message.text)
+    birthday_cache.invalidate(update.message.from_user.id)
+    if b is not None:
         await start(update, context)
         await update.message.reply_text("✅ Last name updated")
         await view_birthday(update, context, bdid)
@@ -527,13 +541,11 @@ async def edit_surname_data(update: Update, context: ContextTypes):
 
 
 async def delete_birthday_confirmed(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_user_ping(update)
+    await db_user_ping(update)
     """delete a birthday"""
     bdid = context.user_data["view_bd_id"]
-    b = session.query(Birthday).filter(Birthday.id == bdid).first()
-    if b is not None and b.user_id == update.message.from_user.id:
-        session.delete(b)
-        session.commit()
+    if await run_db(remove_birthday, update.message.from_user.id, bdid):
+        birthday_cache.invalidate(update.message.from_user.id)
         await update.message.reply_text("✅ Birthday deleted")
         await start(update, context)
     else:
@@ -544,14 +556,71 @@ async def delete_birthday_confirmed(update: Update, context: ContextTypes.DEFAUL
 async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """show info about the bot"""
     await update.message.reply_text("This bot is made by @matmasak.\n"
-                                    "The source code is available on [GitHub](https://github.com/MatMasIt/birthdaybot)", parse_mode="Markdown")
+                                    "The source code is available on [GitHub](https://github.com/MatMasIt/birthdaybot)\n\n"
+                                    "To add many birthdays at once, send a CSV file (first name, last name, date "
+                                    "of birth columns) or a vCard (.vcf) file exported from your contacts\n\n"
+                                    "/export sends your birthdays as a CSV file, /export ics as a calendar to "
+                                    "import in your calendar app\n\n"
+                                    "/find followed by a name looks it up in your birthdays", parse_mode="Markdown")
+
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Import the birthdays of an uploaded CSV or vCard file"""
+    await db_user_ping(update)
+    document = update.message.document
+    kind = file_kind(document.file_name, document.mime_type)
+    if kind is None:
+        await update.message.reply_text("⚠️ Only CSV and vCard (.vcf) files can be imported")
+        return
+    if document.file_size and document.file_size > MAX_FILE_SIZE:
+        await update.message.reply_text("⚠️ The file is too large")
+        return
+    user_id = update.message.from_user.id
+    file = await document.get_file()
+    with tempfile.TemporaryDirectory() as directory:
+        path = await file.download_to_drive(os.path.join(directory, "import"))
+        result = await run_db(import_file, user_id, str(path), kind)
+    if result.added:
+        birthday_cache.invalidate(user_id)
+    text = f"✅ {result.added} birthdays imported"
+    if result.duplicates:
+        text += f"\n{result.duplicates} already in your list, skipped"
+    if result.invalid:
+        text += f"\n⚠️ {result.invalid} not valid, skipped:\n" + "\n".join(result.errors)
+        if result.invalid > len(result.errors):
+            text += "\n…"
+    await update.message.reply_text(text)
+
+
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [csv|ics], send the birthdays as a CSV file or as a calendar with a yearly event for each one"""
+    await db_user_ping(update)
+    user_id = update.message.from_user.id
+    kind = "ics" if context.args and context.args[0].lower() in ("ics", "ical", "calendar") else "csv"
+    file_id = await run_read(cached_export, user_id, kind)
+    if file_id is not None:  # nothing changed since the last export
+        try:
+            await update.message.reply_document(file_id)
+            return
+        except BadRequest:  # no longer known to telegram, send a new one
+            pass
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, FILE_NAMES[kind])
+        version, count = await run_read(write_export, user_id, kind, path)
+        if not count:
+            await update.message.reply_text("⚠️ There are no birthdays to export")
+            return
+        with open(path, "rb") as file:
+            message = await update.message.reply_document(file, filename=FILE_NAMES[kind])
+    await run_db(store_export, user_id, kind, version, message.document.file_id)
 
 
 async def reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
 
     ]
-    _, t = db_user_ping(update)
+    await db_user_ping(update)
+    t = await run_db(get_user, update.message.from_user.id)
     if t.weekly:
         keyboard.append([InlineKeyboardButton("✅ Weekly")])
     else:
@@ -567,202 +636,245 @@ async def reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         keyboard.append([InlineKeyboardButton("❌ Daily")])
     keyboard.append([InlineKeyboardButton("🏠 Home")])
-    await update.message.reply_text("Choose which reminders you want to receive",
+    minute = remind_minute(t.id, t.remind_at)
+    await update.message.reply_text("Choose which reminders you want to receive\n\n"
+                                    f"They are sent at {minute // 60:02d}:{minute % 60:02d} ({zone(t.timezone).key}), "
+                                    "use /time HH:MM and /timezone Area/City to change it",
                                     reply_markup=ReplyKeyboardMarkup(keyboard))
 
 
+async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/timezone Area/City, the timezone used for the reminders"""
+    await db_user_ping(update)
+    if len(context.args) != 1 or not is_timezone(context.args[0]):
+        await update.message.reply_text("⚠️ Send the timezone as /timezone Area/City, for example /timezone Europe/Rome")
+        return
+    t = await run_db(set_schedule, update.message.from_user.id, timezone=context.args[0])
+    if scheduler is not None:  # otherwise the workers pick up the change
+        scheduler.schedule(t.id, t.timezone, t.remind_at)
+    await reminders(update, context)
+
+
+async def set_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/time HH:MM, the time of the day at which the reminders are sent"""
+    await db_user_ping(update)
+    try:
+        at = datetime.datetime.strptime(context.args[0], "%H:%M")
+    except (IndexError, ValueError):
+        await update.message.reply_text("⚠️ Send the time as /time HH:MM, for example /time 08:30")
+        return
+    t = await run_db(set_schedule, update.message.from_user.id, remind_at=at.hour * 60 + at.minute)
+    if scheduler is not None:  # otherwise the workers pick up the change
+        scheduler.schedule(t.id, t.timezone, t.remind_at)
+    await reminders(update, context)
+
+
 async def weekly_on(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _, t = db_user_ping(update)
-    t.weekly = True
-    session.commit()
+    await db_user_ping(update)
+    await run_db(set_reminder, update.message.from_user.id, "weekly", True)
     await reminders(update, context)
 
 
 async def weekly_off(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _, t = db_user_ping(update)
-    t.weekly = False
-    session.commit()
+    await db_user_ping(update)
+    await run_db(set_reminder, update.message.from_user.id, "weekly", False)
     await reminders(update, context)
 
 
 async def monthly_on(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _, t = db_user_ping(update)
-    t.monthly = True
-    session.commit()
+    await db_user_ping(update)
+    await run_db(set_reminder, update.message.from_user.id, "monthly", True)
     await reminders(update, context)
 
 
 async def monthly_off(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _, t = db_user_ping(update)
-    t.monthly = False
-    session.commit()
+    await db_user_ping(update)
+    await run_db(set_reminder, update.message.from_user.id, "monthly", False)
     await reminders(update, context)
 
 
 async def daily_on(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _, t = db_user_ping(update)
-    t.dailiy = True
-    session.commit()
+    await db_user_ping(update)
+    await run_db(set_reminder, update.message.from_user.id, "dailiy", True)
     await reminders(update, context)
 
 
 async def daily_off(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _, t = db_user_ping(update)
-    t.dailiy = False
-    session.commit()
+    await db_user_ping(update)
+    await run_db(set_reminder, update.message.from_user.id, "dailiy", False)
     await reminders(update, context)
 
 
-async def report(application: Application):
-    global session
-    while True:
-        for user in session.query(TelegramUser).all():
-            if datetime.datetime.now().day == 1 and user.monthly:
-                messages = []
-                text = ""
-                bds = session.query(Birthday).filter(Birthday.user_id == user.id).all()
-                if len(bds) == 0:
-                    bds = sorted(bds, key=lambda x: x.birth.month + x.birth.day / 100)
-                    for b in session.query(Birthday).filter(Birthday.user_id == user.id).all():
-                        if b.birth.month == datetime.datetime.now().month:
-                            tt = f"{b.first_name} {b.last_name} - {b.birth.day}/{b.birth.month}/{b.birth.year}, {calculate_age(b.birth)} years\n"
-                            if len(text) + len(tt) > 4096:
-                                messages.append(text)
-                                text = tt
-                            else:
-                                text += tt
-                        if len(text) > 0:
-                            messages.append(text)
-
-                    if len(messages) > 0:
-                        await application.bot.send_message(chat_id=user.id, text="*Birthdays in this month*\n",
-                                                           parse_mode="Markdown")
-                    for m in messages:
-                        await application.bot.send_message(chat_id=user.id, text=m)
-            elif datetime.datetime.now().weekday() == 0 and user.weekly:
-                messages = []
-                text = ""
-                bds = session.query(Birthday).filter(Birthday.user_id == user.id).all()
-                if len(bds):
-                    bds = sorted(bds, key=lambda x: x.birth.month + x.birth.day / 100)
-                    for b in session.query(Birthday).filter(Birthday.user_id == user.id).all():
-                        # check if date falls in this week
-                        if b.birth.month == datetime.datetime.now().month and datetime.datetime.now().day <= b.birth.day < datetime.datetime.now().day + 7:
-                            tt = f"{b.first_name} {b.last_name} - {b.birth.day}/{b.birth.month}/{b.birth.year}, {calculate_age(b.birth)} anni\n"
-                            if len(text) + len(tt) > 4096:
-                                messages.append(text)
-                                text = tt
-                            else:
-                                text += tt
-                    if len(text) > 0:
-                        messages.append(text)
-
-                    if len(messages) > 0:
-                        await application.bot.send_message(chat_id=user.id, text="*Birthdays in this week*\n",
-                                                           parse_mode="Markdown")
-                    for m in messages:
-                        await application.bot.send_message(chat_id=user.id, text=m)
-            else:
-                # daily
-                messages = []
-                text = ""
-                bds = session.query(Birthday).filter(Birthday.user_id == user.id).all()
-                if len(bds):
-                    bds = sorted(bds, key=lambda x: x.birth.month + x.birth.day / 100)
-                    for b in bds:
-                        if b.birth.month == datetime.datetime.now().month and b.birth.day == datetime.datetime.now().day:
-                            tt = f"{b.first_name} {b.last_name} - {b.birth.day}/{b.birth.month}/{b.birth.year}, {calculate_age(b.birth)} anni\n"
-                            if len(text) + len(tt) > 4096:
-                                messages.append(text)
-                                text = tt
-                            else:
-                                text += tt
-                    if len(text) > 0:
-                        messages.append(text)
-                    if len(messages) > 0:
-                        await application.bot.send_message(chat_id=user.id, text="*Birthdays today*\n",
-                                                           parse_mode="Markdown")
-                    for m in messages:
-                        await application.bot.send_message(chat_id=user.id, text=m)
-        await sleep_until(0, 0, 0)
+async def correlate_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Tag the logs of the update with its id and its user, also those of the database threads and of the tasks it
+    starts"""
+    logconfig.correlate(update.update_id, update.effective_user.id if update.effective_user else None)
 
 
-def main() -> None:
-    """Run the bot."""
-    # Create the Application and pass it your bot's token.
-    persistence = PicklePersistence(filepath="conversationbot")
-    application = Application.builder().token(TOKEN).persistence(persistence).build()
+async def post_init(application: Application) -> None:
+    global broadcaster, scheduler, metrics_server, resuming
+    if METRICS_PORT:
+        metrics_server = await metrics.serve_metrics(METRICS_HOST, METRICS_PORT)
+    activity.start()
+    welcome_messages(True)  # the policy is read and packed once, not at the first new user
+    broadcaster = Broadcaster(application.bot)
+    if REMINDERS == "local":
+        await run_db(outbox.prune)
+        # what the previous run planned but did not send, in the background
+        resuming = asyncio.create_task(outbox.deliver(broadcaster, await run_db(outbox.pending)))
+        scheduler = ReminderScheduler(lambda due: report(broadcaster, due))
+        scheduler.load(await run_db(user_schedules))
+        scheduler.start()
+
+
+async def post_stop(application: Application) -> None:
+    # the updates the flood control deferred in tasks of their own, before the bot is shut down
+    if isinstance(application.update_processor, UserOrderedUpdateProcessor):
+        await application.update_processor.drain()
+
+
+async def post_shutdown(application: Application) -> None:
+    if scheduler is not None:
+        await scheduler.stop()
+    if resuming is not None:
+        resuming.cancel()
+        await asyncio.gather(resuming, return_exceptions=True)
+    await activity.stop()  # do not lose the last seconds of activity
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+def build_application(token: str = TOKEN, base_url: str | None = None, persistence=None,
+                      concurrency: int = 1, flood_control: bool = True, trace_file: str | None = TRACE_FILE
+                      ) -> Application:
+    """Create the Application with all the handlers of the bot
+
+    Args:
+        token (str): The bot token
+        base_url (str | None): Bot API base url, to point the bot to a local Bot API server (or the fake one of the
+            benchmarks)
+        persistence: The conversation persistence, None for none
+        concurrency (int): How many updates are handled at the same time, the updates of a same user are always
+            handled in order
+        flood_control (bool): Limit the updates of every user before they are handled (see flood)
+        trace_file (str | None): Record the incoming updates, anonymized, to this file (see tracing)
+    """
+    builder = Application.builder().token(token).post_init(post_init).post_stop(post_stop) \
+        .post_shutdown(post_shutdown)
+    if base_url is not None:  # the files are served next to the methods, as by the local Bot API server
+        builder = builder.base_url(base_url).base_file_url(base_url.rsplit("/bot", 1)[0] + "/file/bot")
+    # the updates always go through the processor, for its flood control, even if they are handled one at a time
+    flood = FloodControl() if flood_control else None
+    recorder = TraceRecorder(trace_file) if trace_file else None
+    builder = builder.concurrent_updates(UserOrderedUpdateProcessor(concurrency, flood, recorder=recorder))
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = builder.build()
 
     start_handler = CommandHandler("start", start)
+    cancel = filters.Text(["❌ Cancel"])
 
     birthday_conversation = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex("🎂➕ Add Birthday"), add_birthday)],
+        entry_points=[MessageHandler(filters.Text(["🎂➕ Add Birthday"]), add_birthday)],
         states={
             NAME: [
-                MessageHandler(filters.Regex("❌ Cancel"), end),
+                MessageHandler(cancel, end),
                 MessageHandler(filters.TEXT, name),
             ],
             SURNAME: [
-                MessageHandler(filters.Regex("❌ Cancel"), end),
+                MessageHandler(cancel, end),
                 MessageHandler(filters.TEXT, surname),
             ],
             DATETIME: [
-                MessageHandler(filters.Regex("❌ Cancel"), end),
+                MessageHandler(cancel, end),
                 MessageHandler(filters.TEXT, datetime_p),
             ]
         },
-        fallbacks=[MessageHandler(filters.Regex("❌ Cancel"), end)],
-
+        fallbacks=[MessageHandler(cancel, end)],
+        name="add_birthday",
+        persistent=persistence is not None,
     )
 
     edit_conversation = ConversationHandler(
         entry_points=[
-            MessageHandler(filters.Regex("📅 Date of birth"), edit_date),
-            MessageHandler(filters.Regex("👤 First name"), edit_name),
-            MessageHandler(filters.Regex("👤 Last name"), edit_surname)
+            MessageHandler(filters.Text(["📅 Date of birth"]), edit_date),
+            MessageHandler(filters.Text(["👤 First name"]), edit_name),
+            MessageHandler(filters.Text(["👤 Last name"]), edit_surname)
         ],
         states={
             NAME: [
-                MessageHandler(filters.Regex("❌ Cancel"), end),
+                MessageHandler(cancel, end),
                 MessageHandler(filters.TEXT, edit_name_data),
             ],
             SURNAME: [
-                MessageHandler(filters.Regex("❌ Cancel"), end),
+                MessageHandler(cancel, end),
                 MessageHandler(filters.TEXT, edit_surname_data),
             ],
             DATETIME: [
-                MessageHandler(filters.Regex("❌ Cancel"), end),
+                MessageHandler(cancel, end),
                 MessageHandler(filters.TEXT, edit_date_data),
             ]
         },
-        fallbacks=[MessageHandler(filters.Regex("❌ Cancel"), end)],
-
+        fallbacks=[MessageHandler(cancel, end)],
+        name="edit_birthday",
+        persistent=persistence is not None,
     )
 
+    # every other button of the keyboards, routed by its exact label
+    buttons = ButtonRouter()
+    buttons.add("🎂📒 List Birthdays", list_birthday)
+    buttons.add("🏠 Home", start)
+    buttons.add("🗑️ Delete", delete_birthday)
+    buttons.add("📝 Edit", edit_birthday)
+    buttons.add("✅ Yes, delete", delete_birthday_confirmed)
+    buttons.add("🔔 Set reminders", reminders)
+    buttons.add("ℹ️ About", about)
+    buttons.add("✅ Weekly", weekly_off)
+    buttons.add("❌ Weekly", weekly_on)
+    buttons.add("✅ Daily", daily_off)
+    buttons.add("❌ Daily", daily_on)
+    buttons.add("✅ Monthly", monthly_off)
+    buttons.add("❌ Monthly", monthly_on)
+    buttons.add_prefix("/view_bd_", view_birthday)
+    labels = [*buttons.labels, "🎂➕ Add Birthday", "📅 Date of birth", "👤 First name", "👤 Last name", "❌ Cancel"]
+    # a button pressed twice in a row is handled once; the text typed in the conversations is never coalesced
+    if flood is not None:
+        flood.buttons.update(labels)
+    if recorder is not None:  # the labels are recorded as they are, the other texts are masked
+        recorder.keep.update(labels)
+
     application.add_handlers([start_handler,
                               birthday_conversation,
-                              MessageHandler(filters.Regex("🎂📒 List Birthdays"), list_birthday),
-                              MessageHandler(filters.Regex("🏠 Home"), start),
-                              MessageHandler(filters.Regex("🗑️ Delete"), delete_birthday),
-                              MessageHandler(filters.Regex("📝 Edit"), edit_birthday),
-                              MessageHandler(filters.Regex("✅ Yes, delete"), delete_birthday_confirmed),
-                              MessageHandler(filters.Regex("^(/view_bd_[\d]+)$"), view_birthday),
+                              buttons,
+                              CallbackQueryHandler(list_birthday_page, pattern="^list_page_[0-9]+$"),
                               edit_conversation,
-                              MessageHandler(filters.Regex("👤 First name"), edit_name),
-                              MessageHandler(filters.Regex("👤 Last name"), edit_surname),
-                              MessageHandler(filters.Regex("🔔 Set reminders"), reminders),
-                              MessageHandler(filters.Regex("ℹ️ About"), about),
-                              MessageHandler(filters.Regex("✅ Weekly"), weekly_off),
-                              MessageHandler(filters.Regex("❌ Weekly"), weekly_on),
-                              MessageHandler(filters.Regex("✅ Daily"), daily_off),
-                              MessageHandler(filters.Regex("❌ Daily"), daily_on),
-                              MessageHandler(filters.Regex("✅ Monthly"), monthly_off),
-                              MessageHandler(filters.Regex("❌ Monthly"), monthly_on),
+                              CommandHandler("timezone", set_timezone),
+                              CommandHandler("time", set_time),
+                              CommandHandler("export", export),
+                              CommandHandler("find", find),
+                              MessageHandler(filters.Document.ALL, import_document),
                               ])
+    for handlers in application.handlers.values():
+        metrics.instrument_handlers(handlers)
+    # before every other handler, not timed: it only tags the logs of the update
+    application.add_handler(TypeHandler(Update, correlate_update), group=-1)
+    return application
+
 
-    threading.Thread(target=asyncio.run, args=(report(application),)).start()
-    # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+def main() -> None:
+    """Run the bot."""
+    logconfig.setup_logging()
+    upgrade(get_engine())  # bring the database schema up to date
+    if MODE == "webhook" and not WEBHOOK_URL:
+        raise SystemExit("WEBHOOK_URL is required in webhook mode")
+    # the same in both modes: the processor keeps the updates of a user in order, and a user being slowed down by the
+    # flood control does not hold back the others
+    application = build_application(persistence=SQLitePersistence(), concurrency=UPDATE_CONCURRENCY)
+    if MODE == "webhook":
+        asyncio.run(run_webhook(application, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET))
+    else:
+        # Run the bot until the user presses Ctrl-C
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
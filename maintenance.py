@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""Database maintenance, to run from cron or before (re)starting the bot: python maintenance.py
+
+Brings the schema up to date, deletes the reminders delivered more than KEEP_DAYS days ago and the heartbeats of
+the reminder workers that are gone, and lets SQLite refresh the statistics of its query planner. Neither telegram
+nor the handlers of the bot are imported.
+"""
+from __future__ import annotations
+
+import logging
+import time
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from dataTypes import WorkerHeartbeat
+from database import get_engine
+from logconfig import setup_logging
+from migrations import upgrade
+from outbox import prune
+
+logger = logging.getLogger(__name__)
+
+
+def run_maintenance() -> dict[str, int]:
+    """Run every maintenance task; returns what was done"""
+    engine = get_engine()
+    version = upgrade(engine)
+    with Session(engine) as session:
+        pruned = prune(session)
+        heartbeats = session.execute(delete(WorkerHeartbeat).where(WorkerHeartbeat.expires <= time.time())).rowcount
+        session.commit()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
+    return {"schema_version": version, "pruned_reminders": pruned, "expired_heartbeats": heartbeats}
+
+
+if __name__ == "__main__":
+    setup_logging()
+    logger.info("Maintenance done: %s", run_maintenance())
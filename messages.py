@@ -0,0 +1,19 @@
+"""The messages sent outside of the handlers, i.e. the reminders
+
+They are kept apart from the sender, so that they can be planned and stored without importing telegram.
+"""
+from __future__ import annotations
+
+from typing import NamedTuple
+
+
+class OutgoingMessage(NamedTuple):
+    text: str
+    parse_mode: str | None = None
+
+
+class Delivery(NamedTuple):
+    """All the messages for one chat, they are sent in order"""
+    chat_id: int
+    messages: list[OutgoingMessage]
+    key: object = None  # identifies the delivery for the caller, e.g. its outbox row
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a cached lookup to a slow broadcast
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+_registry: list = []
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()  # the database threads update some of them
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        if not self._values:
+            yield f"{self.name} 0"
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_labels(dict(key))} {value}"
+
+
+class Gauge:
+    """A value read when the metrics are rendered"""
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+        _registry.append(self)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.read()}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._values: dict[tuple, list] = {}  # labels: [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, data in list(self._values.items()):
+            labels = dict(key)
+            for bound, count in zip(self.buckets, data):
+                yield f"{self.name}_bucket{_labels({**labels, 'le': bound})} {count}"
+            yield f"{self.name}_bucket{_labels({**labels, 'le': '+Inf'})} {data[-1]}"
+            yield f"{self.name}_sum{_labels(labels)} {data[-2]}"
+            yield f"{self.name}_count{_labels(labels)} {data[-1]}"
+
+
+def render() -> str:
+    """All the metrics, in the Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_SECONDS = Histogram("birthdaybot_handler_seconds", "Time spent handling an update, per handler")
+HANDLER_ERRORS = Counter("birthdaybot_handler_errors_total", "Handlers that raised, per handler")
+SQL_QUERIES = Counter("birthdaybot_sql_queries_total", "SQL statements executed")
+SQL_SECONDS = Counter("birthdaybot_sql_seconds_total", "Time spent executing SQL statements")
+UPDATE_SQL_QUERIES = Histogram("birthdaybot_update_sql_queries", "SQL statements per update, per handler",
+                               COUNT_BUCKETS)
+UPDATE_SQL_SECONDS = Histogram("birthdaybot_update_sql_seconds", "Time spent in SQL per update, per handler")
+REMINDER_RUN_SECONDS = Histogram("birthdaybot_reminder_run_seconds", "Duration of a reminder run (plan and send)")
+MESSAGES_SENT = Counter("birthdaybot_messages_sent_total", "Messages sent by the broadcaster")
+MESSAGES_FAILED = Counter("birthdaybot_messages_failed_total", "Messages the broadcaster gave up on")
+RATE_LIMITED = Counter("birthdaybot_rate_limited_total", "RetryAfter answers received from Telegram")
+THROTTLE_SECONDS = Counter("birthdaybot_throttle_seconds_total", "Time spent waiting for the send rate limits")
+
+
+class _UpdateSQL:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# the SQL done on behalf of the update being handled; run_db copies the context, so it follows into the db threads
+_update_sql: contextvars.ContextVar[_UpdateSQL | None] = contextvars.ContextVar("update_sql", default=None)
+
+
+def instrument_engine(engine) -> None:
+    """Count the statements executed through the engine, and the time spent in them"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        SQL_QUERIES.inc()
+        SQL_SECONDS.inc(elapsed)
+        current = _update_sql.get()
+        if current is not None:
+            current.queries += 1
+            current.seconds += elapsed
+
+
+def timed(callback: Callable, name: str | None = None) -> Callable:
+    """Wrap a handler callback to measure its latency and the SQL it runs"""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        sql = _UpdateSQL()
+        token = _update_sql.set(sql)
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+            UPDATE_SQL_QUERIES.observe(sql.queries, handler=name)
+            UPDATE_SQL_SECONDS.observe(sql.seconds, handler=name)
+            _update_sql.reset(token)
+
+    return wrapper
+
+
+def instrument_handlers(handlers) -> None:
+    """Wrap the callbacks of the given handlers, and of the ones nested in conversations, with `timed`"""
+    from telegram.ext import ConversationHandler
+
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state in handler.states.values():
+                instrument_handlers(state)
+            instrument_handlers(handler.fallbacks)
+        elif hasattr(handler, "wrap_callbacks"):  # the button router, its callback is only a dispatcher
+            handler.wrap_callbacks(timed)
+        elif getattr(handler, "callback", None) is not None and not hasattr(handler.callback, "__wrapped__"):
+            handler.callback = timed(handler.callback)
+
+
+async def serve_metrics(host: str, port: int):
+    """Expose the metrics at http://host:port/metrics"""
+    from httpserver import Response, serve
+
+    async def handle(request):
+        if request.path.split("?", 1)[0] != "/metrics":
+            return Response(404)
+        return Response(200, render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+
+    server = await serve(handle, host, port)
+    logger.info("Metrics available on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""Versioned schema migrations
+
+The schema version is stored in SQLite's `user_version` pragma. Each migration is a function that receives a
+connection inside a transaction; new migrations are appended to MIGRATIONS and never edited once released.
+Migrations are written so that they also work on databases that were created by `Base.metadata.create_all`.
+
+Run this file to upgrade a database in place: python migrations.py
+"""
+from __future__ import annotations
+
+import logging
+from typing import Callable
+
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(conn: Connection, table: str) -> set[str]:
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info('{table}')")}
+
+
+def _add_column(conn: Connection, table: str, column: str, definition: str) -> None:
+    if column not in _columns(conn, table):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _baseline(conn: Connection) -> None:
+    """The schema as it was before migrations existed"""
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS user (
+            id INTEGER NOT NULL,
+            username VARCHAR,
+            first_name VARCHAR,
+            last_name VARCHAR,
+            language_code VARCHAR,
+            last_seen DATETIME,
+            monthly BOOLEAN,
+            weekly BOOLEAN,
+            dailiy BOOLEAN,
+            PRIMARY KEY (id)
+        )""")
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS birthday (
+            id INTEGER NOT NULL,
+            first_name VARCHAR,
+            last_name VARCHAR,
+            birth DATETIME,
+            user_id INTEGER,
+            is_anniversary BOOLEAN,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES user (id)
+        )""")
+
+
+def _birthday_indexes(conn: Connection) -> None:
+    """Index the birthdays by user, by name and by day of the year"""
+    _add_column(conn, "birthday", "birth_md", "INTEGER")
+    # birth is stored as 'YYYY-MM-DD HH:MM:SS.ffffff'
+    conn.exec_driver_sql("UPDATE birthday SET birth_md = CAST(strftime('%m%d', birth) AS INTEGER) "
+                         "WHERE birth_md IS NULL AND birth IS NOT NULL")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_birthday_user_id ON birthday (user_id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_birthday_user_name ON birthday (user_id, first_name, last_name)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_birthday_birth_md ON birthday (birth_md)")
+
+
+def _upcoming_index(conn: Connection) -> None:
+    """Index the birthdays of a user by day of the year, for the paginated list"""
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_birthday_user_md ON birthday (user_id, birth_md, id)")
+
+
+def _reminder_schedule(conn: Connection) -> None:
+    """Let the users choose the timezone and the time of their reminders"""
+    _add_column(conn, "user", "timezone", "VARCHAR")
+    _add_column(conn, "user", "remind_at", "INTEGER")
+
+
+def _persistence(conn: Connection) -> None:
+    """Store the conversations and the user data of the bot, in place of the pickle file"""
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER NOT NULL,
+            data BLOB,
+            PRIMARY KEY (user_id)
+        )""")
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS conversation (
+            name VARCHAR NOT NULL,
+            "key" VARCHAR NOT NULL,
+            state BLOB,
+            PRIMARY KEY (name, "key")
+        )""")
+
+
+def _reminder_workers(conn: Connection) -> None:
+    """Leases of the shards of users between the reminder workers, and tracking of the schedule changes"""
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS shard_lease (
+            shard INTEGER NOT NULL,
+            owner VARCHAR,
+            expires FLOAT,
+            PRIMARY KEY (shard)
+        )""")
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS worker_heartbeat (
+            owner VARCHAR NOT NULL,
+            expires FLOAT,
+            PRIMARY KEY (owner)
+        )""")
+    _add_column(conn, "user", "schedule_changed", "DATETIME")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_user_schedule_changed ON user (schedule_changed)")
+
+
+def _outbox(conn: Connection) -> None:
+    """Record the planned reminders until they are delivered, and the last day planned for every user"""
+    _add_column(conn, "user", "reminded_on", "DATE")
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER NOT NULL,
+            user_id INTEGER,
+            day DATE,
+            messages TEXT,
+            status INTEGER,
+            done_at DATETIME,
+            PRIMARY KEY (id),
+            UNIQUE (user_id, day),
+            FOREIGN KEY(user_id) REFERENCES user (id)
+        )""")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_outbox_status ON outbox (status)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_outbox_day ON outbox (day)")
+
+
+def _export(conn: Connection) -> None:
+    """Version of the birthdays of every user, and the exports already sent"""
+    _add_column(conn, "user", "birthdays_version", "INTEGER NOT NULL DEFAULT 0")
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS export_file (
+            user_id INTEGER NOT NULL,
+            kind VARCHAR NOT NULL,
+            version INTEGER,
+            file_id VARCHAR,
+            PRIMARY KEY (user_id, kind),
+            FOREIGN KEY(user_id) REFERENCES user (id)
+        )""")
+
+
+# what is indexed for a row of `birthday`, by the triggers and when filling the index: a contentless FTS5 table can only
+# forget a row if it is given the very values that were indexed
+_SEARCH_VALUES = ("{row}.id, 'u' || {row}.user_id, "
+                  "coalesce({row}.first_name, '') || ' ' || coalesce({row}.last_name, '')")
+
+
+def _birthday_search(conn: Connection) -> None:
+    """Full-text index of the names of the birthdays, with the owner as a token, kept in sync by triggers"""
+    conn.exec_driver_sql("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS birthday_search USING fts5(
+            owner, name, content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""")
+    new, old = _SEARCH_VALUES.format(row="new"), _SEARCH_VALUES.format(row="old")
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS birthday_search_insert AFTER INSERT ON birthday BEGIN
+            INSERT INTO birthday_search (rowid, owner, name) VALUES ({new});
+        END""")
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS birthday_search_delete AFTER DELETE ON birthday BEGIN
+            INSERT INTO birthday_search (birthday_search, rowid, owner, name) VALUES ('delete', {old});
+        END""")
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS birthday_search_update AFTER UPDATE OF first_name, last_name, user_id
+        ON birthday BEGIN
+            INSERT INTO birthday_search (birthday_search, rowid, owner, name) VALUES ('delete', {old});
+            INSERT INTO birthday_search (rowid, owner, name) VALUES ({new});
+        END""")
+    conn.exec_driver_sql("INSERT INTO birthday_search (birthday_search) VALUES ('delete-all')")
+    conn.exec_driver_sql("INSERT INTO birthday_search (rowid, owner, name) SELECT "
+                         f"{_SEARCH_VALUES.format(row='birthday')} FROM birthday")
+    conn.exec_driver_sql("INSERT INTO birthday_search (birthday_search) VALUES ('optimize')")
+
+
+MIGRATIONS: list[Callable[[Connection], None]] = [
+    _baseline,
+    _birthday_indexes,
+    _upcoming_index,
+    _reminder_schedule,
+    _persistence,
+    _reminder_workers,
+    _outbox,
+    _export,
+    _birthday_search,
+]
+
+
+def version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def upgrade(engine: Engine) -> int:
+    """Apply all the pending migrations, each one in its own transaction; returns the final version"""
+    with engine.connect() as conn:
+        current = version(conn)
+    for number, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+        logger.info("Applying migration %d: %s", number, migration.__doc__)
+        with engine.begin() as conn:
+            migration(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+    return max(current, len(MIGRATIONS))
+
+
+if __name__ == "__main__":
+    from database import get_engine
+    from logconfig import setup_logging
+
+    setup_logging()
+    print("Database at version", upgrade(get_engine()))
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import collections
+import datetime
+import json
+import logging
+import time
+from typing import Callable, Collection, Final, TYPE_CHECKING
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from dataTypes import TelegramUser, OutboxMessage
+from database import run_db
+from planner import plan_reminders, ReminderPlan, USER_BATCH
+from messages import Delivery, OutgoingMessage
+
+if TYPE_CHECKING:
+    from sender import Broadcaster
+
+logger = logging.getLogger(__name__)
+
+# a delivery is claimed (SENDING) before it is sent and marked done right after: one interrupted by a crash is left
+# SENDING, not sent again, it may be lost but is never received twice
+PENDING, SENT, FAILED, SENDING = 0, 1, 2, 3
+KEEP_DAYS: Final = 30  # how long the delivered reminders are kept
+
+
+def _unplanned(session: Session, day: datetime.date, user_ids: list[int]) -> list[int]:
+    """The users whose reminders of `day` were not planned yet"""
+    result = []
+    for i in range(0, len(user_ids), USER_BATCH):
+        result += session.scalars(select(TelegramUser.id).where(
+            TelegramUser.id.in_(user_ids[i:i + USER_BATCH]),
+            or_(TelegramUser.reminded_on.is_(None), TelegramUser.reminded_on < day),
+        )).all()
+    return result
+
+
+def _deliveries(rows) -> list[Delivery]:
+    return [Delivery(user_id, [OutgoingMessage(*m) for m in json.loads(messages)], key)
+            for key, user_id, messages in rows]
+
+
+def plan_day(session: Session, day: datetime.date, user_ids: Collection[int],
+             render: Callable[[ReminderPlan], list[OutgoingMessage]],
+             plans: dict[int, ReminderPlan] | None = None) -> list[Delivery]:
+    """Plan the reminders of `day` for the users, write them to the outbox and return them
+
+    The users already planned for that day are skipped, and they are marked as planned in the same transaction as
+    the outbox rows are written: planning a day again, e.g. after a restart, does nothing.
+
+    Args:
+        session (Session): Database session
+        day (datetime.date): The local day of the users
+        user_ids (Collection[int]): The users that are due
+        render: Turns a plan into the messages to send
+        plans (dict[int, ReminderPlan] | None): The plans of the users, already read (e.g. from a read-only
+            connection, to keep the writer short); read in this session if None
+
+    Returns:
+        list[Delivery]: The deliveries to send, keyed by outbox id
+    """
+    users = _unplanned(session, day, list(user_ids))
+    if not users:
+        return []
+    if plans is None:
+        plans = plan_reminders(session, day, users)
+    rows = [{"user_id": user_id, "day": day, "status": PENDING,
+             "messages": json.dumps([list(m) for m in render(plans[user_id])])}
+            for user_id in users if user_id in plans]
+    for i in range(0, len(rows), USER_BATCH):
+        session.execute(insert(OutboxMessage).values(rows[i:i + USER_BATCH])
+                        .on_conflict_do_nothing(index_elements=[OutboxMessage.user_id, OutboxMessage.day]))
+    deliveries = []
+    for i in range(0, len(users), USER_BATCH):
+        batch = users[i:i + USER_BATCH]
+        session.execute(update(TelegramUser).where(TelegramUser.id.in_(batch)).values(reminded_on=day))
+        deliveries += _deliveries(session.execute(
+            select(OutboxMessage.id, OutboxMessage.user_id, OutboxMessage.messages)
+            .where(OutboxMessage.day == day, OutboxMessage.user_id.in_(batch), OutboxMessage.status == PENDING)))
+    return deliveries
+
+
+def pending(session: Session, shards: int = 1, owned: Collection[int] | None = None) -> list[Delivery]:
+    """The reminders planned but not delivered yet, oldest first, optionally only of the users of some shards"""
+    query = select(OutboxMessage.id, OutboxMessage.user_id, OutboxMessage.messages) \
+        .where(OutboxMessage.status == PENDING).order_by(OutboxMessage.day, OutboxMessage.id)
+    if owned is not None:
+        query = query.where((OutboxMessage.user_id % shards).in_(list(owned)))
+    return _deliveries(session.execute(query))
+
+
+def _claim(session: Session, key: int) -> bool:
+    """Whether the delivery was still pending and is now ours to send, atomically"""
+    return session.execute(update(OutboxMessage).where(OutboxMessage.id == key, OutboxMessage.status == PENDING)
+                           .values(status=SENDING)).rowcount == 1
+
+
+def _mark(session: Session, key: int, ok: bool) -> None:
+    session.execute(update(OutboxMessage).where(OutboxMessage.id == key)
+                    .values(status=SENT if ok else FAILED, done_at=datetime.datetime.now()))
+
+
+def prune(session: Session, keep_days: int = KEEP_DAYS) -> int:
+    """Delete the delivered reminders older than `keep_days` days; returns how many were deleted"""
+    before = datetime.date.today() - datetime.timedelta(days=keep_days)
+    return session.execute(delete(OutboxMessage).where(OutboxMessage.day < before,
+                                                       OutboxMessage.status != PENDING)).rowcount
+
+
+class DeliveryGuard:
+    """The deliveries a reminder worker may start: those of the shards it owns, as long as its leases are valid
+
+    It also counts, per shard, the deliveries started and not recorded in the outbox yet: a shard is handed over to
+    another worker only when it has none, so that the new owner does not find them still being sent.
+    """
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self.owned: set[int] = set()
+        self.valid_until = 0.0
+        self._unrecorded: collections.Counter = collections.Counter()
+
+    def owns(self, delivery: Delivery) -> bool:
+        return delivery.chat_id % self.shards in self.owned and time.time() < self.valid_until
+
+    def busy(self, shard: int) -> bool:
+        """Whether deliveries of the shard were started and not recorded yet"""
+        return self._unrecorded[shard] > 0
+
+    def started(self, delivery: Delivery) -> None:
+        self._unrecorded[delivery.chat_id % self.shards] += 1
+
+    def recorded(self, deliveries: list[Delivery]) -> None:
+        for delivery in deliveries:
+            shard = delivery.chat_id % self.shards
+            self._unrecorded[shard] -= 1
+            if self._unrecorded[shard] <= 0:
+                del self._unrecorded[shard]
+
+
+async def deliver(sender: Broadcaster, deliveries: list[Delivery], guard: DeliveryGuard | None = None) -> None:
+    """Send outbox deliveries, each one claimed in the outbox before it is sent and marked sent (or failed) after
+
+    A delivery claimed by someone else meanwhile (another worker, a resume) is skipped. With a `guard`, the
+    deliveries of the shards that are not owned any more are left pending for their new owner.
+    """
+    if not deliveries:
+        return
+    started: dict[int, Delivery] = {}  # by key, until recorded
+
+    async def on_start(delivery: Delivery) -> bool:
+        # checked when the sender is about to send it, not when the list was read
+        if guard is not None:
+            if not guard.owns(delivery):
+                return False
+            guard.started(delivery)
+        started[delivery.key] = delivery
+        claimed = False
+        try:
+            claimed = await run_db(_claim, delivery.key)
+        finally:
+            if not claimed:
+                done(delivery)
+        return claimed
+
+    async def on_done(delivery: Delivery, ok: bool) -> None:
+        try:
+            await run_db(_mark, delivery.key, ok)
+        finally:
+            done(delivery)
+
+    def done(delivery: Delivery) -> None:
+        del started[delivery.key]
+        if guard is not None:
+            guard.recorded([delivery])
+
+    try:
+        await sender.broadcast(deliveries, on_done, on_start)
+    finally:
+        if guard is not None and started:  # never done (cancelled, unexpected errors): left SENDING
+            guard.recorded(list(started.values()))
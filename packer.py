@@ -0,0 +1,126 @@
+"""Packing of long texts into as few Telegram messages as possible
+
+The lines are put in a message until the next one would not fit in MAX_MESSAGE characters, a line is never split
+unless it is longer than a whole message on its own. The texts are in Telegram's (legacy) Markdown: an entity that
+is still open where a message ends, a pre block spanning several lines or a bold in a line that had to be split, is
+closed there and opened again at the start of the next message, so each message parses on its own. The other
+entities do not continue past their line, a marker left alone on its line is not one and is never closed.
+"""
+from __future__ import annotations
+
+from typing import Final, Iterable
+
+MAX_MESSAGE: Final = 4096  # characters, as counted by Telegram (UTF-16 code units)
+_MARKERS: Final = "*_`"
+_PRE: Final = "```"
+
+
+def size(text: str) -> int:
+    """The length of the text as Telegram counts it: characters outside the BMP, like most emoji, count twice"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def escape_markdown(text: str) -> str:
+    """Make text typed by a user (a name) appear as it is, outside of an entity"""
+    for marker in "\\_*`[":
+        text = text.replace(marker, "\\" + marker)
+    return text
+
+
+def _entity_after(line: str, entity: str | None) -> str | None:
+    """The entity (its marker) open at the end of the line, given the one open at its start"""
+    i = 0
+    while i < len(line):
+        if entity is None:
+            if line[i] == "\\":
+                i += 2
+                continue
+            if line.startswith(_PRE, i):
+                entity = _PRE
+                i += 3
+                continue
+            if line[i] in _MARKERS:
+                entity = line[i]
+        elif entity == _PRE:
+            if line.startswith(_PRE, i):
+                entity = None
+                i += 3
+                continue
+        elif line[i] == entity:
+            entity = None
+        i += 1
+    return entity
+
+
+def _entities(pieces: list[str], entity: str | None) -> list[str | None]:
+    """The entity open at the end of each piece of a line, given the one open at its start"""
+    start, result = entity, []
+    for piece in pieces:
+        entity = _entity_after(piece, entity)
+        result.append(entity)
+    if entity is not None and entity != _PRE:  # never closed on its line: a marker, not an entity
+        for i in range(len(pieces) - 1, -1, -1):
+            result[i] = None
+            if (result[i - 1] if i else start) != entity or entity in pieces[i]:  # where it was opened
+                break
+    return result
+
+
+def _pieces(line: str, limit: int) -> Iterable[str]:
+    """The line, cut on spaces (or anywhere, if there are none) into pieces that fit in a message"""
+    while size(line) > limit:
+        cut = limit
+        while size(line[:cut]) > limit:  # characters counting twice
+            cut -= 1
+        space = line.rfind(" ", 0, cut)
+        if space > 0:
+            cut = space
+        elif cut > 1 and line[cut - 1] == "\\":  # not between a backslash and the marker it escapes
+            cut -= 1
+        yield line[:cut]
+        line = line[cut:].lstrip(" ")
+    yield line
+
+
+def pack(lines: Iterable[str], header: str | None = None, limit: int = MAX_MESSAGE) -> list[str]:
+    """The lines joined in messages as full as possible
+
+    Args:
+        lines (Iterable[str]): The lines of the text, without their newline
+        header (str | None): Goes at the top of the first message, e.g. a title
+        limit (int): The longest a message can be
+
+    Returns:
+        list[str]: The messages, none of them longer than `limit`
+    """
+    messages: list[str] = []
+    current: list[str] = []
+    used = 0  # size of the current message, its newlines included
+    entity: str | None = None  # open at the end of the current message
+    room = limit - 2 * len(_PRE) - 1  # what a line can take, leaving room to close and reopen an entity
+    if header is not None:
+        lines = [header, *lines]
+    for line in lines:
+        pieces = list(_pieces(line, room))
+        for piece, closing in zip(pieces, _entities(pieces, entity)):
+            length = size(piece) + (1 if current else 0)
+            if current and used + length + (len(closing) if closing else 0) > limit:
+                if entity is not None:
+                    current[-1] += entity
+                messages.append("\n".join(current))
+                current = [entity] if entity is not None else []
+                used = len(entity) if entity is not None else 0
+                length = size(piece)
+                if current:
+                    current[0] += piece  # the reopening marker is not a line of its own
+                    used += length
+                    entity = closing
+                    continue
+            current.append(piece)
+            used += length
+            entity = closing
+    if current:
+        if entity is not None:
+            current[-1] += entity
+        messages.append("\n".join(current))
+    return messages
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from telegram.ext import BasePersistence, PersistenceInput
+
+from dataTypes import UserData, ConversationState
+from database import run_db
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH: int = 500  # rows per statement, keeps clear of SQLite's bound parameters limit
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _load_user_data(session: Session, user_id: int) -> bytes | None:
+    return session.scalar(select(UserData.data).where(UserData.user_id == user_id))
+
+
+def _load_conversations(session: Session, name: str) -> list[tuple[str, bytes]]:
+    return session.execute(select(ConversationState.key, ConversationState.state)
+                           .where(ConversationState.name == name)).all()
+
+
+def _store(session: Session, users: dict[int, bytes | None], conversations: dict[tuple, bytes | None]) -> None:
+    """Write the changed rows, a None value deletes the row"""
+    rows = [{"user_id": user_id, "data": data} for user_id, data in users.items() if data is not None]
+    for i in range(0, len(rows), WRITE_BATCH):
+        statement = insert(UserData).values(rows[i:i + WRITE_BATCH])
+        session.execute(statement.on_conflict_do_update(index_elements=[UserData.user_id],
+                                                        set_={"data": statement.excluded.data}))
+    dropped = [user_id for user_id, data in users.items() if data is None]
+    if dropped:
+        session.execute(delete(UserData).where(UserData.user_id.in_(dropped)))
+    for (name, key), state in conversations.items():
+        if state is None:
+            session.execute(delete(ConversationState).where(ConversationState.name == name,
+                                                            ConversationState.key == key))
+        else:
+            statement = insert(ConversationState).values(name=name, key=key, state=state)
+            session.execute(statement.on_conflict_do_update(index_elements=[ConversationState.name,
+                                                                            ConversationState.key],
+                                                            set_={"state": statement.excluded.state}))
+
+
+class SQLitePersistence(BasePersistence):
+    """Stores the conversations and the `user_data` in the bot database, one row per user
+
+    Unlike PicklePersistence, which rewrites every user on each flush, only the users whose data actually changed
+    are written, and all the writes of a persistence run go in a single transaction. The `user_data` of a user is
+    loaded on the first update of that user, so the startup doesn't depend on how many users the bot ever had;
+    the conversations are loaded at startup, but only the ongoing ones are stored.
+
+    Chat data, bot data and callback data are not used by the bot and are not stored.
+
+    Args:
+        update_interval (float): Seconds between two runs of the persistence, see BasePersistence
+    """
+
+    def __init__(self, update_interval: float = 60):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+                         update_interval=update_interval)
+        self._loaded: set[int] = set()  # users whose data was looked up already
+        self._digests: dict[int, bytes] = {}  # digest of the stored data, to skip the users with no changes
+        self._users: dict[int, bytes | None] = {}
+        self._conversations: dict[tuple, bytes | None] = {}
+        self._writing: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    async def _write_soon(self) -> None:
+        # the application updates every user with a separate call, all at once: let them queue up
+        await asyncio.sleep(0)
+        self._writing = None
+        users, self._users = self._users, {}
+        conversations, self._conversations = self._conversations, {}
+        if not users and not conversations:
+            return
+        async with self._lock:  # keep the writes in order
+            try:
+                await run_db(_store, users, conversations)
+            except Exception:
+                for user_id, data in users.items():  # try again next time, unless there is something newer
+                    self._users.setdefault(user_id, data)
+                for key, state in conversations.items():
+                    self._conversations.setdefault(key, state)
+                raise
+
+    async def _write(self) -> None:
+        if self._writing is None:
+            self._writing = asyncio.create_task(self._write_soon())
+        await asyncio.shield(self._writing)
+
+    async def get_user_data(self) -> dict[int, dict]:
+        return {}  # loaded lazily, see refresh_user_data
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        data = await run_db(_load_user_data, user_id)
+        if data is not None:
+            self._digests[user_id] = _digest(data)
+            for key, value in pickle.loads(data).items():
+                user_data.setdefault(key, value)  # what a handler may have set in the meantime wins
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        pickled = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = _digest(pickled)
+        if self._digests.get(user_id) == digest:
+            return
+        self._digests[user_id] = digest
+        self._users[user_id] = pickled
+        await self._write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._digests.pop(user_id, None)
+        self._users[user_id] = None
+        await self._write()
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await run_db(_load_conversations, name)
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        self._conversations[name, json.dumps(key)] = None if new_state is None \
+            else pickle.dumps(new_state, protocol=pickle.HIGHEST_PROTOCOL)
+        await self._write()
+
+    async def flush(self) -> None:
+        if self._writing is not None:
+            await asyncio.shield(self._writing)
+
+    # not stored
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
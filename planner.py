@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import calendar
+import datetime
+from typing import Collection, NamedTuple
+
+from sqlalchemy import and_, or_, true
+from sqlalchemy.orm import Session
+
+from dataTypes import TelegramUser, Birthday
+
+MONTHLY, WEEKLY, DAILY = "monthly", "weekly", "daily"
+USER_BATCH: int = 500  # users per query when planning a subset of the users
+
+
+class PlannedBirthday(NamedTuple):
+    first_name: str
+    last_name: str
+    birth: datetime.datetime
+
+
+class ReminderPlan(NamedTuple):
+    """What a single user has to receive today"""
+    user_id: int
+    kind: str
+    birthdays: list[PlannedBirthday]
+    day: datetime.date  # the day planned, the ages are computed from it
+
+
+def md_key(day: datetime.date) -> int:
+    """The month-day key of a date, as stored in Birthday.birth_md"""
+    return day.month * 100 + day.day
+
+
+def _end_key(day: datetime.date) -> int:
+    # the birthdays of the 29th of February are celebrated on the 28th in the other years
+    if day.month == 2 and day.day == 28 and not calendar.isleap(day.year):
+        return 229
+    return md_key(day)
+
+
+def md_ranges(start: datetime.date, days: int) -> list[tuple[int, int]]:
+    """The month-day key ranges covering `days` consecutive days starting from `start`
+
+    A window that wraps over New Year is split in two ranges, so that both are index range scans.
+    """
+    end = start + datetime.timedelta(days=days - 1)
+    if end.year == start.year:
+        return [(md_key(start), _end_key(end))]
+    return [(md_key(start), 1231), (101, _end_key(end))]
+
+
+def _collect(plans: dict[int, ReminderPlan], session: Session, today: datetime.date, kind: str, user_filter,
+             ranges: list[tuple[int, int]]) -> None:
+    """Run a single query for all the users that get a reminder of the given kind, and group the rows per user"""
+    md = Birthday.birth_md
+    rows = session.query(Birthday.user_id, Birthday.first_name, Birthday.last_name, Birthday.birth) \
+        .join(TelegramUser, TelegramUser.id == Birthday.user_id) \
+        .filter(user_filter, or_(*(md.between(low, high) for low, high in ranges))) \
+        .order_by(Birthday.user_id, md < ranges[0][0], md) \
+        .all()
+    # birthdays after New Year come after the ones of this year
+    for user_id, first_name, last_name, birth in rows:
+        plan = plans.get(user_id)
+        if plan is None:
+            plan = plans[user_id] = ReminderPlan(user_id, kind, [], today)
+        plan.birthdays.append(PlannedBirthday(first_name, last_name, birth))
+
+
+def plan_reminders(session: Session, today: datetime.date,
+                   user_ids: Collection[int] | None = None) -> dict[int, ReminderPlan]:
+    """Plan all the reminders of a day with one query per reminder kind, instead of scanning every user
+
+    Every user gets at most one reminder per day: the monthly one on the first day of the month, otherwise the weekly
+    one on mondays, otherwise the daily one. Users without matching birthdays are not part of the plan.
+
+    Args:
+        session (Session): Database session
+        today (datetime.date): The day to plan
+        user_ids (Collection[int] | None): Only plan these users, all of them if None
+
+    Returns:
+        dict[int, ReminderPlan]: The plan of every user that has something to receive, by user id
+    """
+    if user_ids is not None:
+        # keep the number of bound parameters of a query well below SQLite's limit
+        ids = list(user_ids)
+        plans: dict[int, ReminderPlan] = {}
+        for i in range(0, len(ids), USER_BATCH):
+            plans.update(_plan(session, today, TelegramUser.id.in_(ids[i:i + USER_BATCH])))
+        return plans
+    return _plan(session, today, true())
+
+
+def _plan(session: Session, today: datetime.date, users) -> dict[int, ReminderPlan]:
+    plans: dict[int, ReminderPlan] = {}
+    is_monthly = today.day == 1
+    is_weekly = today.weekday() == 0
+    monthly = TelegramUser.monthly.is_(True)
+    weekly = TelegramUser.weekly.is_(True)
+    daily = TelegramUser.dailiy.is_(True)
+
+    if is_monthly:
+        month = [(today.month * 100 + 1, today.month * 100 + 31)]
+        _collect(plans, session, today, MONTHLY, and_(users, monthly), month)
+    if is_weekly:
+        # users with the monthly reminder already got this week's birthdays today
+        weekly_filter = and_(users, weekly, monthly.isnot(True)) if is_monthly else and_(users, weekly)
+        _collect(plans, session, today, WEEKLY, weekly_filter, md_ranges(today, 7))
+    # daily reminders go to whoever did not get a monthly or weekly one
+    daily_filter = and_(users, daily)
+    if is_monthly:
+        daily_filter = and_(daily_filter, monthly.isnot(True))
+    if is_weekly:
+        daily_filter = and_(daily_filter, weekly.isnot(True))
+    _collect(plans, session, today, DAILY, daily_filter, md_ranges(today, 1))
+    return plans
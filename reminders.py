@@ -0,0 +1,60 @@
+"""The reminders: what is sent to a user when birthdays are due, and the run that plans and sends them
+
+Used both by the bot (REMINDERS=local) and by the reminder workers, without the Telegram handler stack.
+"""
+from __future__ import annotations
+
+import datetime
+from typing import Final, TYPE_CHECKING
+
+import metrics
+import outbox
+from database import run_db, run_read
+from dates import occurrences
+from planner import plan_reminders, ReminderPlan, MONTHLY, WEEKLY, DAILY
+from messages import OutgoingMessage
+from packer import pack, escape_markdown
+
+if TYPE_CHECKING:
+    from sender import Broadcaster
+
+
+REPORT_HEADERS: Final = {
+    MONTHLY: "*Birthdays in this month*\n",
+    WEEKLY: "*Birthdays in this week*\n",
+    DAILY: "*Birthdays today*\n",
+}
+
+
+def render_plan(plan: ReminderPlan) -> list[str]:
+    """Format the birthdays of a reminder plan, header included, in as few Markdown messages as possible"""
+    unit = "years" if plan.kind == MONTHLY else "anni"
+    lines = [f"{escape_markdown(b.first_name)} {escape_markdown(b.last_name)} - "
+             f"{b.birth.day}/{b.birth.month}/{b.birth.year}, {when.age} {unit}"
+             for b, when in zip(plan.birthdays, occurrences([b.birth for b in plan.birthdays], plan.day))]
+    return pack(lines, header=REPORT_HEADERS[plan.kind])
+
+
+def plan_messages(plan: ReminderPlan) -> list[OutgoingMessage]:
+    """The messages of a reminder plan"""
+    return [OutgoingMessage(m, "Markdown") for m in render_plan(plan)]
+
+
+async def report(sender: Broadcaster, due: list[tuple[int, datetime.date]],
+                 guard: outbox.DeliveryGuard | None = None):
+    """Send the reminders of the users that are due, for their local day
+
+    The reminders go through the outbox: a day that was already planned for a user is not planned again, and what
+    was planned but not delivered is resumed at the next start. A reminder worker passes its `guard`, to stop
+    sending the reminders of the shards it gives up (see outbox.deliver).
+    """
+    by_day: dict[datetime.date, list[int]] = {}
+    for user_id, day in due:
+        by_day.setdefault(day, []).append(user_id)
+    with metrics.REMINDER_RUN_SECONDS.time():
+        for day, user_ids in sorted(by_day.items()):  # the days being caught up, in order
+            # only the users with a birthday to be reminded of are part of the plan; the birthdays are read on a
+            # read-only connection, the writer only records the plan
+            plans = await run_read(plan_reminders, day, user_ids)
+            deliveries = await run_db(outbox.plan_day, day, user_ids, plan_messages, plans)
+            await outbox.deliver(sender, deliveries, guard)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from typing import Callable, Iterable
+
+from telegram import Update
+from telegram.ext import BaseHandler
+
+
+class ButtonRouter(BaseHandler):
+    """Routes the text messages sent by the keyboards with a single dictionary lookup
+
+    The bot used to register a `MessageHandler(filters.Regex(...))` per button, so every message was matched against
+    each regex in turn. Here the exact label of a button, or the prefix of a command with an argument such as
+    `/view_bd_<id>`, is the key of a dict: the cost of routing an update does not depend on how many buttons exist.
+    """
+
+    def __init__(self, block: bool = True):
+        super().__init__(self._dispatch, block=block)
+        self.labels: dict[str, Callable] = {}
+        self.prefixes: dict[str, Callable] = {}
+
+    def add(self, label: str, callback: Callable) -> None:
+        """Route the messages that are exactly `label` to `callback`"""
+        if label in self.labels:
+            raise ValueError(f"{label!r} is already routed")
+        self.labels[label] = callback
+
+    def add_prefix(self, prefix: str, callback: Callable) -> None:
+        """Route the messages made of `prefix` and a numeric id (e.g. `/view_bd_` for `/view_bd_42`) to `callback`
+
+        The prefix must end with the `_` separating it from the id.
+        """
+        if not prefix.endswith("_"):
+            raise ValueError("The prefix must end with '_'")
+        self.prefixes[prefix] = callback
+
+    def wrap_callbacks(self, wrapper: Callable[[Callable], Callable]) -> None:
+        """Replace every routed callback with `wrapper(callback)`"""
+        for routes in (self.labels, self.prefixes):
+            for key, callback in routes.items():
+                if not hasattr(callback, "__wrapped__"):
+                    routes[key] = wrapper(callback)
+
+    @property
+    def routes(self) -> Iterable[str]:
+        return [*self.labels, *self.prefixes]
+
+    def check_update(self, update: object) -> Callable | None:
+        if not isinstance(update, Update) or update.message is None or not update.message.text:
+            return None
+        text = update.message.text
+        callback = self.labels.get(text)
+        if callback is not None:
+            return callback
+        head, sep, tail = text.rpartition("_")
+        if sep and tail.isdecimal():
+            return self.prefixes.get(head + sep)
+        return None
+
+    async def handle_update(self, update: Update, application, check_result: Callable, context):
+        self.collect_additional_context(context, update, application, check_result)
+        return await check_result(update, context)
+
+    async def _dispatch(self, update: Update, context) -> None:
+        # only called if the router is used as a plain callback, the routed callbacks are called by handle_update
+        callback = self.check_update(update)
+        if callback is not None:
+            await callback(update, context)
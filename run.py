@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Entry points of the bot, each one importing only what it needs
+
+    python run.py bot           # the Telegram bot, as python main.py
+    python run.py reminders     # a reminder worker, as python workers.py
+    python run.py maintenance   # migrations and cleanup, as python maintenance.py
+
+The reminder workers and the maintenance never import the handlers of the bot nor the telegram.ext stack, and
+the database engine is only created when first used. benchmarks/bench_startup.py measures the startup cost of each.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+
+from logconfig import setup_logging
+
+
+def bot() -> None:
+    import main
+
+    main.main()
+
+
+def reminders() -> None:
+    from workers import run_worker
+
+    setup_logging()
+    asyncio.run(run_worker())
+
+
+def maintenance() -> None:
+    from maintenance import run_maintenance
+
+    setup_logging()
+    logging.getLogger(__name__).info("Maintenance done: %s", run_maintenance())
+
+
+ENTRY_POINTS = {"bot": bot, "reminders": reminders, "maintenance": maintenance}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("entry_point", choices=ENTRY_POINTS)
+    ENTRY_POINTS[parser.parse_args().entry_point]()
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import heapq
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Final
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE: Final = os.getenv("DEFAULT_TIMEZONE", "Europe/Rome")
+# users that did not choose a time get theirs spread over the first REMIND_SPREAD minutes after midnight
+REMIND_SPREAD: Final = int(os.getenv("REMIND_SPREAD", "60"))
+# the reminders missed while the bot was down are sent when it is back, for up to this many days
+CATCH_UP_DAYS: Final = int(os.getenv("CATCH_UP_DAYS", "7"))
+
+
+def zone(name: str | None) -> ZoneInfo:
+    """The timezone with the given name, or the default one if it is not valid"""
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def is_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def remind_minute(user_id: int, remind_at: int | None) -> int:
+    """Minutes after local midnight at which the user gets the reminders"""
+    if remind_at is not None:
+        return remind_at
+    return user_id % REMIND_SPREAD if REMIND_SPREAD > 0 else 0
+
+
+def next_fire(user_id: int, timezone: str | None, remind_at: int | None, after: float,
+              not_before: datetime.date | None = None) -> tuple[float, datetime.date]:
+    """The next time the user has to get the reminders
+
+    Args:
+        user_id (int): The user
+        timezone (str | None): The user's timezone name
+        remind_at (int | None): The user's chosen minute of the day
+        after (float): Unix time, the result is strictly after it
+        not_before (datetime.date | None): The first local day that can be reminded (to avoid reminding a day twice)
+
+    Returns:
+        tuple[float, datetime.date]: Unix time of the reminder, and the local day it is for
+    """
+    tz = zone(timezone)
+    minute = remind_minute(user_id, remind_at)
+    day = datetime.datetime.fromtimestamp(after, tz).date()
+    if not_before is not None and not_before > day:
+        day = not_before
+    while True:
+        fire = datetime.datetime.combine(day, datetime.time(minute // 60, minute % 60), tz).timestamp()
+        if fire > after:
+            return fire, day
+        day += datetime.timedelta(days=1)
+
+
+class ReminderScheduler:
+    """Keeps the next reminder time of every user in a heap, and fires them on the running event loop
+
+    Rescheduling a user pushes a new entry and bumps the user's version, the old entry is skipped when it surfaces
+    (lazy deletion), so every change costs O(log n). Users that are due at the same time are fired together.
+
+    Args:
+        fire: Coroutine called with the list of (user_id, local day) that are due
+    """
+
+    def __init__(self, fire: Callable[[list[tuple[int, datetime.date]]], Awaitable[None]]):
+        self.fire = fire
+        self._heap: list[tuple[float, int, int, datetime.date]] = []  # (when, user_id, version, local day)
+        self._settings: dict[int, tuple[str | None, int | None, int]] = {}  # user_id: (timezone, remind_at, version)
+        self._reminded: dict[int, datetime.date] = {}  # last local day reminded, per user
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._firing: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._settings)
+
+    def __iter__(self):
+        """The scheduled user ids"""
+        return iter(list(self._settings))
+
+    def load(self, users) -> None:
+        """Schedule many users at once, from an iterable of (user_id, timezone, remind_at, reminded_on); O(n)
+
+        `reminded_on` is the last local day the user was reminded of; the days missed since then (at most
+        CATCH_UP_DAYS) are due right away. Users never reminded start from the next reminder time.
+        """
+        now = time.time()
+        catch_up = now - CATCH_UP_DAYS * 86400
+        for user_id, timezone, remind_at, reminded_on in users:
+            version = self._settings.get(user_id, (None, None, 0))[2] + 1
+            self._settings[user_id] = (timezone, remind_at, version)
+            if reminded_on is None:
+                when, day = next_fire(user_id, timezone, remind_at, now)
+            else:
+                self._reminded[user_id] = reminded_on
+                when, day = next_fire(user_id, timezone, remind_at, catch_up, reminded_on + datetime.timedelta(days=1))
+            self._heap.append((when, user_id, version, day))
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def schedule(self, user_id: int, timezone: str | None, remind_at: int | None) -> None:
+        """Schedule a user, or reschedule it after a change of its settings"""
+        version = self._settings.get(user_id, (None, None, 0))[2] + 1
+        self._settings[user_id] = (timezone, remind_at, version)
+        reminded = self._reminded.get(user_id)
+        when, day = next_fire(user_id, timezone, remind_at, time.time(),
+                              reminded + datetime.timedelta(days=1) if reminded else None)
+        heapq.heappush(self._heap, (when, user_id, version, day))
+        if self._heap[0][1] == user_id:  # the sleeping loop must wake up earlier
+            self._wakeup.set()
+        self._compact()
+
+    def unschedule(self, user_id: int) -> None:
+        self._settings.pop(user_id, None)
+
+    def _compact(self) -> None:
+        """Drop the stale entries when they are the majority of the heap"""
+        if len(self._heap) > 2 * len(self._settings) + 64:
+            self._heap = [e for e in self._heap if self._settings.get(e[1], (None, None, -1))[2] == e[2]]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self, now: float) -> list[tuple[int, datetime.date]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, user_id, version, day = heapq.heappop(self._heap)
+            settings = self._settings.get(user_id)
+            if settings is None or settings[2] != version:
+                continue  # rescheduled or removed meanwhile
+            due.append((user_id, day))
+            self._reminded[user_id] = day
+            # the next one is tomorrow, local time
+            timezone, remind_at, _ = settings
+            next_when, next_day = next_fire(user_id, timezone, remind_at, when, day + datetime.timedelta(days=1))
+            heapq.heappush(self._heap, (next_when, user_id, version, next_day))
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = self._pop_due(time.time())
+            if due:
+                # a large batch takes a while to send, meanwhile the next users must not wait
+                task = asyncio.create_task(self._fire(due))
+                self._firing.add(task)
+                task.add_done_callback(self._firing.discard)
+
+    async def _fire(self, due: list[tuple[int, datetime.date]]) -> None:
+        try:
+            await self.fire(due)
+        except Exception:
+            logger.exception("Error while sending the reminders of %d users", len(due))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        tasks = list(self._firing)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
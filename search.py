@@ -0,0 +1,141 @@
+"""Search of the birthdays of a user by name, for /find
+
+The names are indexed in `birthday_search`, an FTS5 table kept in sync with `birthday` by triggers (see
+migrations), where the owner of every birthday is a token of its own: a search reads the postings of that user and
+of the words typed, never the whole table. The results come in tiers: the names containing all the words typed,
+then the names with words starting with them, then, if there are still too few, the names that are close to them
+(typos) among the ones sharing their first letters.
+"""
+from __future__ import annotations
+
+import difflib
+import re
+import unicodedata
+from typing import Final
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from dataTypes import Birthday
+
+SEARCH_LIMIT: Final = 20
+FUZZY_PREFIX: Final = 2  # letters a name word must share with a typed word to be a fuzzy candidate
+FUZZY_CANDIDATES: Final = 5000  # names compared at most, per search
+FUZZY_CUTOFF: Final = 0.7  # how similar (0 to 1) the words must be
+
+_WORD = re.compile(r"\w+")
+# the shortest names first: for "mar", Marco before Mariangela
+_SEARCH = text("""
+    SELECT birthday.* FROM birthday_search JOIN birthday ON birthday.id = birthday_search.rowid
+    WHERE birthday_search MATCH :expression
+    ORDER BY length(birthday.first_name) + length(coalesce(birthday.last_name, '')), birthday.first_name,
+        birthday.last_name, birthday.id
+    LIMIT :limit""")
+_CANDIDATES = text("""
+    SELECT birthday.id, birthday.first_name, birthday.last_name FROM birthday_search
+    JOIN birthday ON birthday.id = birthday_search.rowid
+    WHERE birthday_search MATCH :expression LIMIT :limit""")
+
+
+def normalize(value: str) -> str:
+    """Lowercase and without diacritics, as the index sees the names"""
+    if value.isascii():
+        return value.lower()
+    decomposed = unicodedata.normalize("NFKD", value.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def words(query: str) -> list[str]:
+    """The words of a search, normalized; what is not a letter or a digit separates them"""
+    return _WORD.findall(normalize(query))
+
+
+def match_expression(user_id: int, terms: list[str], prefix: bool = False, any_term: bool = False) -> str:
+    """The FTS5 query for the birthdays of the user whose name has the terms (or one of them, with `any_term`)"""
+    star = "*" if prefix else ""
+    joined = (" OR " if any_term else " AND ").join(f'"{term}"{star}' for term in terms)
+    return f"owner:u{int(user_id)} AND name:({joined})"
+
+
+class _Similarity:
+    """How close names are to the words typed: for each of them the most similar word of the name, on average
+
+    The names of a user share most of their words, the similarity of a pair of words is computed once per search.
+    """
+
+    def __init__(self, typed: list[str]):
+        self.matchers = [difflib.SequenceMatcher(None, "", word) for word in typed]  # the typed word is indexed once
+        self.pairs: dict[tuple[str, str], float] = {}
+
+    def _pair(self, matcher: difflib.SequenceMatcher, candidate: str) -> float:
+        typed = matcher.b
+        # the ratio is at most 2 * shortest / total length, most pairs are ruled out without comparing them
+        if 2 * min(len(typed), len(candidate)) < FUZZY_CUTOFF * (len(typed) + len(candidate)):
+            return 0.0
+        matcher.set_seq1(candidate)
+        return matcher.ratio() if matcher.quick_ratio() >= FUZZY_CUTOFF else 0.0
+
+    def __call__(self, name: str) -> float:
+        name_words = words(name)
+        if not name_words:
+            return 0.0
+        total = 0.0
+        for matcher in self.matchers:
+            best = 0.0
+            for candidate in name_words:
+                key = (matcher.b, candidate)
+                score = self.pairs.get(key)
+                if score is None:
+                    score = self.pairs[key] = self._pair(matcher, candidate)
+                best = max(best, score)
+            total += best
+        return total / len(self.matchers)
+
+
+def _fuzzy(session: Session, user_id: int, typed: list[str], limit: int, found: set[int]) -> list[int]:
+    prefixes = sorted({word[:FUZZY_PREFIX] for word in typed})
+    rows = session.execute(_CANDIDATES, {"expression": match_expression(user_id, prefixes, prefix=True, any_term=True),
+                                         "limit": FUZZY_CANDIDATES})
+    similarity = _Similarity(typed)
+    scored = []
+    for birthday_id, first_name, last_name in rows:
+        if birthday_id in found:
+            continue
+        name = f"{first_name or ''} {last_name or ''}"
+        score = similarity(name)
+        if score >= FUZZY_CUTOFF:
+            scored.append((-score, len(name), birthday_id))
+    return [birthday_id for _, _, birthday_id in sorted(scored)[:limit]]
+
+
+def search_birthdays(session: Session, user_id: int, query: str, limit: int = SEARCH_LIMIT) -> list[Birthday]:
+    """The birthdays of the user matching the search, best matches first
+
+    Args:
+        session (Session): Database session
+        user_id (int): The owner of the birthdays
+        query (str): What the user typed, one or more (parts of) names
+        limit (int): How many results at most
+
+    Returns:
+        list[Birthday]: The whole words first, then the prefixes, then the similar names
+    """
+    typed = words(query)
+    if not typed:
+        return []
+    results: list[Birthday] = []
+    found: set[int] = set()
+    for prefix in (False, True):
+        if len(results) >= limit:
+            break
+        expression = match_expression(user_id, typed, prefix=prefix)
+        for b in session.scalars(select(Birthday).from_statement(_SEARCH),
+                                 {"expression": expression, "limit": limit + len(found)}):
+            if b.id not in found and len(results) < limit:
+                found.add(b.id)
+                results.append(b)
+    if len(results) < limit:
+        ids = _fuzzy(session, user_id, typed, limit - len(results), found)
+        by_id = {b.id: b for b in session.scalars(select(Birthday).where(Birthday.id.in_(ids)))} if ids else {}
+        results += [by_id[i] for i in ids if i in by_id]
+    return results
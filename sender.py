@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Iterable
+
+from telegram.error import RetryAfter, TimedOut, NetworkError, Forbidden, BadRequest
+
+import metrics
+from messages import Delivery, OutgoingMessage
+
+logger = logging.getLogger(__name__)
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+GLOBAL_RATE: float = 30  # messages per second, for the whole bot
+PER_CHAT_RATE: float = 1  # messages per second, for a single chat
+CHAT_SWEEP_EVERY: int = 10_000  # chat buckets looked up between two removals of the idle ones
+
+
+class BroadcastStats:
+    def __init__(self):
+        self.deliveries = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0  # how many times Telegram answered with a RetryAfter
+        self.throttle_wait = 0.0  # seconds spent waiting on our own token buckets
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Messages sent per second"""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return (f"<BroadcastStats(deliveries={self.deliveries}, sent={self.sent}, failed={self.failed}, "
+                f"retries={self.retries}, rate_limited={self.rate_limited}, throttle_wait={self.throttle_wait:.2f}s, "
+                f"elapsed={self.elapsed:.2f}s, throughput={self.throughput:.1f}/s)>")
+
+
+class TokenBucket:
+    """Asynchronous token bucket, `rate` tokens per second with bursts of up to `capacity` tokens
+
+    A rate of 0 or less disables the limit.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token, and return how many seconds to wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        # a negative balance is a reservation of a future token
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    async def acquire(self) -> float:
+        """Wait for a token, returns the time waited"""
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class Broadcaster:
+    """Sends many deliveries concurrently, respecting the global and per-chat limits of the Bot API
+
+    Args:
+        bot: The telegram Bot (anything with an async `send_message`)
+        workers (int): How many deliveries are in flight at the same time
+        global_rate (float): Maximum messages per second for the whole bot, 0 for no limit
+        per_chat_rate (float): Maximum messages per second for a single chat, 0 for no limit
+        max_retries (int): How many times a message is retried on network errors before giving up
+        max_flood_waits (int): How many times a message waits for Telegram's flood control (RetryAfter) before giving
+            up, apart from `max_retries`: being asked to wait is not a failure
+    """
+
+    def __init__(self, bot, workers: int = 32, global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 max_retries: int = 5, max_flood_waits: int = 20):
+        self.bot = bot
+        self.workers = workers
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.max_flood_waits = max_flood_waits
+        self.bucket = TokenBucket(global_rate, capacity=max(1.0, global_rate))
+        # by chat, shared by the deliveries running at the same time (regular, resumed, caught up) to the same chat
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._lookups = 0
+        self._paused_until = 0.0  # set when Telegram asks to back off, honoured by every worker
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        self._lookups += 1
+        if self._lookups % CHAT_SWEEP_EVERY == 0:
+            self._sweep_chats()
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def _sweep_chats(self) -> None:
+        # a bucket that has refilled is the same as a new one, a broadcast to many chats does not keep them all
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, b in self._chat_buckets.items()
+                        if b.tokens + (now - b.updated) * b.rate >= b.capacity]:
+            del self._chat_buckets[chat_id]
+
+    async def _wait_pause(self) -> None:
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _send(self, chat_id: int, message: OutgoingMessage, chat_bucket: TokenBucket,
+                    stats: BroadcastStats) -> bool:
+        attempt = flood_waits = 0
+        while attempt <= self.max_retries and flood_waits <= self.max_flood_waits:
+            await self._wait_pause()
+            waited = await chat_bucket.acquire() + await self.bucket.acquire()
+            stats.throttle_wait += waited
+            metrics.THROTTLE_SECONDS.inc(waited)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=message.text, parse_mode=message.parse_mode)
+                return True
+            except RetryAfter as e:
+                # flood control is applied to the whole bot, so everyone slows down
+                stats.rate_limited += 1
+                metrics.RATE_LIMITED.inc()
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") \
+                    else float(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                flood_waits += 1
+            except (Forbidden, BadRequest) as e:  # blocked by the user, chat not found, ...: retrying is pointless
+                logger.info("Could not deliver to %s: %s", chat_id, e)
+                return False
+            except (TimedOut, NetworkError) as e:
+                # exponential backoff with jitter
+                delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.debug("Network error while sending to %s (%s), retrying in %.1fs", chat_id, e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+            stats.retries += 1
+        logger.warning("Giving up sending to %s after %d network errors and %d flood waits", chat_id, attempt,
+                       flood_waits)
+        return False
+
+    async def _worker(self, queue: asyncio.Queue, stats: BroadcastStats, on_done, on_start) -> None:
+        while True:
+            delivery = await queue.get()
+            if delivery is None:
+                return
+            try:
+                if on_start is not None and not await on_start(delivery):
+                    continue
+                chat_bucket = self._chat_bucket(delivery.chat_id)
+                ok = True
+                for message in delivery.messages:
+                    if await self._send(delivery.chat_id, message, chat_bucket, stats):
+                        stats.sent += 1
+                        metrics.MESSAGES_SENT.inc()
+                    else:
+                        stats.failed += 1
+                        metrics.MESSAGES_FAILED.inc()
+                        ok = False
+                        break  # do not send the rest of a reminder if its beginning is missing
+                stats.deliveries += 1
+                if on_done is not None:
+                    await on_done(delivery, ok)
+            except Exception:
+                logger.exception("Unexpected error while delivering to %s", delivery.chat_id)
+            finally:
+                queue.task_done()
+
+    async def broadcast(self, deliveries: Iterable[Delivery],
+                        on_done: Callable[[Delivery, bool], Awaitable[None]] | None = None,
+                        on_start: Callable[[Delivery], Awaitable[bool]] | None = None) -> BroadcastStats:
+        """Send all the deliveries and wait for them to be done
+
+        `deliveries` is consumed lazily, so it can be a generator over a very large plan. `on_start` is awaited
+        before each delivery, which is skipped if it returns False, and `on_done` after it, with whether all its
+        messages were sent.
+        """
+        stats = BroadcastStats()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        tasks = [asyncio.create_task(self._worker(queue, stats, on_done, on_start)) for _ in range(self.workers)]
+        try:
+            for delivery in deliveries:
+                await queue.put(delivery)
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        stats.elapsed = time.monotonic() - stats.started
+        logger.info("Broadcast done: %r", stats)
+        return stats
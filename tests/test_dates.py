@@ -0,0 +1,49 @@
+import datetime
+import unittest
+
+from dates import FutureDate, InvalidDate, celebrated_on, occurrence, parse_birth_date
+
+
+class OccurrenceTest(unittest.TestCase):
+    def test_next_birthday(self):
+        birth = datetime.date(1990, 3, 10)
+        self.assertEqual(occurrence(birth, datetime.date(2024, 3, 10))[::3], (0, 34))  # on the day
+        self.assertEqual(occurrence(birth, datetime.date(2024, 3, 9))[::3], (1, 33))
+        self.assertEqual(occurrence(birth, datetime.date(2024, 3, 11))[::3], (364, 34))  # 2025 is not leap
+
+    def test_leap_day(self):
+        birth = datetime.date(2000, 2, 29)
+        self.assertEqual(occurrence(birth, datetime.date(2023, 2, 28))[::3], (0, 23))  # celebrated on the 28th
+        self.assertEqual(occurrence(birth, datetime.date(2023, 2, 27))[::3], (1, 22))
+        self.assertEqual(occurrence(birth, datetime.date(2024, 2, 28))[::3], (1, 23))  # a leap year has the 29th
+        self.assertEqual(occurrence(birth, datetime.date(2024, 2, 29))[::3], (0, 24))
+        self.assertEqual(occurrence(birth, datetime.date(2023, 3, 1)).days, 365)  # the 29th of February 2024
+        self.assertEqual(occurrence(birth, datetime.date(2024, 3, 1)).days, 364)  # the 28th of February 2025
+
+    def test_celebrated_on(self):
+        self.assertEqual(celebrated_on(2023, 2, 29), datetime.date(2023, 2, 28))
+        self.assertEqual(celebrated_on(2024, 2, 29), datetime.date(2024, 2, 29))
+
+
+class ParseTest(unittest.TestCase):
+    now = datetime.datetime(2024, 6, 1)
+
+    def test_valid(self):
+        self.assertEqual(parse_birth_date(" 29/02/2000 ", now=self.now), datetime.datetime(2000, 2, 29))
+
+    def test_invalid(self):
+        for text in ("29/02/2001", "1990-02-01", "", "31/04/1990"):
+            with self.assertRaises(InvalidDate, msg=text):
+                parse_birth_date(text, now=self.now)
+
+    def test_future(self):
+        with self.assertRaises(FutureDate):
+            parse_birth_date("02/06/2024", now=self.now)
+
+    def test_formats(self):
+        self.assertEqual(parse_birth_date("1990-02-01", ("%d/%m/%Y", "%Y-%m-%d"), now=self.now),
+                         datetime.datetime(1990, 2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import datetime
+import io
+import os
+import tempfile
+import unittest
+
+# before the modules reading it are imported (the importer), the test modules share the first one
+os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+from export import write_csv, write_ics  # noqa: E402
+from importer import iter_csv  # noqa: E402
+
+STAMP = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+
+
+def ics(rows: list[tuple]) -> str:
+    file = io.StringIO(newline="")
+    write_ics(iter(rows), file, STAMP)
+    return file.getvalue()
+
+
+def unfolded(text: str) -> list[str]:
+    return text.replace("\r\n ", "").split("\r\n")
+
+
+class IcsTest(unittest.TestCase):
+    def test_event(self):
+        lines = unfolded(ics([(7, "Ann", "Lee", datetime.datetime(1990, 2, 1))]))
+        self.assertIn("DTSTART;VALUE=DATE:19900201", lines)
+        self.assertIn("RRULE:FREQ=YEARLY", lines)
+        self.assertIn("UID:birthday-7@birthdaybot", lines)
+        self.assertIn("SUMMARY:🎂 Ann Lee", lines)
+        self.assertEqual(lines[-2:], ["END:VCALENDAR", ""])
+
+    def test_leap_day(self):
+        # every year on the last day of February, not only in the leap years
+        lines = unfolded(ics([(1, "Lea", "", datetime.datetime(2000, 2, 29))]))
+        self.assertIn("DTSTART;VALUE=DATE:20000229", lines)
+        self.assertIn("RRULE:FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=-1", lines)
+
+    def test_escaped(self):
+        lines = unfolded(ics([(1, "Bob", "Smith, Jr; \\", datetime.datetime(1985, 3, 12))]))
+        self.assertIn("SUMMARY:🎂 Bob Smith\\, Jr\\; \\\\", lines)
+
+    def test_folding(self):
+        name = "Åsa " + "Ölçüm" * 30  # multi-byte characters around the fold
+        text = ics([(1, name, "", datetime.datetime(1985, 3, 12))])
+        for line in text.split("\r\n"):
+            self.assertLessEqual(len(line.encode()), 75)
+        self.assertIn("SUMMARY:🎂 " + name, unfolded(text))
+
+
+class CsvTest(unittest.TestCase):
+    def test_read_back(self):
+        file = io.StringIO(newline="")
+        count = write_csv(iter([(1, "Ann", "Lee", datetime.datetime(1990, 2, 1)),
+                                (2, "Bob", None, datetime.datetime(2000, 2, 29))]), file)
+        self.assertEqual(count, 2)
+        file.seek(0)
+        self.assertEqual([entry[1:] for entry in iter_csv(file)],
+                         [("Ann", "Lee", "1990-02-01"), ("Bob", "", "2000-02-29")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import unittest
+
+import httpserver
+from httpserver import serve
+from webhook import webhook_handler
+
+
+class FakeApplication:
+    def __init__(self):
+        self.bot = None
+        self.update_processor = None
+        self.update_queue: asyncio.Queue = asyncio.Queue()
+
+
+class ServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.application = FakeApplication()
+        handler = webhook_handler(self.application, "/hook", None)
+        self.server = await serve(handler, "127.0.0.1", 0, timeout=0.2)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def request(self, data: bytes) -> bytes:
+        """Send raw bytes, returns the status line, or b"" if the connection was closed without an answer"""
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        try:
+            writer.write(data)
+            await writer.drain()
+            return (await reader.readline()).strip()
+        finally:
+            writer.close()
+
+    async def post(self, body: bytes, headers: str = "") -> bytes:
+        return await self.request(f"POST /hook HTTP/1.1\r\nContent-Length: {len(body)}\r\n{headers}\r\n".encode()
+                                  + body)
+
+    async def test_update(self):
+        update = {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}}
+        self.assertEqual(await self.post(json.dumps(update).encode()), b"HTTP/1.1 200 OK")
+        self.assertEqual(self.application.update_queue.qsize(), 1)
+
+    async def test_not_an_update(self):
+        for body in (b"[]", b"1", b'"x"', b"null", b"{"):
+            self.assertEqual(await self.post(body), b"HTTP/1.1 400 Bad Request", body)
+        self.assertEqual(self.application.update_queue.qsize(), 0)
+
+    async def test_content_length(self):
+        for length in ("abc", "-5"):
+            status = await self.request(f"POST /hook HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode())
+            self.assertEqual(status, b"HTTP/1.1 400 Bad Request", length)
+        status = await self.request(f"POST /hook HTTP/1.1\r\nContent-Length: {httpserver.MAX_BODY + 1}\r\n\r\n"
+                                    .encode())
+        self.assertEqual(status, b"HTTP/1.1 413 Payload Too Large")
+
+    async def test_too_many_headers(self):
+        headers = "".join(f"X-{i}: {i}\r\n" for i in range(httpserver.MAX_HEADERS + 1))
+        self.assertEqual(await self.post(b"{}", headers), b"HTTP/1.1 431 Request Header Fields Too Large")
+
+    async def test_headers_too_large(self):
+        headers = "".join(f"X-{i}: {'a' * 1000}\r\n" for i in range(httpserver.MAX_HEADER_BYTES // 1000 + 1))
+        self.assertEqual(await self.post(b"{}", headers), b"HTTP/1.1 431 Request Header Fields Too Large")
+        line = f"X-Long: {'a' * httpserver.MAX_HEADER_BYTES}\r\n"  # over the limit of the reader
+        self.assertEqual(await self.post(b"{}", line), b"HTTP/1.1 431 Request Header Fields Too Large")
+
+    async def test_slow_client_is_disconnected(self):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write(b"POST /hook HTTP/1.1\r\nX-Slow: 1\r\n")  # and never the end of the headers
+        await writer.drain()
+        self.assertEqual(await asyncio.wait_for(reader.read(), 2), b"")  # closed, without an answer
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+
+# before the modules reading it are imported, the test modules share the first one
+os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+from sqlalchemy import delete, event, func, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import database  # noqa: E402
+from dataTypes import Birthday, TelegramUser  # noqa: E402
+from importer import IMPORT_BATCH, Entry, import_birthdays, iter_csv, iter_vcard  # noqa: E402
+from migrations import upgrade  # noqa: E402
+
+USER = 1
+engine = None
+
+
+def setUpModule():
+    global engine
+    upgrade(database.engine)
+    engine = database.make_engine(database.DATABASE_URL, 1)
+
+    @event.listens_for(engine, "connect")
+    def limit(dbapi_connection, connection_record):
+        # the limit of the SQLite versions before 3.32
+        dbapi_connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+
+
+def tearDownModule():
+    engine.dispose()
+
+
+class ImportTest(unittest.TestCase):
+    def setUp(self):
+        self.session = Session(engine)
+        self.session.execute(delete(Birthday).where(Birthday.user_id == USER))
+        self.session.execute(delete(TelegramUser).where(TelegramUser.id == USER))
+        self.session.add(TelegramUser(id=USER))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def names(self) -> list[tuple[str, str]]:
+        return sorted(self.session.execute(select(Birthday.first_name, Birthday.last_name)
+                                           .where(Birthday.user_id == USER)).all())
+
+    def test_duplicates(self):
+        entries = [Entry(1, "Ann", "Lee", "01/02/1990"), Entry(2, "Bob", "", "1985-03-12"),
+                   Entry(3, "Ann", "Lee", "02/02/1990")]  # the same person twice in the file
+        result = import_birthdays(self.session, USER, entries)
+        self.assertEqual((result.added, result.duplicates, result.invalid), (2, 1, 0))
+        result = import_birthdays(self.session, USER, entries + [Entry(4, "Cleo", "X", "01/01/2000")])
+        self.assertEqual((result.added, result.duplicates), (1, 3))  # the ones already there
+        self.assertEqual(self.names(), [("Ann", "Lee"), ("Bob", ""), ("Cleo", "X")])
+
+    def test_full_batches(self):
+        count = IMPORT_BATCH * 2 + 10
+        entries = [Entry(i, f"Name{i}", "Surname", "01/02/1990") for i in range(count)]
+        result = import_birthdays(self.session, USER, entries)
+        self.assertEqual((result.added, result.duplicates), (count, 0))
+        result = import_birthdays(self.session, USER, entries)
+        self.assertEqual((result.added, result.duplicates), (0, count))
+        self.assertEqual(self.session.scalar(select(func.count()).select_from(Birthday)
+                                             .where(Birthday.user_id == USER)), count)
+
+    def test_invalid(self):
+        result = import_birthdays(self.session, USER, [
+            Entry(1, "", "Lee", "01/02/1990"), Entry(2, "Ann", "", "31/02/1990"), Entry(3, "Bob", "", "01/01/2999")])
+        self.assertEqual((result.added, result.invalid), (0, 3))
+        self.assertEqual(len(result.errors), 3)
+
+    def test_files(self):
+        csv = io.StringIO("Name,Surname,Birthday\nAnn,Lee,01/02/1990\n")
+        self.assertEqual(list(iter_csv(csv)), [Entry(2, "Ann", "Lee", "01/02/1990")])
+        vcard = io.StringIO("BEGIN:VCARD\r\nN:Lee;Ann;;;\r\nFN:Ann Lee\r\nBDAY:1990-02-01\r\nEND:VCARD\r\n")
+        self.assertEqual([(e.first_name, e.last_name, e.date) for e in iter_vcard(vcard)],
+                         [("Ann", "Lee", "1990-02-01")])
+
+
+if __name__ == "__main__":
+    unittest.main()
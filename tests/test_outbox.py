@@ -0,0 +1,82 @@
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+# before the modules reading it are imported, the test modules share the first one
+os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+from sqlalchemy import delete, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import database  # noqa: E402
+import outbox  # noqa: E402
+from dataTypes import OutboxMessage  # noqa: E402
+from database import run_db  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from sender import Broadcaster  # noqa: E402
+
+
+def setUpModule():
+    upgrade(database.engine)
+
+
+class FakeBot:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.sent: list[int] = []
+
+    async def send_message(self, chat_id: int, text: str, parse_mode=None) -> None:
+        await asyncio.sleep(self.delay)
+        self.sent.append(chat_id)
+
+
+class OutboxTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        with Session(database.engine) as session:
+            session.execute(delete(OutboxMessage))
+            session.add_all(OutboxMessage(user_id=user_id, day=datetime.date(2024, 2, 29), status=outbox.PENDING,
+                                          messages=json.dumps([["hi", None]])) for user_id in range(1, 21))
+            session.commit()
+
+    def statuses(self) -> dict[int, int]:
+        with Session(database.engine) as session:
+            return dict(session.execute(select(OutboxMessage.user_id, OutboxMessage.status)).all())
+
+    async def test_sent_once_and_recorded(self):
+        bot = FakeBot()
+        await outbox.deliver(Broadcaster(bot, global_rate=0, per_chat_rate=0), await run_db(outbox.pending))
+        self.assertEqual(sorted(bot.sent), list(range(1, 21)))
+        self.assertEqual(set(self.statuses().values()), {outbox.SENT})
+        self.assertEqual(await run_db(outbox.pending), [])
+
+    async def test_delivered_twice_at_once(self):
+        # a resume and a worker taking over, with the same pending rows
+        bot = FakeBot(0.01)
+        sender = Broadcaster(bot, workers=4, global_rate=0, per_chat_rate=0)
+        deliveries = await run_db(outbox.pending)
+        await asyncio.gather(outbox.deliver(sender, deliveries), outbox.deliver(sender, deliveries))
+        self.assertEqual(sorted(bot.sent), list(range(1, 21)))
+
+    async def test_interrupted_not_sent_again(self):
+        bot = FakeBot(0.05)
+        task = asyncio.create_task(outbox.deliver(Broadcaster(bot, workers=4, global_rate=0, per_chat_rate=0),
+                                                  await run_db(outbox.pending)))
+        await asyncio.sleep(0.12)
+        task.cancel()  # a crash while sending
+        await asyncio.gather(task, return_exceptions=True)
+        first = list(bot.sent)
+        await outbox.deliver(Broadcaster(bot, global_rate=0, per_chat_rate=0), await run_db(outbox.pending))
+        self.assertEqual(len(bot.sent), len(set(bot.sent)))  # nothing received twice
+        statuses = self.statuses()
+        interrupted = {user_id for user_id, status in statuses.items() if status == outbox.SENDING}
+        self.assertTrue(interrupted)
+        self.assertEqual(set(statuses.values()), {outbox.SENT, outbox.SENDING})
+        # the interrupted ones are not sent again, they were sent before the crash or never
+        self.assertEqual(set(bot.sent) - set(first), set(statuses) - interrupted - set(first))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from packer import pack, size
+
+
+def balanced(message: str) -> bool:
+    """Whether every entity of the (legacy) Markdown message is closed, the escaped markers aside"""
+    message = message.replace("```", "\0")
+    for marker in "\0*_`":
+        count, i = 0, 0
+        while i < len(message):
+            if message[i] == "\\":
+                i += 2
+                continue
+            count += message[i] == marker
+            i += 1
+        if count % 2:
+            return False
+    return True
+
+
+class PackTest(unittest.TestCase):
+    def test_joined(self):
+        self.assertEqual(pack(["a", "b"], header="*Title*"), ["*Title*\na\nb"])
+
+    def test_lone_underscore(self):
+        # not an entity: nothing is carried to the next line nor added at the end
+        self.assertEqual(pack(["a_b c", "d"]), ["a_b c\nd"])
+        self.assertEqual(pack(["*a", "b"], limit=10), ["*a\nb"])
+
+    def test_escaped_markers(self):
+        lines = [r"Ann\_Lee \*1990\*", r"\`x\`"]
+        self.assertEqual(pack(lines), ["\n".join(lines)])
+        for message in pack([r"a\_b" * 20], limit=12):
+            self.assertTrue(balanced(message), message)
+            self.assertFalse(message.endswith("\\"), message)
+
+    def test_split_bold(self):
+        line = "*" + "word " * 30 + "end*"
+        messages = pack([line, "next"], limit=40)
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertLessEqual(size(message), 40)
+            self.assertTrue(message.startswith("*"), message)
+            self.assertTrue(balanced(message), message)
+        self.assertTrue(messages[-1].endswith("end*\nnext"))
+
+    def test_split_italic_after_bold(self):
+        messages = pack(["*a* _" + "x " * 40 + "y_"], limit=30)
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertTrue(balanced(message), message)
+        self.assertTrue(all(message.startswith("_") for message in messages[1:]))
+
+    def test_split_pre_block(self):
+        lines = ["```", *(f"line {i}" for i in range(20)), "```"]
+        messages = pack(lines, limit=50)
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertLessEqual(size(message), 50)
+            self.assertTrue(balanced(message), message)
+        self.assertEqual("".join(messages).replace("```", "").replace("\n", ""),
+                         "".join(f"line {i}" for i in range(20)))
+
+    def test_wide_characters(self):
+        for message in pack(["🎂" * 100], limit=50):
+            self.assertLessEqual(size(message), 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
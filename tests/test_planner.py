@@ -0,0 +1,82 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+# before the modules reading it are imported, the test modules share the first one
+os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+from sqlalchemy import delete  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import database  # noqa: E402
+from dataTypes import Birthday, TelegramUser  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from planner import DAILY, MONTHLY, WEEKLY, md_ranges, plan_reminders  # noqa: E402
+
+MONTHLY_USER, WEEKLY_USER, DAILY_USER = 101, 102, 103
+USERS = (MONTHLY_USER, WEEKLY_USER, DAILY_USER)
+BIRTHDAYS = ("28/02/1990", "29/02/2000", "01/03/1985", "31/12/1970", "02/01/1980", "15/07/1995", "02/07/1999")
+
+
+def setUpModule():
+    upgrade(database.engine)
+    with Session(database.engine) as session:
+        session.execute(delete(Birthday).where(Birthday.user_id.in_(USERS)))
+        session.execute(delete(TelegramUser).where(TelegramUser.id.in_(USERS)))
+        for user_id, flags in ((MONTHLY_USER, (True, True, True)), (WEEKLY_USER, (False, True, True)),
+                               (DAILY_USER, (False, False, True))):
+            session.add(TelegramUser(id=user_id, monthly=flags[0], weekly=flags[1], dailiy=flags[2]))
+            session.add_all(Birthday(user_id=user_id, first_name=f"N{i}", last_name="",
+                                     birth=datetime.datetime.strptime(date, "%d/%m/%Y"))
+                            for i, date in enumerate(BIRTHDAYS))
+        session.commit()
+
+
+def plan(day: datetime.date) -> dict[int, tuple[str, list[str]]]:
+    """The kind of reminder and the birthdays (dd/mm) of every user, in the order they are listed"""
+    with Session(database.engine) as session:
+        plans = plan_reminders(session, day, USERS)
+    return {user_id: (p.kind, [b.birth.strftime("%d/%m") for b in p.birthdays]) for user_id, p in plans.items()}
+
+
+class RangesTest(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual(md_ranges(datetime.date(2024, 7, 1), 7), [(701, 707)])
+        self.assertEqual(md_ranges(datetime.date(2024, 12, 30), 7), [(1230, 1231), (101, 105)])  # over New Year
+
+    def test_leap_day(self):
+        self.assertEqual(md_ranges(datetime.date(2023, 2, 28), 1), [(228, 229)])  # the 29th celebrated on the 28th
+        self.assertEqual(md_ranges(datetime.date(2024, 2, 28), 1), [(228, 228)])
+        self.assertEqual(md_ranges(datetime.date(2023, 2, 22), 7), [(222, 229)])
+
+
+class PlanTest(unittest.TestCase):
+    def test_daily_leap_day(self):
+        self.assertEqual(plan(datetime.date(2023, 2, 28)), {
+            user_id: (DAILY, ["28/02", "29/02"]) for user_id in USERS})  # a tuesday
+        self.assertEqual(plan(datetime.date(2024, 2, 28)), {user_id: (DAILY, ["28/02"]) for user_id in USERS})
+        self.assertEqual(plan(datetime.date(2024, 2, 29)), {user_id: (DAILY, ["29/02"]) for user_id in USERS})
+
+    def test_weekly_over_new_year(self):
+        plans = plan(datetime.date(2024, 12, 30))  # a monday
+        self.assertEqual(plans[MONTHLY_USER], (WEEKLY, ["31/12", "02/01"]))  # this year's first
+        self.assertEqual(plans[WEEKLY_USER], (WEEKLY, ["31/12", "02/01"]))
+        self.assertNotIn(DAILY_USER, plans)  # nobody's birthday on the 30th
+
+    def test_weekly_over_leap_day(self):
+        plans = plan(datetime.date(2023, 2, 27))  # a monday, the 29th is celebrated on the 28th
+        self.assertEqual(plans[WEEKLY_USER], (WEEKLY, ["28/02", "29/02", "01/03"]))
+
+    def test_one_reminder_a_day(self):
+        plans = plan(datetime.date(2024, 7, 1))  # a monday and the first of the month
+        self.assertEqual(plans[MONTHLY_USER], (MONTHLY, ["02/07", "15/07"]))
+        self.assertEqual(plans[WEEKLY_USER], (WEEKLY, ["02/07"]))
+        self.assertNotIn(DAILY_USER, plans)
+
+    def test_nothing_due(self):
+        self.assertEqual(plan(datetime.date(2024, 7, 3)), {})  # a wednesday
+
+
+if __name__ == "__main__":
+    unittest.main()
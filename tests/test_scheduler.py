@@ -0,0 +1,78 @@
+import datetime
+import time
+import unittest
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+import scheduler
+from scheduler import ReminderScheduler, next_fire, remind_minute
+
+ROME = ZoneInfo("Europe/Rome")
+
+
+def at(*args, tz=ROME) -> float:
+    return datetime.datetime(*args, tzinfo=tz).timestamp()
+
+
+async def fire(due):
+    pass
+
+
+class NextFireTest(unittest.TestCase):
+    def test_chosen_time(self):
+        self.assertEqual(next_fire(1, "Europe/Rome", 8 * 60, at(2024, 7, 1, 7, 0)),
+                         (at(2024, 7, 1, 8, 0), datetime.date(2024, 7, 1)))
+        self.assertEqual(next_fire(1, "Europe/Rome", 8 * 60, at(2024, 7, 1, 8, 0)),  # strictly after
+                         (at(2024, 7, 2, 8, 0), datetime.date(2024, 7, 2)))
+
+    def test_local_day(self):
+        tokyo = ZoneInfo("Asia/Tokyo")
+        when, day = next_fire(1, "Asia/Tokyo", 0, at(2024, 7, 1, 20, 0))  # already the 2nd in Tokyo
+        self.assertEqual((when, day), (at(2024, 7, 3, 0, 0, tz=tokyo), datetime.date(2024, 7, 3)))
+
+    def test_daylight_saving(self):
+        # 8:00 local on both sides of the change, 23 hours apart
+        first, _ = next_fire(1, "Europe/Rome", 8 * 60, at(2024, 3, 30, 9, 0))
+        self.assertEqual(first - at(2024, 3, 30, 8, 0), 23 * 3600)
+
+    def test_not_before(self):
+        self.assertEqual(next_fire(1, None, 0, at(2024, 7, 1, 7, 0), datetime.date(2024, 7, 5))[1],
+                         datetime.date(2024, 7, 5))
+
+    def test_invalid_timezone(self):
+        self.assertEqual(next_fire(1, "Bad/Zone", 60, at(2024, 7, 1, 0, 0)), next_fire(1, None, 60, at(2024, 7, 1)))
+
+    def test_spread(self):
+        self.assertEqual(remind_minute(7, None), 7 % scheduler.REMIND_SPREAD)
+        self.assertEqual(remind_minute(7, 90), 90)
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_catch_up(self):
+        now = at(2024, 7, 10, 12, 0)
+        s = ReminderScheduler(fire)
+        with mock.patch("scheduler.time.time", return_value=now):
+            s.load([(1, None, 0, datetime.date(2024, 7, 7)),  # missed the 8th, 9th and 10th
+                    (2, None, 0, datetime.date(2024, 6, 1)),  # at most CATCH_UP_DAYS
+                    (3, None, 0, None)])  # never reminded: from tomorrow
+        due = s._pop_due(now)
+        self.assertEqual(sorted(d for u, d in due if u == 1),
+                         [datetime.date(2024, 7, d) for d in (8, 9, 10)])
+        self.assertEqual(min(d for u, d in due if u == 2),
+                         datetime.date(2024, 7, 10) - datetime.timedelta(days=scheduler.CATCH_UP_DAYS - 1))
+        self.assertNotIn(3, [u for u, _ in due])
+        self.assertEqual(s._pop_due(now), [])  # each day once
+
+    def test_reschedule(self):
+        s = ReminderScheduler(fire)
+        s.load([(1, None, 0, None)])
+        s.schedule(1, "Asia/Tokyo", 60)  # the old entry is skipped
+        due = s._pop_due(time.time() + 2 * 86400)
+        self.assertEqual(len(due), len({d for _, d in due}))
+        s.unschedule(1)
+        self.assertEqual(s._pop_due(time.time() + 10 * 86400), [])
+        self.assertEqual(len(s), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
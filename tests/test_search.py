@@ -0,0 +1,65 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+# before the modules reading it are imported, the test modules share the first one
+os.environ.setdefault("DATABASE_URL", "sqlite+pysqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+from sqlalchemy import delete  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import database  # noqa: E402
+from dataTypes import Birthday, TelegramUser  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from search import search_birthdays, words  # noqa: E402
+
+USER, OTHER = 201, 202
+NAMES = (("Marco", "Rossi"), ("Mariangela", "Bianchi"), ("José", "Núñez"), ("Anna", "Maria Verdi"),
+         ("Giovanni", "Esposito"))
+
+
+def setUpModule():
+    upgrade(database.engine)
+    with Session(database.engine) as session:
+        session.execute(delete(Birthday).where(Birthday.user_id.in_((USER, OTHER))))
+        session.execute(delete(TelegramUser).where(TelegramUser.id.in_((USER, OTHER))))
+        session.add_all([TelegramUser(id=USER), TelegramUser(id=OTHER)])
+        session.add_all(Birthday(user_id=USER, first_name=first, last_name=last, birth=datetime.datetime(1990, 1, 1))
+                        for first, last in NAMES)
+        session.add(Birthday(user_id=OTHER, first_name="Marco", last_name="Neri", birth=datetime.datetime(1990, 1, 1)))
+        session.commit()
+
+
+def search(query: str) -> list[str]:
+    with Session(database.engine) as session:
+        return [f"{b.first_name} {b.last_name}" for b in search_birthdays(session, USER, query)]
+
+
+class SearchTest(unittest.TestCase):
+    def test_words(self):
+        self.assertEqual(words("  José_Núñez, o'Neil "), ["jose_nunez", "o", "neil"])
+
+    def test_whole_words_then_prefixes(self):
+        self.assertEqual(search("maria"), ["Anna Maria Verdi", "Mariangela Bianchi"])
+        self.assertEqual(search("mar"), ["Marco Rossi", "Anna Maria Verdi", "Mariangela Bianchi"])  # shortest first
+
+    def test_all_words(self):
+        self.assertEqual(search("marco rossi"), ["Marco Rossi"])
+
+    def test_diacritics(self):
+        self.assertEqual(search("jose nunez"), ["José Núñez"])
+        self.assertEqual(search("NÚÑEZ"), ["José Núñez"])
+
+    def test_typos(self):
+        self.assertEqual(search("giovani esposto"), ["Giovanni Esposito"])
+
+    def test_only_own_birthdays(self):
+        self.assertEqual(search("neri"), [])
+
+    def test_nothing_typed(self):
+        self.assertEqual(search(" ,. "), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
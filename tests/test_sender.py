@@ -0,0 +1,45 @@
+import unittest
+from unittest import mock
+
+from telegram.error import RetryAfter, TimedOut
+
+from messages import Delivery, OutgoingMessage
+from sender import Broadcaster
+
+
+class FakeBot:
+    def __init__(self, errors: list[Exception]):
+        self.errors = errors
+        self.sent = 0
+
+    async def send_message(self, chat_id: int, text: str, parse_mode=None) -> None:
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent += 1
+
+
+async def send(bot: FakeBot, **kwargs):
+    broadcaster = Broadcaster(bot, global_rate=0, per_chat_rate=0, **kwargs)
+    return await broadcaster.broadcast([Delivery(1, [OutgoingMessage("hi", None)], 1)])
+
+
+@mock.patch("sender.random.uniform", lambda a, b: 0.001)  # no real backoff
+class RetryTest(unittest.IsolatedAsyncioTestCase):
+    async def test_flood_waits_are_not_failures(self):
+        bot = FakeBot([RetryAfter(0.001) for _ in range(8)])
+        stats = await send(bot, max_retries=2)
+        self.assertEqual((bot.sent, stats.failed, stats.rate_limited), (1, 0, 8))
+
+    async def test_network_errors(self):
+        bot = FakeBot([TimedOut() for _ in range(8)])
+        stats = await send(bot, max_retries=2)
+        self.assertEqual((bot.sent, stats.failed, len(bot.errors)), (0, 1, 5))  # 3 attempts
+
+    async def test_flood_waits_capped(self):
+        bot = FakeBot([RetryAfter(0.001) for _ in range(30)])
+        stats = await send(bot, max_flood_waits=3)
+        self.assertEqual((bot.sent, stats.failed, stats.rate_limited), (0, 1, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Run with `python -m unittest discover tests`"""
+import asyncio
+import time
+import unittest
+
+from telegram import Update
+
+from flood import FloodControl
+from webhook import UserOrderedUpdateProcessor
+
+
+def message(update_id: int, user_id: int, text: str = "hi") -> Update:
+    return Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": text, "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "User"}}}, None)
+
+
+class FakeBot:
+    def __init__(self):
+        self.answered: list[str] = []
+
+    async def answer_callback_query(self, callback_query_id: str, **kwargs) -> bool:
+        self.answered.append(callback_query_id)
+        return True
+
+
+def button(update_id: int, user_id: int, data: str, bot: FakeBot) -> Update:
+    user = {"id": user_id, "is_bot": False, "first_name": "User"}
+    return Update.de_json({"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user, "chat_instance": "1", "data": data}}, bot)
+
+
+class FloodedUserTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tasks: list[asyncio.Task] = []
+
+    async def feed(self, processor: UserOrderedUpdateProcessor, updates: list[Update]) -> dict[int, float]:
+        """Process the updates like the update fetcher of the Application does, returns when each one ran"""
+        handled: dict[int, float] = {}
+
+        async def handle(update: Update) -> None:
+            handled[update.update_id] = time.monotonic()
+
+        for update in updates:
+            if processor.max_concurrent_updates > 1:  # in tasks, that Application.stop waits for
+                self.tasks.append(asyncio.create_task(processor.process_update(update, handle(update))))
+            else:  # awaited in the fetcher itself, as in polling
+                await processor.process_update(update, handle(update))
+        return handled
+
+    async def stop(self, processor: UserOrderedUpdateProcessor) -> None:
+        """What the Application does when it stops (with post_stop of main) and shuts down"""
+        await asyncio.gather(*self.tasks)
+        await processor.drain()
+        await processor.shutdown()
+
+    async def check_other_user_not_delayed(self, concurrency: int) -> None:
+        processor = UserOrderedUpdateProcessor(concurrency, FloodControl(rate=1, burst=2, max_delay=3))
+        started = time.monotonic()
+        flood = [message(i, 1) for i in range(1, 6)]  # two in the burst, three deferred
+        handled = await self.feed(processor, flood + [message(6, 2)])
+        await asyncio.sleep(0.1)
+        self.assertLess(handled[6] - started, 0.5)
+        self.assertEqual(processor.backlog, 3)
+        await self.stop(processor)  # the deferred updates of user 1 are still handled, in order
+        self.assertEqual(sorted(handled, key=handled.get), [1, 2, 6, 3, 4, 5])
+        self.assertEqual(processor.backlog, 0)
+
+    async def test_one_at_a_time(self):
+        await self.check_other_user_not_delayed(1)
+
+    async def test_concurrent(self):
+        await self.check_other_user_not_delayed(8)
+
+    async def test_repeated_button_is_answered(self):
+        bot = FakeBot()
+        processor = UserOrderedUpdateProcessor(1, FloodControl(rate=1, burst=10, max_delay=3))
+        handled = await self.feed(processor, [button(1, 1, "list_page_1", bot), button(2, 1, "list_page_1", bot)])
+        await self.stop(processor)
+        self.assertEqual(list(handled), [1])  # the second press is coalesced, only its spinner is stopped
+        self.assertEqual(bot.answered, ["2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
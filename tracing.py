@@ -0,0 +1,197 @@
+"""Recording of the incoming updates, anonymized, to replay real traffic offline (see benchmarks.replay)
+
+    TRACE_FILE=updates.trace   # append every update received to this file, nothing is recorded if unset
+    TRACE_KEY=...              # the secret the ids are pseudonymized with, random (per process) if unset
+
+The trace has one compact JSON object per line, `{"t": <unix time>, "u": <the update>}`, in the order the updates
+were received, before the flood control. Before being written the updates are anonymized: the ids of users and
+chats are replaced by a keyed hash, the same user always getting the same pseudonym with the same key; the names
+but the first one (replaced by "User") and the usernames are removed; the texts are masked letter by letter,
+except the button labels and the command names, which are what decides the handler, the file names keep only
+their extension and the file ids are pseudonymized too. Punctuation is kept but the digits are not: a date typed (or
+a time of day) is replaced by another one of the same kind, valid and past, in the future or invalid, and the other
+digits by random ones, the same for the same text with the same key.
+
+The updates are converted and written by a background thread, recording costs the event loop a queue put.
+"""
+from __future__ import annotations
+
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Collection, Final, Iterator
+
+from telegram import Update
+
+from dates import DATE_FORMAT, FutureDate, InvalidDate, parse_birth_date
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE: Final = os.getenv("TRACE_FILE") or None
+TRACE_KEY: Final = os.getenv("TRACE_KEY") or None
+
+_PSEUDONYMIZED: Final = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat", "via_bot"}
+_REMOVED: Final = {"username", "last_name", "title", "phone_number", "bio", "invite_link", "contact", "location",
+                   "venue", "photo", "vcard", "forward_sender_name", "author_signature"}
+_TEXTS: Final = {"text", "caption", "query"}
+_FILE_IDS: Final = {"file_id", "file_unique_id"}
+_TIME_FORMAT: Final = "%H:%M"  # as in /time
+_BIRTHS: Final = datetime.date(1930, 1, 1), 90 * 365  # the range of the dates of birth replacing the typed ones
+# always in Message.to_dict, only worth recording when true
+_FLAGS: Final = {"channel_chat_created", "delete_chat_photo", "group_chat_created", "supergroup_chat_created"}
+
+
+def mask(text: str, keep: Collection[str] = (), digits: Iterator[str] | None = None) -> str:
+    """The text with its letters replaced, as long as the original (also for Telegram's UTF-16 entity offsets)
+
+    A text in `keep` (a button label) is kept as it is, and so is the name of a command, only its arguments are
+    masked. The digits are replaced by those taken from `digits`, kept if None.
+    """
+    if text in keep:
+        return text
+    command = ""
+    if text.startswith("/"):
+        command, _, text = text.partition(" ")
+        command += " " if text else ""
+    masked = "".join(("xx" if ord(c) > 0xFFFF else "X" if c.isupper() else "x") if c.isalpha()
+                     else next(digits) if digits is not None and c in "0123456789" else c for c in text)
+    return command + masked
+
+
+class Anonymizer:
+    """Anonymizes the dict of an update, see the module docstring
+
+    Args:
+        key (bytes): The secret of the pseudonyms
+        keep (Collection[str]): The texts kept as they are, the labels of the keyboard buttons
+    """
+
+    def __init__(self, key: bytes, keep: Collection[str] = ()):
+        self.key = key
+        self.keep = set(keep)
+
+    def pseudonym(self, value: int) -> int:
+        """A positive id stays positive, a negative one (a group chat) negative; both fit in 48 bits"""
+        digest = hmac.new(self.key, str(abs(value)).encode(), hashlib.sha256).digest()
+        pseudonym = int.from_bytes(digest[:6], "big") or 1
+        return -pseudonym if value < 0 else pseudonym
+
+    def _digest(self, value: str) -> bytes:
+        return hmac.new(self.key, value.encode(), hashlib.sha256).digest()
+
+    def _digits(self, text: str) -> Iterator[str]:
+        digest = self._digest(text)
+        while True:
+            yield from (str(b % 10) for b in digest)
+            digest = hashlib.sha256(digest).digest()
+
+    def _date(self, text: str) -> str | None:
+        """Another date of the same kind if the text is a date or a time of day, None otherwise"""
+        n = int.from_bytes(self._digest(text)[:8], "big")
+        try:
+            parse_birth_date(text)
+            first, days = _BIRTHS
+            return (first + datetime.timedelta(days=n % days)).strftime(DATE_FORMAT)
+        except FutureDate:
+            return (datetime.date.today() + datetime.timedelta(days=1 + n % 3650)).strftime(DATE_FORMAT)
+        except InvalidDate:
+            pass
+        try:
+            datetime.datetime.strptime(text.strip(), _TIME_FORMAT)
+        except ValueError:
+            return None
+        return f"{n % 24:02}:{n // 24 % 60:02}"
+
+    def text(self, text: str) -> str:
+        """The text masked, see the module docstring"""
+        if text in self.keep:
+            return text
+        command, space, args = text.partition(" ") if text.startswith("/") else ("", "", text)
+        date = self._date(args)
+        if date is not None:
+            return command + space + date
+        return mask(text, self.keep, self._digits(text))
+
+    def __call__(self, data: dict, parent: str | None = None) -> dict:
+        result = {}
+        for key, value in data.items():
+            if key in _REMOVED or (key in _FLAGS and not value):
+                continue
+            if isinstance(value, dict):
+                value = self(value, key)
+            elif isinstance(value, list):
+                value = [self(v, key) if isinstance(v, dict) else v for v in value]
+            elif key == "id" and parent in _PSEUDONYMIZED and isinstance(value, int):
+                value = self.pseudonym(value)
+            elif key == "first_name":
+                value = "User"
+            elif key in _TEXTS and isinstance(value, str):
+                value = self.text(value)
+            elif key in _FILE_IDS and isinstance(value, str):
+                value = self._digest(value)[:12].hex()
+            elif key == "file_name" and isinstance(value, str):
+                value = "file" + os.path.splitext(value)[1]
+            result[key] = value
+        return result
+
+
+class TraceRecorder:
+    """Appends the anonymized updates to a trace file, from a background thread
+
+    Args:
+        path (str): The trace file, created if missing, appended to otherwise
+        keep (Collection[str]): The texts recorded as they are, the labels of the keyboard buttons
+        key (str | bytes | None): The secret of the pseudonyms, random if None: the pseudonyms of two runs differ
+    """
+
+    def __init__(self, path: str, keep: Collection[str] = (), key: str | bytes | None = TRACE_KEY):
+        if key is None:
+            key = os.urandom(16)
+        self.path = path
+        self.anonymize = Anonymizer(key.encode() if isinstance(key, str) else key, keep)
+        self.recorded = 0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def keep(self) -> set[str]:
+        return self.anonymize.keep
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write, name="trace", daemon=True)
+            self._thread.start()
+            logger.info("Recording the updates to %s", self.path)
+
+    def record(self, update: object) -> None:
+        """Queue the update to be written, with the time it was received"""
+        if self._thread is not None and isinstance(update, Update):
+            self._queue.put((time.time(), update))
+
+    def close(self) -> None:
+        """Write what is queued and stop the writer"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def line(self, received: float, update: Update) -> str:
+        return json.dumps({"t": round(received, 3), "u": self.anonymize(update.to_dict())},
+                          ensure_ascii=False, separators=(",", ":"))
+
+    def _write(self) -> None:
+        with open(self.path, "a", encoding="utf-8") as file:
+            while (item := self._queue.get()) is not None:
+                try:
+                    file.write(self.line(*item) + "\n")
+                    self.recorded += 1
+                except Exception:
+                    logger.exception("Could not record an update")
+                if self._queue.empty():  # a burst is written at once
+                    file.flush()
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+import urllib.parse
+
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+from flood import FloodControl, UPDATES_DROPPED
+from tracing import TraceRecorder
+from httpserver import Request, Response, serve
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKLOG: int = 10_000  # updates accepted but not processed yet, above this Telegram is asked to retry later
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes up to `max_concurrent_updates` updates at the same time, but those of a same user one at a time
+
+    The conversations keep their state per user, so two messages of the same user must not be handled
+    concurrently; updates without a user are ordered by chat, if they have one.
+
+    Before taking a slot, every update goes through the flood control, which may defer it or drop it, and updates
+    are dropped as long as `max_backlog` of them are waiting or being processed: a few clients sending too much
+    never reach the handlers nor the database. A dropped callback query is still answered, unless the bot is
+    overloaded. With a `recorder`, every update is recorded as it arrives, the dropped ones too.
+    """
+
+    def __init__(self, max_concurrent_updates: int, flood: FloodControl | None = None,
+                 max_backlog: int = MAX_BACKLOG, recorder: TraceRecorder | None = None):
+        super().__init__(max_concurrent_updates)
+        self.flood = flood
+        self.recorder = recorder
+        self.max_backlog = max_backlog
+        self._locks: dict[int, tuple[asyncio.Lock, int]] = {}  # key: (lock, updates holding or waiting for it)
+        self._tasks: set[asyncio.Task] = set()  # deferred updates, answers to dropped callback queries
+        self.backlog = 0
+
+    @staticmethod
+    def _key(update: object) -> int | None:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    def _admit(self, update: object) -> float | None:
+        """Seconds to wait before processing the update, None to drop it"""
+        if self.backlog >= self.max_backlog:
+            UPDATES_DROPPED.inc(reason="overload")
+            return None
+        key = self._key(update)
+        if key is None or self.flood is None:
+            return 0.0
+        return self.flood.admit(key, update)
+
+    async def process_update(self, update: object, coroutine) -> None:
+        if self.recorder is not None:
+            self.recorder.record(update)
+        wait = self._admit(update)
+        if wait is None:
+            coroutine.close()  # never started
+            logger.debug("Dropped update %s", getattr(update, "update_id", None))
+            if isinstance(update, Update) and update.callback_query is not None and \
+                    self.backlog < self.max_backlog:
+                # the client shows a spinner on the button until the query is answered, dropped or not
+                self._spawn(update.callback_query.answer())
+            return
+        self.backlog += 1  # waiting for a slot or being processed
+        if wait > 0 and self.max_concurrent_updates <= 1:
+            # the caller is the update fetcher itself, which would hold back the updates of every other user while
+            # this one waits: it is deferred in a task of its own instead. The later updates of the user are
+            # deferred longer, so they still come in order
+            self._spawn(self._process(update, coroutine, wait))
+            return
+        # otherwise the caller is already a task of the Application, which waits for it when stopping
+        await self._process(update, coroutine, wait)
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    async def _process(self, update: object, coroutine, wait: float) -> None:
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await super().process_update(update, coroutine)
+        finally:
+            self.backlog -= 1
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:  # nobody awaits it to see the error
+            logger.error("Error in a deferred update or answer", exc_info=task.exception())
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+    async def initialize(self) -> None:
+        if self.recorder is not None:
+            self.recorder.start()
+
+    async def drain(self) -> None:
+        """Wait for the deferred updates and the answers to the dropped ones, to call while the bot is still up"""
+        while self._tasks:  # they are a few seconds away at most
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def shutdown(self) -> None:
+        await self.drain()
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+def webhook_handler(application: Application, path: str, secret: str | None):
+    """The request handler that validates the webhook calls and queues their update"""
+    expected = secret.encode() if secret else None
+
+    async def handle(request: Request) -> Response:
+        if request.path.split("?", 1)[0] != path:
+            return Response(404)
+        if request.method != "POST":
+            return Response(405)
+        if expected is not None:
+            token = request.headers.get("x-telegram-bot-api-secret-token", "").encode()
+            if not hmac.compare_digest(token, expected):
+                return Response(403)
+        if application.update_queue.qsize() + _backlog(application) >= MAX_BACKLOG:
+            return Response(503)  # Telegram delivers it again later
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict):  # valid JSON, but not an update
+                return Response(400)
+            update = Update.de_json(data, application.bot)
+        except (ValueError, TypeError, KeyError):
+            return Response(400)
+        await application.update_queue.put(update)
+        return Response(200)
+
+    return handle
+
+
+def _backlog(application: Application) -> int:
+    processor = application.update_processor
+    return processor.backlog if isinstance(processor, UserOrderedUpdateProcessor) else 0
+
+
+async def serve_webhook(application: Application, host: str, port: int, path: str,
+                        secret: str | None) -> asyncio.Server:
+    """Start the HTTP server receiving the updates from Telegram"""
+    server = await serve(webhook_handler(application, path, secret), host, port)
+    logger.info("Receiving updates on http://%s:%d%s", host, server.sockets[0].getsockname()[1], path)
+    return server
+
+
+async def run_webhook(application: Application, url: str, host: str, port: int, secret: str | None) -> None:
+    """Run the bot receiving the updates through a webhook until SIGINT or SIGTERM
+
+    Mirrors Application.run_polling: initialize, post_init, start, and the reverse on the way out. The webhook is
+    left registered at shutdown, so Telegram keeps the updates until the bot is back.
+
+    Args:
+        application (Application): The bot
+        url (str): The public HTTPS url Telegram calls, its path is the one served locally
+        host (str): Address to bind
+        port (int): Port to bind
+        secret (str | None): Secret token Telegram sends with every call, checked on each request
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    path = urllib.parse.urlsplit(url).path or "/"
+    await application.initialize()
+    try:
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.bot.set_webhook(url=url, secret_token=secret, allowed_updates=Update.ALL_TYPES,
+                                          max_connections=100)
+        server = await serve_webhook(application, host, port, path, secret)
+        await application.start()
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await application.stop()
+            if application.post_stop is not None:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""Reminder workers: the users are split in shards, every worker process sends the reminders of the shards it owns
+
+    REMINDERS=workers python main.py     # the bot, without the reminders
+    python workers.py                    # as many times as needed, on one or more hosts sharing the database
+
+A worker owns a shard as long as it renews its lease in the `shard_lease` table; the leases of a worker that
+stops renewing them (crashed, hung, disconnected) expire and are taken over by the others. The shards are spread
+evenly: a worker owns at most ceil(SHARDS / live workers) of them and releases the extra ones when workers join.
+A shard is released only once the reminders its worker started sending are recorded in the outbox, and no new one
+is started meanwhile: the next owner resumes what is still pending without sending anything twice.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime
+import logging
+import math
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Final
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from telegram import Bot
+
+from dataTypes import ShardLease, WorkerHeartbeat
+from database import run_db, user_schedules
+from logconfig import setup_logging
+from outbox import deliver, pending, DeliveryGuard
+from reminders import report
+from scheduler import ReminderScheduler
+from sender import Broadcaster
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+TOKEN: Final = os.getenv("TOKEN")
+SHARDS: Final = int(os.getenv("SHARDS", "16"))  # changing it requires stopping all the workers
+LEASE_TTL: Final = float(os.getenv("LEASE_TTL", "30"))  # seconds a lease lasts without renewal
+HEARTBEAT: Final = float(os.getenv("HEARTBEAT", "10"))  # seconds between two renewals
+
+
+def shard_of(user_id: int, shards: int = SHARDS) -> int:
+    return user_id % shards
+
+
+def _claim(session: Session, owner: str, shards: int, ttl: float) -> tuple[set[int], set[int]]:
+    """Renew the leases of `owner` and take its fair share of the free or expired ones
+
+    Returns the shards leased and, among them, those over the fair share (someone joined), to be handed over
+    """
+    now = time.time()
+    session.execute(insert(ShardLease).values([{"shard": s, "owner": None, "expires": 0} for s in range(shards)])
+                    .on_conflict_do_nothing(index_elements=[ShardLease.shard]))
+    session.execute(update(ShardLease).where(ShardLease.owner == owner).values(expires=now + ttl))
+    heartbeat = insert(WorkerHeartbeat).values(owner=owner, expires=now + ttl)
+    session.execute(heartbeat.on_conflict_do_update(index_elements=[WorkerHeartbeat.owner],
+                                                    set_={"expires": heartbeat.excluded.expires}))
+    session.execute(delete(WorkerHeartbeat).where(WorkerHeartbeat.expires <= now))
+    alive = session.scalar(select(func.count()).select_from(WorkerHeartbeat))
+    target = math.ceil(shards / alive)
+    leases = session.execute(select(ShardLease.shard, ShardLease.owner, ShardLease.expires)
+                             .where(ShardLease.shard < shards)).all()
+    mine = sorted(lease.shard for lease in leases if lease.owner == owner)
+    surplus = set(mine[target:])
+    mine = set(mine)
+    free = [lease.shard for lease in leases if lease.owner is None or lease.expires <= now]
+    for shard in free[:max(0, target - len(mine))]:
+        # the conditions are checked again: another worker may have been faster
+        claimed = session.execute(update(ShardLease).where(
+            ShardLease.shard == shard, or_(ShardLease.owner.is_(None), ShardLease.expires <= now),
+        ).values(owner=owner, expires=now + ttl))
+        if claimed.rowcount == 1:
+            mine.add(shard)
+    return mine, surplus
+
+
+def _hand_over(session: Session, owner: str, shards: set[int]) -> None:
+    session.execute(update(ShardLease).where(ShardLease.shard.in_(list(shards)), ShardLease.owner == owner)
+                    .values(owner=None, expires=0))
+
+
+def _release(session: Session, owner: str) -> None:
+    session.execute(update(ShardLease).where(ShardLease.owner == owner).values(owner=None, expires=0))
+    session.execute(delete(WorkerHeartbeat).where(WorkerHeartbeat.owner == owner))
+
+
+class ShardWorker:
+    """Keeps the leases of a worker, and a reminder scheduler with the users of the shards it owns
+
+    Args:
+        fire: Coroutine called with the list of (user_id, local day) that are due, as for ReminderScheduler
+        resume: Coroutine called with the shards just claimed, to send what their previous owner left pending
+        shards (int): In how many shards the users are split
+        ttl (float): Seconds a lease lasts without renewal
+        heartbeat (float): Seconds between two renewals, well below `ttl`
+    """
+
+    def __init__(self, fire: Callable[[list[tuple[int, datetime.date]]], Awaitable[None]],
+                 resume: Callable[[set[int]], Awaitable[None]] | None = None, shards: int = SHARDS,
+                 ttl: float = LEASE_TTL, heartbeat: float = HEARTBEAT):
+        self.fire = fire
+        self.resume = resume
+        self.scheduler = ReminderScheduler(self._guarded_fire)
+        self.shards = shards
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.owned: set[int] = set()  # the shards served, the leased ones but those being handed over
+        self.leaving: set[int] = set()
+        self.valid_until = 0.0  # the leases may have been taken over after this time
+        self.guard = DeliveryGuard(shards)  # for the deliveries of the reminders of this worker
+        self._since: datetime.datetime | None = None
+        self._task: asyncio.Task | None = None
+        self._resuming: set[asyncio.Task] = set()
+
+    async def tick(self) -> None:
+        """Renew and claim the leases, and update the scheduler accordingly"""
+        started, changes_since = time.time(), datetime.datetime.now()
+        leased, surplus = await run_db(_claim, self.owner, self.shards, self.ttl)
+        self.valid_until = self.guard.valid_until = started + self.ttl
+        # no delivery of the shards over the fair share starts from now on (nothing is awaited in between), and those
+        # without deliveries started and not recorded yet are handed over; the others at a next tick
+        self.leaving = (self.leaving | surplus) & leased
+        owned = self.guard.owned = leased - self.leaving
+        handover = {shard for shard in self.leaving if not self.guard.busy(shard)}
+        if handover:
+            await run_db(_hand_over, self.owner, handover)
+            self.leaving -= handover
+        if self.leaving:
+            logger.info("Handing over shards %s once their reminders being sent are recorded", sorted(self.leaving))
+        lost, gained = self.owned - owned, owned - self.owned
+        self.owned = owned
+        if lost:
+            logger.info("Lost shards %s", sorted(lost))
+            for user_id in self.scheduler:
+                if shard_of(user_id, self.shards) in lost:
+                    self.scheduler.unschedule(user_id)
+        if gained:
+            logger.info("Claimed shards %s", sorted(gained))
+            self.scheduler.load(await run_db(user_schedules, self.shards, gained))
+            if self.resume is not None:
+                task = asyncio.create_task(self.resume(gained))
+                self._resuming.add(task)
+                task.add_done_callback(self._resuming.discard)
+        if self._since is not None and owned:
+            # new users and changed schedules; the shards just claimed were loaded whole
+            for user_id, timezone, remind_at, _ in await run_db(user_schedules, self.shards, owned - gained,
+                                                                self._since):
+                self.scheduler.schedule(user_id, timezone, remind_at)
+        self._since = changes_since - datetime.timedelta(seconds=1)  # the clocks of the processes may differ
+
+    async def _guarded_fire(self, due: list[tuple[int, datetime.date]]) -> None:
+        """Send only the reminders of the shards that are still owned"""
+        if time.time() > self.valid_until:
+            logger.warning("The leases expired, not sending the reminders of %d users", len(due))
+            return
+        due = [(user_id, day) for user_id, day in due if shard_of(user_id, self.shards) in self.owned]
+        if due:
+            await self.fire(due)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Could not renew the shard leases")
+
+    async def start(self) -> None:
+        await self.tick()
+        self._task = asyncio.create_task(self._run())
+        self.scheduler.start()
+
+    async def stop(self) -> None:
+        """Stop renewing, and release the leases so that the other workers take over right away"""
+        self.guard.owned = set()
+        await self.scheduler.stop()
+        tasks = list(self._resuming)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await run_db(_release, self.owner)
+        self.owned = set()
+
+
+async def run_worker() -> None:
+    """Run a reminder worker until SIGINT or SIGTERM, without the handlers of the bot"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with Bot(TOKEN) as bot:
+        broadcaster = Broadcaster(bot)
+
+        async def resume(shards: set[int]) -> None:
+            await deliver(broadcaster, await run_db(pending, SHARDS, shards), worker.guard)
+
+        worker = ShardWorker(lambda due: report(broadcaster, due, worker.guard), resume)
+        await worker.start()
+        logger.info("Worker %s started", worker.owner)
+        try:
+            await stop.wait()
+        finally:
+            await worker.stop()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(run_worker())